@@ -0,0 +1,68 @@
+import itertools
+import random
+
+from lib import database_utils, identity_map
+from lib.article import Article
+from lib.author import Author
+from lib.magazine import Magazine
+
+# (authors, magazines, articles)
+SCALES = {
+    "tiny": (1_000, 100, 20_000),
+    "small": (10_000, 1_000, 200_000),
+    "medium": (100_000, 10_000, 1_000_000),
+    "large": (100_000, 10_000, 5_000_000),
+}
+
+CATEGORIES = [
+    "Science", "Technology", "Politics", "Business", "Health", "Sport",
+    "Travel", "Culture", "Food", "Design", "Finance", "Education",
+]
+
+# title vocabulary, so full-text search has realistic posting lists
+TOPICS = [
+    "climate", "energy", "markets", "election", "health", "ocean", "space", "design",
+    "startup", "football", "recipes", "travel", "education", "privacy", "cities", "music",
+]
+
+
+def zipf_weights(n, skew):
+    """
+    Cumulative weights for rank-based Zipf sampling: item k has weight 1 / k**skew.
+    """
+    return list(itertools.accumulate(1.0 / (k ** skew) for k in range(1, n + 1)))
+
+
+def generate(db_file, authors, magazines, articles, seed=1, skew=1.1, chunk=10_000):
+    """
+    Build a deterministic dataset in db_file (which should not exist yet).
+    A few prolific authors and popular magazines get most of the articles,
+    following a Zipf distribution with the given skew. Returns row counts.
+    """
+    rng = random.Random(seed)
+    database_utils.configure_pool(db_file=db_file)
+    database_utils.create_tables()
+    # the generator's objects should not crowd the benchmark's identity map
+    identity_map.configure(0)
+
+    author_objs = [Author(f"Author {i}") for i in range(authors)]
+    Author.bulk_create(author_objs)
+    magazine_objs = [Magazine(f"Magazine {i}", rng.choice(CATEGORIES)) for i in range(magazines)]
+    Magazine.bulk_create(magazine_objs)
+
+    author_cum = zipf_weights(authors, skew)
+    magazine_cum = zipf_weights(magazines, skew)
+
+    def article_rows():
+        made = 0
+        while made < articles:
+            n = min(chunk, articles - made)
+            picked_authors = rng.choices(author_objs, cum_weights=author_cum, k=n)
+            picked_magazines = rng.choices(magazine_objs, cum_weights=magazine_cum, k=n)
+            for offset, (a, m) in enumerate(zip(picked_authors, picked_magazines)):
+                yield Article(f"Article {made + offset} on {rng.choice(TOPICS)} and {rng.choice(TOPICS)}", a, m)
+            made += n
+
+    Article.bulk_create(article_rows())
+    identity_map.configure()
+    return {"authors": authors, "magazines": magazines, "articles": articles}
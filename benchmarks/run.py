@@ -0,0 +1,227 @@
+"""
+Benchmark the public model methods against a synthetic dataset.
+
+    python -m benchmarks.run --scale small
+    python -m benchmarks.run --scale tiny --compare benchmarks/results/<commit>.json
+    python -m benchmarks.run --scale small --memory --compare <disk results>.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.datagen import CATEGORIES, SCALES, TOPICS, generate
+from lib import database_utils, identity_map, memory
+from lib.article import Article
+from lib.author import Author
+from lib.magazine import Magazine
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(fn, args_list, cold=False):
+    """
+    Call fn(*args) for every entry of args_list and return latency stats (ms),
+    throughput (ops/s) and the peak traced memory of one extra traced call.
+    """
+    latencies = []
+    for args in args_list:
+        if cold:
+            identity_map.invalidate()
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    if cold:
+        identity_map.invalidate()
+    tracemalloc.start()
+    fn(*args_list[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "calls": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies),
+        "ops_per_s": len(latencies) / (total / 1000) if total else 0.0,
+        "peak_kib": peak / 1024,
+    }
+
+
+def working_copy(db_file):
+    """
+    Copy db_file into a new temp directory and return the copy's path. The
+    write benchmarks run against the copy, so a reused --db dataset is the
+    same for every run.
+    """
+    work = os.path.join(tempfile.mkdtemp(prefix="magazine-bench-"), os.path.basename(db_file))
+    source, target = sqlite3.connect(db_file), sqlite3.connect(work)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return work
+
+
+def benchmarks(counts, iterations, rng):
+    """
+    Return {name: (callable, [args, ...])} covering every public model method.
+    Ids are drawn uniformly, so popular (large) and long-tail entities both show up.
+    """
+    def ids(n):
+        return [rng.randint(1, n) for _ in range(iterations)]
+
+    authors = Author.find_many(ids(counts["authors"]))
+    magazines = Magazine.find_many(ids(counts["magazines"]))
+    one_author, one_magazine = authors[0], magazines[0]
+    titles = iter(range(10 ** 9))
+
+    def update_magazine(m):
+        m.name = f"{m.name.split(' #')[0]} #{next(titles)}"
+        m.save()
+
+    return {
+        "Author.find_by_id": (Author.find_by_id, [(i,) for i in ids(counts["authors"])]),
+        "Magazine.find_by_id": (Magazine.find_by_id, [(i,) for i in ids(counts["magazines"])]),
+        "Article.find_by_id": (Article.find_by_id, [(i,) for i in ids(counts["articles"])]),
+        "Author.articles": (Author.articles, [(a,) for a in authors]),
+        "Author.articles[eager]": (lambda a: a.articles(eager=True), [(a,) for a in authors]),
+        "Author.magazines": (Author.magazines, [(a,) for a in authors]),
+        "Author.topic_areas": (Author.topic_areas, [(a,) for a in authors]),
+        "Magazine.articles": (Magazine.articles, [(m,) for m in magazines]),
+        "Magazine.contributors": (Magazine.contributors, [(m,) for m in magazines]),
+        "Magazine.article_titles": (Magazine.article_titles, [(m,) for m in magazines]),
+        "Magazine.contributing_authors": (Magazine.contributing_authors, [(m,) for m in magazines]),
+        "Magazine.top_publisher": (Magazine.top_publisher, [()] * iterations),
+        "Magazine.top_publishers[10]": (Magazine.top_publishers, [(10,)] * iterations),
+        "Magazine.article_counts[batch]": (Magazine.article_counts, [(magazines,)] * iterations),
+        "Magazine.contributing_authors_for": (Magazine.contributing_authors_for, [(magazines,)] * iterations),
+        "Author.topic_areas_for": (Author.topic_areas_for, [(authors,)] * iterations),
+        "Author.collaborators": (Author.collaborators, [(a,) for a in authors]),
+        "Magazine.related_magazines[10]": (Magazine.related_magazines, [(m, 10) for m in magazines]),
+        "Article.search": (
+            lambda i: Article.search(TOPICS[i % len(TOPICS)], category=CATEGORIES[i % len(CATEGORIES)]),
+            [(i,) for i in range(iterations)],
+        ),
+        "Article.query[where,limit]": (
+            lambda m: list(Article.query().where(magazine=m, author__in=authors[:20]).order_by("-id").limit(50)),
+            [(m,) for m in magazines],
+        ),
+        "Article.query[values]": (
+            lambda m: list(Article.query().where(magazine=m).order_by("-id").limit(50).values("title")),
+            [(m,) for m in magazines],
+        ),
+        "Article.query[count]": (lambda m: Article.query().where(magazine=m).count(), [(m,) for m in magazines]),
+        "Author.save[insert]": (lambda i: Author(f"Bench {i}").save(), [(i,) for i in range(iterations)]),
+        "Magazine.save[update]": (update_magazine, [(m,) for m in magazines]),
+        "Author.add_article": (
+            lambda i: one_author.add_article(one_magazine, f"Bench article {i}"),
+            [(i,) for i in range(iterations)],
+        ),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)["benchmarks"]
+    print(f"\n{'benchmark':34} {'p50 before':>11} {'p50 after':>10} {'change':>8}")
+    for name, stats in results.items():
+        if name in baseline and baseline[name]["p50_ms"]:
+            before, after = baseline[name]["p50_ms"], stats["p50_ms"]
+            print(f"{name:34} {before:10.3f}ms {after:9.3f}ms {100 * (after - before) / before:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="tiny")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for authors/magazines")
+    parser.add_argument("--db", help="dataset file to reuse or create (default: a temp file); runs use a copy")
+    parser.add_argument("--cold", action="store_true", help="clear the identity map before every call")
+    parser.add_argument("--memory", action="store_true", help="serve the dataset from RAM (lib.memory)")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this text")
+    parser.add_argument("--out", help="results JSON path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to diff against")
+    args = parser.parse_args(argv)
+
+    n_authors, n_magazines, n_articles = SCALES[args.scale]
+    counts = {"authors": n_authors, "magazines": n_magazines, "articles": n_articles}
+    db_file = args.db or os.path.join(tempfile.mkdtemp(prefix="magazine-bench-"), f"{args.scale}.db")
+    if os.path.exists(db_file):
+        database_utils.configure_pool(db_file=db_file)
+    else:
+        start = time.perf_counter()
+        generate(db_file, n_authors, n_magazines, n_articles, seed=args.seed, skew=args.skew)
+        print(f"generated {args.scale} dataset in {time.perf_counter() - start:.1f}s -> {db_file}")
+
+    work_file = working_copy(db_file)
+    database_utils.configure_pool(db_file=work_file)
+    if args.memory:
+        memory.enable()
+    rng = random.Random(args.seed)
+    results = {}
+    try:
+        for name, (fn, args_list) in benchmarks(counts, args.iterations, rng).items():
+            if args.only and args.only not in name:
+                continue
+            results[name] = stats = measure(fn, args_list, cold=args.cold)
+            print(f"{name:34} p50 {stats['p50_ms']:8.3f}ms  p99 {stats['p99_ms']:8.3f}ms  "
+                  f"{stats['ops_per_s']:10.0f} ops/s  peak {stats['peak_kib']:9.1f} KiB")
+    finally:
+        # the benchmark writes stay in the working copy, which is thrown away
+        memory.disable(snapshot=False)
+        database_utils.configure_pool(db_file=db_file)
+        shutil.rmtree(os.path.dirname(work_file), ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "scale": args.scale,
+        "counts": counts,
+        "iterations": args.iterations,
+        "cold": args.cold,
+        "memory": args.memory,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "benchmarks": results,
+    }
+    suffix = f"{args.scale}-memory" if args.memory else args.scale
+    out = args.out or os.path.join(os.path.dirname(__file__), "results", f"{commit}-{suffix}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {out}")
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
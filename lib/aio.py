@@ -0,0 +1,146 @@
+import asyncio
+import atexit
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import database_utils
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_CONCURRENCY = 64
+
+
+class _Job:
+    # tracks which connection (if any) is running a call, so it can be interrupted
+    __slots__ = ("conn", "cancelled", "lock")
+
+    def __init__(self):
+        self.conn = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class AsyncExecutor:
+    """
+    Runs blocking model calls on a pool of worker threads that each own a
+    dedicated sqlite3 connection, so coroutines never block the event loop on
+    SQLite I/O. At most max_concurrency calls are queued or running per event
+    loop; cancelling an awaiting task drops a queued call or interrupts the
+    statement a running call is executing.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-async")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # asyncio.Semaphore is tied to the loop it is first used on
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _thread_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.db_file != database_utils.DB_FILE:
+            # the process switched databases (configure_pool); reconnect
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = database_utils.get_pool()._connect()
+            self._local.conn = conn
+            self._local.db_file = database_utils.DB_FILE
+            with self._lock:
+                self._connections.append(conn)
+            database_utils.bind_thread_connection(conn)
+        return conn
+
+    def _call(self, job, fn, args, kwargs):
+        conn = self._thread_connection()
+        with job.lock:
+            if job.cancelled:
+                return None
+            job.conn = conn
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with job.lock:
+                job.conn = None
+
+    def _semaphore(self, loop):
+        sem = self._semaphores.get(loop)
+        if sem is None:
+            sem = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) executed on a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._semaphore(loop):
+            job = _Job()
+            future = loop.run_in_executor(self._executor, self._call, job, fn, args, kwargs)
+            try:
+                return await future
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads and close their connections.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the process-wide AsyncExecutor, creating it on first use.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = AsyncExecutor()
+    return _executor
+
+
+def configure(workers=DEFAULT_WORKERS, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Replace the process-wide executor with one using the given limits.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = AsyncExecutor(workers, max_concurrency)
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+atexit.register(shutdown)
+
+
+async def run(fn, *args, **kwargs):
+    return await get_executor().run(fn, *args, **kwargs)
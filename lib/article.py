@@ -1,6 +1,56 @@
-from lib.database_utils import get_connection
+import heapq
+import sqlite3
+
+from lib import aio
+from lib import author as _author
+from lib import magazine as _magazine
+from lib import sharding
+from lib.database_utils import BULK_BATCH_SIZE, batched, fetch_all, transaction, update_sql
+from lib.pagination import DEFAULT_PAGE_SIZE, Page, decode_cursor, encode_cursor
+from lib.query import QuerySet
+from lib.session import after_save, changed_columns, defer, track
+
+# Plain article columns: author and magazine stay lazy references
+ARTICLE_COLUMNS = "a.id, a.title, a.author_id, a.magazine_id"
+ARTICLE_FROM = "FROM articles a"
+ARTICLE_SELECT = f"SELECT {ARTICLE_COLUMNS} {ARTICLE_FROM}"
+
+# Article columns plus the author and magazine columns needed to hydrate them
+JOINED_COLUMNS = f"""{ARTICLE_COLUMNS},
+           au.name AS author_name, m.name AS magazine_name, m.category AS magazine_category"""
+JOINED_FROM = """
+    FROM articles a
+    JOIN authors au ON au.id = a.author_id
+    JOIN magazines m ON m.id = a.magazine_id
+"""
+JOINED_SELECT = f"SELECT {JOINED_COLUMNS} {JOINED_FROM}"
+# FTS5 reports a malformed MATCH expression as an OperationalError starting with one of these
+FTS_QUERY_ERRORS = ("fts5: syntax error", "unterminated string", "unknown special query")
+
+
+def _is_query_error(error, query):
+    # tell a bad search query apart from a real failure (locked, interrupted, missing table...)
+    message = str(error)
+    if message.startswith(FTS_QUERY_ERRORS):
+        return True
+    # a column filter ("colour: red") naming a column the index doesn't have
+    column = message.removeprefix("no such column: ")
+    return column != message and column in query
+
 
 class Article:
+    # _author/_magazine hold the loaded objects, or None until first access;
+    # _author_id/_magazine_id always hold the foreign keys
+    __slots__ = ("_title", "_author", "_author_id", "_magazine", "_magazine_id", "id", "_loaded")
+
+    # unit-of-work metadata (see lib/session.py); flushed after authors/magazines
+    _table = "articles"
+    _flush_order = 1
+    _identity_mapped = False
+    _sharded = True
+    # column order of _from_row(), for lib.query
+    _columns = ("id", "title", "author_id", "magazine_id")
+
     def __init__(self, title, author, magazine, id=None):
         # title validation (read-only property)
         if not isinstance(title, str):
@@ -9,22 +59,22 @@ class Article:
             raise Exception("Article title must not be empty.")
 
         # author and magazine should be instances of Author and Magazine
-        # we avoid importing at module load to prevent circular import
-        from lib.author import Author as _Author
-        from lib.magazine import Magazine as _Magazine
-
-        if not isinstance(author, _Author):
+        if not isinstance(author, _author.Author):
             raise Exception("author must be an Author instance.")
-        if not isinstance(magazine, _Magazine):
+        if not isinstance(magazine, _magazine.Magazine):
             raise Exception("magazine must be a Magazine instance.")
 
         self._title = title
         self._author = author
+        self._author_id = author.id
         self._magazine = magazine
+        self._magazine_id = magazine.id
         self.id = id
+        # column values as last read from / written to the DB (None = unsaved)
+        self._loaded = (title, author.id, magazine.id) if id is not None else None
 
     def __repr__(self):
-        return f"<Article id={self.id} title={self._title!r} author_id={self._author.id} magazine_id={self._magazine.id}>"
+        return f"<Article id={self.id} title={self._title!r} author_id={self.author_id} magazine_id={self.magazine_id}>"
 
     @property
     def title(self):
@@ -32,81 +82,358 @@ class Article:
 
     @property
     def author(self):
+        # lazy: loaded (through the identity map) on first access
+        if self._author is None:
+            self._author = _author.Author.find_by_id(self._author_id)
         return self._author
 
     @author.setter
     def author(self, value):
-        from lib.author import Author as _Author
-        if not isinstance(value, _Author):
+        if not isinstance(value, _author.Author):
             raise Exception("author must be an Author instance.")
         self._author = value
+        self._author_id = value.id
+        track(self)
 
     @property
     def magazine(self):
+        if self._magazine is None:
+            self._magazine = _magazine.Magazine.find_by_id(self._magazine_id)
         return self._magazine
 
     @magazine.setter
     def magazine(self, value):
-        from lib.magazine import Magazine as _Magazine
-        if not isinstance(value, _Magazine):
+        if not isinstance(value, _magazine.Magazine):
             raise Exception("magazine must be a Magazine instance.")
         self._magazine = value
+        self._magazine_id = value.id
+        track(self)
+
+    @property
+    def author_id(self):
+        # prefer the object: it may have been saved (and got an id) after assignment
+        return self._author.id if self._author is not None else self._author_id
+
+    @property
+    def magazine_id(self):
+        return self._magazine.id if self._magazine is not None else self._magazine_id
+
+    def _column_values(self):
+        return {"title": self._title, "author_id": self.author_id, "magazine_id": self.magazine_id}
+
+    def _related(self):
+        return tuple(obj for obj in (self._author, self._magazine) if obj is not None)
+
+    def _cache_tags(self):
+        # cached results this write can change (see lib/result_cache.py); call before mark_clean()
+        tags = {("magazine", self.magazine_id), ("author", self.author_id)}
+        if self._loaded is None or self._loaded[2] != self.magazine_id:
+            tags.add("top_publishers")
+        if self._loaded is not None:
+            tags.update((("author", self._loaded[1]), ("magazine", self._loaded[2])))
+        return tags
 
     # --- DB helpers ---
     @classmethod
-    def new_from_db(cls, row):
+    def _from_row(cls, id, title, author_id, magazine_id, author=None, magazine=None):
+        """
+        Trusted constructor for values read from the DB: skips validation.
+        author/magazine may be passed when already known; otherwise they are
+        loaded lazily from author_id/magazine_id.
+        """
+        obj = object.__new__(cls)
+        obj._title = title
+        obj._author = author
+        obj._author_id = author_id
+        obj._magazine = magazine
+        obj._magazine_id = magazine_id
+        obj.id = id
+        obj._loaded = (title, author_id, magazine_id)
+        return obj
+
+    @classmethod
+    def new_from_db(cls, row, eager=False):
+        """
+        Build an Article from an (id, title, author_id, magazine_id) row.
+        author and magazine are lazy unless eager=True.
+        """
         if row is None:
             return None
-        try:
-            id_val = row["id"]
-            title_val = row["title"]
-            author_id = row["author_id"]
-            magazine_id = row["magazine_id"]
-        except Exception:
+        if isinstance(row, (tuple, list)):
             id_val, title_val, author_id, magazine_id = row[0], row[1], row[2], row[3]
+        else:
+            id_val, title_val = row["id"], row["title"]
+            author_id, magazine_id = row["author_id"], row["magazine_id"]
+        article = cls._from_row(id_val, title_val, author_id, magazine_id)
+        if eager:
+            # touch both lazy references to load them now
+            article.author, article.magazine
+        return article
+
+    @classmethod
+    def new_from_joined(cls, row):
+        """
+        Build an Article from a JOINED_SELECT row without any follow-up queries.
+        Columns are read by position, in JOINED_SELECT order.
+        """
+        author_obj = _author.Author._hydrate(row[2], row[4])
+        magazine_obj = _magazine.Magazine._hydrate(row[3], row[5], row[6])
+        return cls._from_row(row[0], row[1], row[2], row[3], author_obj, magazine_obj)
+
+    @classmethod
+    def _builder(cls, eager, author, magazine, extra_columns=""):
+        # returns (SELECT prefix, row -> Article) for the requested loading mode;
+        # extra_columns are appended after the ones the builder reads
+        if eager:
+            return f"SELECT {JOINED_COLUMNS}{extra_columns} {JOINED_FROM}", cls.new_from_joined
+        select = f"SELECT {ARTICLE_COLUMNS}{extra_columns} {ARTICLE_FROM}"
+        return select, lambda r: cls._from_row(r[0], r[1], r[2], r[3], author, magazine)
+
+    @classmethod
+    def select_where(cls, where, params=(), eager=False, author=None, magazine=None):
+        """
+        Return articles matching `where` (aliases: a=articles, and with eager=True
+        also au=authors, m=magazines) in id order, in a single query.
+
+        By default author and magazine are lazy references; pass author/magazine
+        when the filter already pins them. eager=True hydrates both from a JOIN.
+        """
+        select, build = cls._builder(eager, author, magazine)
+        shard = sharding.shard_of(magazine.id) if magazine is not None else None
+        results = sharding.gather(shard, fetch_all, f"{select} WHERE {where} ORDER BY a.id", params)
+        return [build(r) for r in sharding.merge(results, key=lambda r: r[0])]
+
+    @classmethod
+    def page_where(cls, where, params=(), page_size=DEFAULT_PAGE_SIZE, cursor=None, eager=False,
+                   author=None, magazine=None):
+        """
+        Keyset-paginated variant of select_where(): returns a Page of up to
+        page_size articles with id greater than the one encoded in cursor.
+        Every page costs one indexed range scan, however deep it is.
+        """
+        if page_size < 1:
+            raise Exception("page_size must be a positive integer.")
+        select, build = cls._builder(eager, author, magazine)
+        shard = sharding.shard_of(magazine.id) if magazine is not None else None
+        results = sharding.gather(
+            shard, fetch_all,
+            f"{select} WHERE {where} AND a.id > ? ORDER BY a.id LIMIT ?",
+            (*params, decode_cursor(cursor), page_size + 1),
+        )
+        rows = sharding.merge(results, key=lambda r: r[0])
+        # the extra row only tells us whether another page exists
+        items = [build(r) for r in rows[:page_size]]
+        next_cursor = encode_cursor(items[-1].id) if len(rows) > page_size else None
+        return Page(items, next_cursor)
+
+    @classmethod
+    def iter_where(cls, where, params=(), chunk_size=None, eager=False, author=None, magazine=None):
+        """
+        Streaming variant of select_where(): a generator that hydrates rows
+        chunk_size at a time, so memory stays constant for huge result sets.
+        """
+        select, build = cls._builder(eager, author, magazine)
+        shard = sharding.shard_of(magazine.id) if magazine is not None else None
+        rows = sharding.streams(shard, f"{select} WHERE {where} ORDER BY a.id", params, chunk_size)
+        for row in heapq.merge(*rows, key=lambda r: r[0]):
+            yield build(row)
 
-        # Lazy: fetch author and magazine objects by id
-        from lib.author import Author
-        from lib.magazine import Magazine
-        author_obj = Author.find_by_id(author_id)
-        magazine_obj = Magazine.find_by_id(magazine_id)
-        return cls(title_val, author_obj, magazine_obj, id=id_val)
+    @classmethod
+    def search(cls, query, magazine=None, author=None, category=None, limit=DEFAULT_PAGE_SIZE, eager=False):
+        """
+        Full-text search over titles (articles_fts, see migration 5), best
+        matches first by bm25 rank. query uses FTS5 syntax: words are ANDed,
+        "quoted phrases", OR / NOT, and `clim*` for prefix matches.
+        Optionally restrict to a Magazine, an Author or a magazine category.
+        """
+        if not isinstance(query, str) or not query.strip():
+            raise Exception("search query must be a non-empty string.")
+        if limit < 1:
+            raise Exception("limit must be a positive integer.")
+        select, build = cls._builder(eager, author, magazine, ", articles_fts.rank AS fts_rank")
+        where, params = ["articles_fts MATCH ?"], [query]
+        if magazine is not None:
+            where.append("a.magazine_id = ?")
+            params.append(magazine.id)
+        if author is not None:
+            where.append("a.author_id = ?")
+            params.append(author.id)
+        if category is not None:
+            where.append("a.magazine_id IN (SELECT id FROM magazines WHERE category = ?)")
+            params.append(category)
+        sql = (
+            f"{select} JOIN articles_fts ON articles_fts.rowid = a.id"
+            f" WHERE {' AND '.join(where)} ORDER BY articles_fts.rank LIMIT ?"
+        )
+        shard = sharding.shard_of(magazine.id) if magazine is not None else None
+        try:
+            results = sharding.gather(shard, fetch_all, sql, (*params, limit))
+        except sqlite3.OperationalError as e:
+            if not _is_query_error(e, query):
+                raise
+            raise Exception(f"invalid search query {query!r}: {e}") from None
+        # bm25 scores are per shard, but close enough to interleave the shards' hits
+        rows = sharding.merge(results, key=lambda r: r["fts_rank"])[:limit]
+        return [build(r) for r in rows]
 
     @classmethod
-    def find_by_id(cls, id):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, title, author_id, magazine_id FROM articles WHERE id = ?", (id,))
-        row = cur.fetchone()
-        conn.close()
-        return cls.new_from_db(row)
+    def query(cls):
+        """
+        Lazy, chainable query over articles; see lib/query.py.
+        """
+        return QuerySet(cls)
+
+    @classmethod
+    def find_by_id(cls, id, eager=False):
+        results = sharding.gather(
+            sharding.article_shard(id), fetch_all,
+            "SELECT id, title, author_id, magazine_id FROM articles WHERE id = ?", (id,),
+        )
+        rows = [row for rows in results for row in rows]
+        return cls.new_from_db(rows[0] if rows else None, eager=eager)
 
     def save(self):
         """
-        INSERT or UPDATE using foreign keys from self.author.id and self.magazine.id
+        INSERT or UPDATE using foreign keys from self.author.id and self.magazine.id.
+        Only changed columns are updated; inside a Session the write is deferred.
         """
-        from lib.author import Author as _Author
-        from lib.magazine import Magazine as _Magazine
+        if defer(self):
+            return self
 
-        if not isinstance(self._author, _Author):
+        if self._author is not None and not isinstance(self._author, _author.Author):
             raise Exception("author must be an Author instance before saving.")
-        if not isinstance(self._magazine, _Magazine):
+        if self._magazine is not None and not isinstance(self._magazine, _magazine.Magazine):
             raise Exception("magazine must be a Magazine instance before saving.")
-        if self._author.id is None or self._magazine.id is None:
+        if self.author_id is None or self.magazine_id is None:
             raise Exception("author and magazine must be saved (have ids) before saving article.")
 
-        conn = get_connection()
-        cur = conn.cursor()
+        inserted = [self] if self.id is None else []
+        source = self._moved_from()
+        shard = sharding.shard_of(self._shard_key())
+        if source is not None:
+            self._move(source)
+        else:
+            sharding.run_on(shard, self._write)
+        # on the shard, so it follows the transaction the row was written in
+        sharding.run_on(shard, after_save, [self], inserted)
+        return self
+
+    def _write(self):
         if self.id is None:
-            cur.execute(
-                "INSERT INTO articles (title, author_id, magazine_id) VALUES (?, ?, ?)",
-                (self._title, self._author.id, self._magazine.id)
-            )
-            self.id = cur.lastrowid
+            with transaction() as conn:
+                sharding.insert_rows(
+                    conn, "articles", ("title", "author_id", "magazine_id"), [self],
+                    lambda a: (a._title, a.author_id, a.magazine_id),
+                )
         else:
-            cur.execute(
-                "UPDATE articles SET title = ?, author_id = ?, magazine_id = ? WHERE id = ?",
-                (self._title, self._author.id, self._magazine.id, self.id)
-            )
-        conn.commit()
-        conn.close()
+            changes = changed_columns(self)
+            if changes:
+                with transaction() as conn:
+                    conn.execute(update_sql("articles", changes), (*changes.values(), self.id))
+
+    def _shard_key(self):
+        # articles live on their magazine's shard (see lib/sharding.py)
+        return self.magazine_id
+
+    def _moved_from(self):
+        # the shard a saved article still lives on, when its new magazine is on another one
+        if self._loaded is None or sharding.same_shard(self._loaded[2], self.magazine_id):
+            return None
+        return sharding.shard_of(self._loaded[2])
+
+    def _move(self, source):
+        """
+        Move a saved article to its new magazine's shard: insert it there,
+        then delete it from source. It gets a new id, since article ids are
+        routed by shard. If the delete fails the copy is removed again.
+        """
+        old_id = self.id
+        target = sharding.shard_of(self._shard_key())
+        self.id = None
+        try:
+            sharding.run_on(target, self._write)
+        except BaseException:
+            self.id = old_id
+            raise
+        try:
+            sharding.run_on(source, self._delete_row, old_id)
+        except BaseException:
+            sharding.run_on(target, self._delete_row, self.id)
+            self.id = old_id
+            raise
+
+    @staticmethod
+    def _delete_row(id):
+        # the delete triggers keep the counters and the search index in step
+        with transaction() as conn:
+            conn.execute("DELETE FROM articles WHERE id = ?", (id,))
+
+    @classmethod
+    def bulk_create(cls, articles, batch_size=BULK_BATCH_SIZE):
+        """
+        INSERT many unsaved Articles in one transaction with executemany and
+        assign their ids. Authors and magazines must already be saved.
+        articles may be any iterable, including a generator; it is consumed
+        batch_size rows at a time. Returns the number inserted.
+        """
+        batches = batched(articles, batch_size)
+        if not sharding.enabled():
+            return cls._insert_batches(batches)
+        # sharded: one transaction per (batch, shard) rather than one overall
+        count = 0
+        for batch in batches:
+            for shard, group in sharding.partition(batch, key=lambda a: getattr(a, "magazine_id", None)).items():
+                count += sharding.run_on(shard, cls._insert_batches, [group])
+        return count
+
+    @classmethod
+    def _insert_batches(cls, batches):
+        inserted = []
+        try:
+            with transaction() as conn:
+                for batch in batches:
+                    if not all(
+                        type(a) is cls and a.id is None and a.author_id is not None and a.magazine_id is not None
+                        for a in batch
+                    ):
+                        raise Exception("bulk_create expects unsaved Articles whose author and magazine have ids.")
+                    inserted.extend(batch)
+                    sharding.insert_rows(
+                        conn, "articles", ("title", "author_id", "magazine_id"), batch,
+                        lambda a: (a._title, a.author_id, a.magazine_id),
+                    )
+        except BaseException:
+            # the rows were rolled back, so the ids handed out are not real
+            for a in inserted:
+                a.id = None
+            raise
+        after_save(inserted, inserted)
+        return len(inserted)
+
+    # --- asyncio counterparts (run on lib.aio's connection-owning executor) ---
+    @classmethod
+    async def afind_by_id(cls, id, eager=False):
+        return await aio.run(cls.find_by_id, id, eager)
+
+    @classmethod
+    async def asearch(cls, query, magazine=None, author=None, category=None, limit=DEFAULT_PAGE_SIZE, eager=False):
+        return await aio.run(cls.search, query, magazine, author, category, limit, eager)
+
+    async def asave(self):
+        return await aio.run(self.save)
+
+    async def aauthor(self):
+        """
+        Awaitable form of the lazy `author` property.
+        """
+        if self._author is None:
+            await aio.run(getattr, self, "author")
+        return self._author
+
+    async def amagazine(self):
+        """
+        Awaitable form of the lazy `magazine` property.
+        """
+        if self._magazine is None:
+            await aio.run(getattr, self, "magazine")
+        return self._magazine
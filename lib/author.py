@@ -1,6 +1,27 @@
-from lib.database_utils import get_connection
+from lib import aio
+from lib import article as _article
+from lib import identity_map
+from lib import magazine as _magazine
+from lib import result_cache
+from lib import sharding
+from lib.database_utils import (
+    BULK_BATCH_SIZE, batched, connection, fetch_all, insert_batch, select_in, transaction, update_sql,
+)
+from lib.pagination import DEFAULT_PAGE_SIZE
+from lib.query import QuerySet
+from lib.session import after_save, changed_columns, defer
 
 class Author:
+    __slots__ = ("_name", "id", "_loaded", "_partial")
+
+    # unit-of-work metadata (see lib/session.py)
+    _table = "authors"
+    _flush_order = 0
+    _identity_mapped = True
+    _sharded = False
+    # column order of _from_row(), for lib.query
+    _columns = ("id", "name")
+
     def __init__(self, name, id=None):
         if not isinstance(name, str):
             raise Exception("Author name must be a string.")
@@ -8,6 +29,9 @@ class Author:
             raise Exception("Author name must not be empty.")
         self._name = name
         self.id = id
+        # column values as last read from / written to the DB (None = unsaved)
+        self._loaded = (name,) if id is not None else None
+        self._partial = False
 
     def __repr__(self):
         return f"<Author id={self.id} name={self._name!r}>"
@@ -17,98 +41,189 @@ class Author:
     def name(self):
         return self._name
 
+    def _column_values(self):
+        return {"name": self._name}
+
+    def _related(self):
+        return ()
+
+    def _cache_tags(self):
+        # cached results a write to this row can change (see lib/result_cache.py)
+        return [("author", self.id)]
+
     # --- Class / helper methods for DB mapping ---
+    @classmethod
+    def _from_row(cls, id, name):
+        """
+        Trusted constructor for values read from the DB: skips validation.
+        """
+        obj = object.__new__(cls)
+        obj._name = name
+        obj.id = id
+        obj._loaded = (name,)
+        obj._partial = False
+        return obj
+
+    @classmethod
+    def _hydrate(cls, id, name):
+        # reuse the instance already loaded for this id, if any
+        cached = identity_map.lookup(cls, id)
+        if cached is not None:
+            return cached
+        return identity_map.register(cls._from_row(id, name))
+
+    @classmethod
+    def _load(cls, row):
+        # row fetched after a counted identity-map miss: peek, so it isn't counted twice
+        if row is None:
+            return None
+        cached = identity_map.peek(cls, row[0])
+        if cached is not None:
+            return cached
+        return identity_map.register(cls._from_row(row[0], row[1]))
+
     @classmethod
     def new_from_db(cls, row):
         """
-        row is sqlite3.Row with keys: id, name
+        row is sqlite3.Row (or dict) with keys: id, name, or an (id, name) tuple
         """
         if row is None:
             return None
-        # row may be sqlite3.Row or tuple; prefer mapping by keys
-        try:
-            id_val = row["id"]
-            name_val = row["name"]
-        except Exception:
-            # fallback for tuple ordering (id, name)
-            id_val, name_val = row[0], row[1]
-        return cls(name_val, id=id_val)
+        if isinstance(row, (tuple, list)):
+            return cls._hydrate(row[0], row[1])
+        return cls._hydrate(row["id"], row["name"])
 
     @classmethod
     def find_by_id(cls, id):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, name FROM authors WHERE id = ?", (id,))
-        row = cur.fetchone()
-        conn.close()
-        return cls.new_from_db(row)
+        cached = identity_map.lookup(cls, id)
+        if cached is not None:
+            return cached
+        with connection() as conn:
+            row = conn.execute("SELECT id, name FROM authors WHERE id = ?", (id,)).fetchone()
+        return cls._load(row)
+
+    @classmethod
+    def query(cls):
+        """
+        Lazy, chainable query over authors; see lib/query.py.
+        """
+        return QuerySet(cls)
+
+    @classmethod
+    def find_many(cls, ids):
+        """
+        Return Authors for ids in the given order (unknown ids are skipped).
+        Ids missing from the identity map are fetched with batched IN (...) queries.
+        """
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        missing = []
+        for id in ids:
+            cached = identity_map.lookup(cls, id)
+            if cached is not None:
+                found[id] = cached
+            else:
+                missing.append(id)
+        if missing:
+            with connection() as conn:
+                for row in select_in(conn, "SELECT id, name FROM authors WHERE id IN ({placeholders})", missing):
+                    found[row["id"]] = cls._load(row)
+        return [found[id] for id in ids if id in found]
 
     def save(self):
         """
-        INSERT if no id, else UPDATE
+        INSERT if no id, else UPDATE the changed columns (no-op if none changed).
+        Inside a Session the write is deferred until the session flushes.
         """
-        conn = get_connection()
-        cur = conn.cursor()
+        if defer(self):
+            return self
+        inserted = [self] if self.id is None else []
         if self.id is None:
-            cur.execute("INSERT INTO authors (name) VALUES (?)", (self._name,))
-            self.id = cur.lastrowid
+            with transaction() as conn:
+                cur = conn.execute("INSERT INTO authors (name) VALUES (?)", (self._name,))
+                self.id = cur.lastrowid
         else:
-            cur.execute("UPDATE authors SET name = ? WHERE id = ?", (self._name, self.id))
-        conn.commit()
-        conn.close()
+            changes = changed_columns(self)
+            if changes:
+                with transaction() as conn:
+                    conn.execute(update_sql("authors", changes), (*changes.values(), self.id))
+        after_save([self], inserted)
+        return self
+
+    @classmethod
+    def bulk_create(cls, authors, batch_size=BULK_BATCH_SIZE):
+        """
+        INSERT many unsaved Authors in one transaction with executemany and
+        assign their ids. authors may be any iterable, including a generator;
+        it is consumed batch_size rows at a time. Returns the number inserted.
+        """
+        inserted = []
+        try:
+            with transaction() as conn:
+                for batch in batched(authors, batch_size):
+                    if not all(type(a) is cls and a.id is None for a in batch):
+                        raise Exception("bulk_create expects unsaved Author instances.")
+                    inserted.extend(batch)
+                    insert_batch(conn, "INSERT INTO authors (name) VALUES (?)", batch, lambda a: (a._name,))
+        except BaseException:
+            # the rows were rolled back, so the ids handed out are not real
+            for a in inserted:
+                a.id = None
+            raise
+        # only committed rows are cached and copied to the shards
+        after_save(inserted, inserted)
+        return len(inserted)
 
     # --- Relationships & aggregate methods ---
-    def articles(self):
+    def articles(self, eager=False):
         """
-        Return list of Article instances written by this author.
+        Return list of Article instances written by this author, in one query.
+        Each article's magazine is loaded lazily on first access, unless
+        eager=True hydrates them all from the same JOINed result set.
         """
-        from .article import Article  # local import to avoid circular imports
+        return _article.Article.select_where("a.author_id = ?", (self.id,), eager=eager, author=self)
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, title, author_id, magazine_id FROM articles WHERE author_id = ?", (self.id,))
-        rows = cur.fetchall()
-        conn.close()
-        return [Article.new_from_db(r) for r in rows]
+    def articles_page(self, page_size=DEFAULT_PAGE_SIZE, cursor=None, eager=False):
+        """
+        Return a Page of this author's articles in id order. Pass the page's
+        next_cursor back in to fetch the following page.
+        """
+        return _article.Article.page_where("a.author_id = ?", (self.id,), page_size, cursor, eager, author=self)
+
+    def iter_articles(self, chunk_size=None, eager=False):
+        """
+        Generator over this author's articles, streamed chunk_size rows at a time.
+        """
+        return _article.Article.iter_where("a.author_id = ?", (self.id,), chunk_size, eager, author=self)
 
+    @result_cache.cached(lambda self, mags: [("author", self.id), *(("magazine", m.id) for m in mags)])
     def magazines(self):
         """
         Return list of distinct Magazine instances where this author has articles.
         """
-        from lib.magazine import Magazine
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
+        sql = """
             SELECT DISTINCT m.id, m.name, m.category
             FROM magazines m
             JOIN articles a ON a.magazine_id = m.id
             WHERE a.author_id = ?
-            """,
-            (self.id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [Magazine.new_from_db(r) for r in rows]
+            ORDER BY m.id
+        """
+        # each magazine's articles live on one shard, so the shards' lists are disjoint
+        rows = sharding.merge(sharding.scatter(fetch_all, sql, (self.id,)), key=lambda r: r[0])
+        from_db = _magazine.Magazine.new_from_db
+        return [from_db(r) for r in rows]
 
     def add_article(self, magazine, title):
         """
         Create a new Article tied to this author and the provided magazine.
         """
-        from .article import Article
-
-        if not isinstance(magazine, object) or magazine is None:
-            raise Exception("magazine must be a Magazine instance.")
-        # Use isinstance check dynamically
-        from lib.magazine import Magazine as _Magazine
-        if not isinstance(magazine, _Magazine):
+        if not isinstance(magazine, _magazine.Magazine):
             raise Exception("magazine must be a Magazine instance.")
 
         if not isinstance(title, str) or not title.strip():
             raise Exception("title must be a non-empty string.")
 
-        article = Article(title=title, author=self, magazine=magazine)
+        article = _article.Article(title=title, author=self, magazine=magazine)
         article.save()
         return article
 
@@ -116,10 +231,90 @@ class Author:
         """
         Extract unique categories from magazines this author contributes to.
         """
-        mags = self.magazines()
-        # unique categories
-        categories = []
-        for m in mags:
-            if m.category not in categories:
-                categories.append(m.category)
-        return categories
+        return Author.topic_areas_for([self])[self]
+
+    # --- Batch aggregates (one grouped query for many authors) ---
+    @staticmethod
+    def topic_areas_for(authors):
+        """
+        Return {author: [unique categories, sorted]} for every given Author,
+        read from the magazine_author_counts counters in one grouped query.
+        """
+        authors = list(dict.fromkeys(authors))
+        by_id = {a.id: a for a in authors}
+        categories = {a: set() for a in authors}
+        sql = """
+            SELECT c.author_id, m.category
+            FROM magazine_author_counts c
+            JOIN magazines m ON m.id = c.magazine_id
+            WHERE c.author_id IN ({placeholders})
+            GROUP BY c.author_id, m.category
+        """
+
+        def fetch():
+            with connection() as conn:
+                return list(select_in(conn, sql, by_id))
+
+        for rows in sharding.scatter(fetch):
+            for author_id, category in rows:
+                categories[by_id[author_id]].add(category)
+        return {a: sorted(found) for a, found in categories.items()}
+
+    def collaborators(self, min_shared=1):
+        """
+        Return {author: shared magazine count} for the authors who publish in
+        at least min_shared of the magazines this author publishes in, most
+        shared first (ties broken by id). One self-join of the trigger-maintained
+        magazine_author_counts adjacency table, however prolific the author.
+        """
+        sql = """
+            SELECT au.id, au.name, COUNT(*) AS shared
+            FROM magazine_author_counts mine
+            JOIN magazine_author_counts other
+                ON other.magazine_id = mine.magazine_id AND other.author_id != mine.author_id
+            JOIN authors au ON au.id = other.author_id
+            WHERE mine.author_id = ?
+            GROUP BY other.author_id
+            HAVING COUNT(*) >= ?
+        """
+        # each magazine lives on one shard, so per-shard counts cover disjoint
+        # magazines and add up; the threshold can only be applied to the sum
+        having = 1 if sharding.enabled() else min_shared
+        shared, rows = {}, {}
+        for results in sharding.scatter(fetch_all, sql, (self.id, having)):
+            for row in results:
+                shared[row["id"]] = shared.get(row["id"], 0) + row["shared"]
+                rows[row["id"]] = row
+        ranked = sorted((id for id, count in shared.items() if count >= min_shared), key=lambda id: (-shared[id], id))
+        return {Author.new_from_db(rows[id]): shared[id] for id in ranked}
+
+    # --- asyncio counterparts (run on lib.aio's connection-owning executor) ---
+    @classmethod
+    async def afind_by_id(cls, id):
+        return await aio.run(cls.find_by_id, id)
+
+    @classmethod
+    async def afind_many(cls, ids):
+        return await aio.run(cls.find_many, list(ids))
+
+    async def asave(self):
+        return await aio.run(self.save)
+
+    async def aarticles(self, eager=False):
+        return await aio.run(self.articles, eager)
+
+    async def amagazines(self):
+        return await aio.run(self.magazines)
+
+    async def aadd_article(self, magazine, title):
+        return await aio.run(self.add_article, magazine, title)
+
+    async def atopic_areas(self):
+        return await aio.run(self.topic_areas)
+
+    @staticmethod
+    async def atopic_areas_for(authors):
+        return await aio.run(Author.topic_areas_for, list(authors))
+
+    async def acollaborators(self, min_shared=1):
+        return await aio.run(self.collaborators, min_shared)
@@ -1,66 +1,699 @@
+import atexit
+import itertools
+import re
 import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from lib.migrations import migrate
+
 DB_FILE = 'magazine.db'
 
-def get_connection():
+# Pool defaults; change them with configure_pool()
+POOL_SIZE = 5
+IDLE_TIMEOUT = 300.0
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to every new connection. journal_mode is stored in the database file,
+# the rest are per-connection settings.
+CONNECTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "cache_size": -16000,  # negative = KiB, i.e. ~16 MB page cache
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+# Max ids bound into a single "IN (...)" list (SQLite's default variable limit is 999)
+IN_BATCH_SIZE = 500
+
+# Rows per fetchmany() call in the streaming iter_* methods
+STREAM_CHUNK_SIZE = 500
+
+# Rows per executemany() call in the bulk_create helpers
+BULK_BATCH_SIZE = 1000
+
+
+# --- Instrumentation ---
+# Listeners are called with a QueryEvent for every statement run through a
+# PooledConnection. With no listeners registered nothing is timed or recorded.
+_listeners = []
+_commit_listeners = []   # called by transaction() just before it commits
+
+
+class QueryEvent:
     """
-    Return a sqlite3 connection with row factory set to sqlite3.Row.
+    One executed statement. rows counts the rows fetched (or changed, for
+    DML) and duration includes fetch time; both are final once the event is
+    delivered to listeners.
     """
-    # Ensure the database file directory exists (useful in some test setups)
-    db_path = Path(DB_FILE)
-    if not db_path.parent.exists():
-        db_path.parent.mkdir(parents=True, exist_ok=True)
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    __slots__ = ("sql", "params", "duration", "rows", "caller", "thread", "many")
 
+    def __init__(self, sql, params, caller, many=False):
+        self.sql = sql
+        self.params = params
+        self.duration = 0.0
+        self.rows = 0
+        self.caller = caller
+        self.thread = threading.get_ident()
+        self.many = many
+        origin = getattr(_local, "origin", None)
+        if origin is not None:
+            # run on a helper thread on behalf of another call (see query_origin)
+            self.thread, self.caller = origin
 
-def create_tables():
+    @property
+    def shape(self):
+        return query_shape(self.sql)
+
+    def __repr__(self):
+        return f"<QueryEvent {self.caller} {self.duration * 1000:.3f}ms rows={self.rows} {self.shape!r}>"
+
+
+def add_listener(listener):
+    """
+    Register listener(event) to be called for every executed statement.
+    """
+    _listeners.append(listener)
+    return listener
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+def _emit(event):
+    for listener in list(_listeners):
+        listener(event)
+
+
+def add_commit_listener(listener):
+    """
+    Register listener(conn) to be called right before transaction() commits
+    a write, while conn still holds the write lock.
+    """
+    _commit_listeners.append(listener)
+    return listener
+
+
+def remove_commit_listener(listener):
+    _commit_listeners.remove(listener)
+
+
+# modules that only relay calls, skipped when naming the calling method
+_RELAY_MODULES = {__name__, "lib.sharding", "lib.result_cache", "lib.aio"}
+
+
+def _calling_method(depth=2):
+    # the outermost lib.* frame outside the relay modules, as "Class.method":
+    # the public method the application called, not the helper it delegated to
+    frame = sys._getframe(depth)
+    found = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("lib.") and module not in _RELAY_MODULES:
+            code = frame.f_code
+            # co_qualname is new in Python 3.11
+            found = getattr(code, "co_qualname", code.co_name)
+        frame = frame.f_back
+    return found
+
+
+def current_origin():
+    """
+    (thread id, calling method) of the current call, for query_origin().
+    """
+    return threading.get_ident(), _calling_method()
+
+
+@contextmanager
+def query_origin(origin):
+    """
+    Attribute the statements run in the block to origin (from current_origin()
+    on another thread), so capture_queries() on that thread still sees them.
+    """
+    previous = getattr(_local, "origin", None)
+    _local.origin = origin
+    try:
+        yield
+    finally:
+        _local.origin = previous
+
+
+def query_shape(sql):
+    """
+    Normalize sql so statements differing only in whitespace or in the length
+    of an IN (?, ?, ...) list compare equal.
+    """
+    shape = " ".join(sql.split())
+    return re.sub(r"\?(?:\s*,\s*\?)+", "?...", shape)
+
+
+class QueryStats:
+    """
+    Events collected by capture_queries(), with a few summaries.
+    """
+
+    def __init__(self, all_threads=False):
+        self.events = []
+        self._thread = None if all_threads else threading.get_ident()
+
+    def record(self, event):
+        if self._thread is None or event.thread == self._thread:
+            self.events.append(event)
+
+    @property
+    def count(self):
+        return len(self.events)
+
+    @property
+    def total_duration(self):
+        return sum(e.duration for e in self.events)
+
+    def by_shape(self):
+        """
+        Return {query shape: number of executions}.
+        """
+        counts = {}
+        for event in self.events:
+            counts[event.shape] = counts.get(event.shape, 0) + 1
+        return counts
+
+    def by_caller(self):
+        """
+        Return {calling model method: (statements, total seconds)}.
+        """
+        totals = {}
+        for event in self.events:
+            count, duration = totals.get(event.caller, (0, 0.0))
+            totals[event.caller] = (count + 1, duration + event.duration)
+        return totals
+
+
+@contextmanager
+def capture_queries(all_threads=False):
+    """
+    Collect the statements run inside the block (by this thread only, unless
+    all_threads=True) into a QueryStats, e.g. to assert a query budget:
+
+        with capture_queries() as stats:
+            magazine.articles()
+        assert stats.count == 1
+    """
+    stats = QueryStats(all_threads)
+    add_listener(stats.record)
+    try:
+        yield stats
+    finally:
+        remove_listener(stats.record)
+
+
+class NPlusOneDetector:
+    """
+    Result of detect_n_plus_one(): findings lists (shape, executions, callers)
+    for every query shape repeated at least `threshold` times.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.stats = None
+        self.findings = []
+
+    def analyze(self, stats):
+        self.stats = stats
+        callers = {}
+        for event in stats.events:
+            callers.setdefault(event.shape, set()).add(event.caller)
+        self.findings = [
+            (shape, count, sorted(c for c in callers[shape] if c))
+            for shape, count in stats.by_shape().items()
+            if count >= self.threshold
+        ]
+        return self.findings
+
+
+@contextmanager
+def detect_n_plus_one(threshold=5, raise_on_detect=False):
+    """
+    Treat the block as one logical operation and flag query shapes executed
+    `threshold` or more times in it (the N+1 pattern). With raise_on_detect
+    an Exception is raised on exit when anything was found.
+    """
+    detector = NPlusOneDetector(threshold)
+    with capture_queries() as stats:
+        yield detector
+    findings = detector.analyze(stats)
+    if findings and raise_on_detect:
+        details = "; ".join(f"{count}x {shape} (from {', '.join(callers) or '?'})" for shape, count, callers in findings)
+        raise Exception(f"N+1 query pattern detected: {details}")
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that reports statements to the instrumentation listeners.
+    SELECT events are delivered once the result set has been consumed (or
+    the cursor is closed, re-executed or garbage collected).
+    """
+
+    _event = None
+
+    def _start(self, sql, params, many):
+        self._finish()
+        return QueryEvent(sql, params, _calling_method(), many)
+
+    def _finish(self):
+        event = self._event
+        if event is not None:
+            self._event = None
+            _emit(event)
+
+    def _timed(self, event, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            event.duration += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        if not _listeners:
+            return super().execute(sql, parameters)
+        event = self._start(sql, parameters, False)
+        self._timed(event, super().execute, sql, parameters)
+        if self.description is None:
+            event.rows = max(self.rowcount, 0)
+            _emit(event)
+        else:
+            self._event = event
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _listeners:
+            return super().executemany(sql, seq_of_parameters)
+        event = self._start(sql, seq_of_parameters, True)
+        self._timed(event, super().executemany, sql, seq_of_parameters)
+        event.rows = max(self.rowcount, 0)
+        _emit(event)
+        return self
+
+    def fetchone(self):
+        event = self._event
+        if event is None:
+            return super().fetchone()
+        row = self._timed(event, super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            event.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        event = self._event
+        if event is None:
+            return super().fetchmany(size or self.arraysize)
+        size = size or self.arraysize
+        rows = self._timed(event, super().fetchmany, size)
+        event.rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        event = self._event
+        if event is None:
+            return super().fetchall()
+        rows = self._timed(event, super().fetchall)
+        event.rows += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that goes back to its pool on close() instead of
+    being torn down, so its prepared-statement cache survives between calls.
+    Its cursors are InstrumentedCursors.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._last_used = time.monotonic()
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection's shortcuts don't go through cursor(), so route them
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            super().close()
+
+    def _close(self):
+        self._pool = None
+        super().close()
+
+
+def is_uri(db_file):
+    """
+    True for "file:" URIs (e.g. the in-memory database of lib.memory).
     """
-    Create authors, magazines, and articles tables with proper foreign keys.
+    return db_file.startswith("file:")
+
+
+class ConnectionPool:
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    Bounded pool of persistent sqlite3 connections to one database file.
 
-    # Enable foreign keys
-    cur.execute("PRAGMA foreign_keys = ON;")
+    At most `size` idle connections are kept; connections idle for longer
+    than `idle_timeout` seconds are closed the next time the pool is used.
+    Each connection keeps up to `cached_statements` prepared statements.
+    The schema is migrated once, when the pool opens its first connection.
+    """
 
-    # Authors table
-    cur.execute(
+    def __init__(self, db_file=None, size=None, idle_timeout=None, cached_statements=None):
+        self.db_file = db_file if db_file is not None else DB_FILE
+        self.size = size if size is not None else POOL_SIZE
+        self.idle_timeout = idle_timeout if idle_timeout is not None else IDLE_TIMEOUT
+        self.cached_statements = cached_statements if cached_statements is not None else STATEMENT_CACHE_SIZE
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._migrated = False
+
+        # Ensure the database file directory exists (useful in some test setups)
+        db_path = Path(self.db_file)
+        if not is_uri(self.db_file) and not db_path.parent.exists():
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            factory=PooledConnection,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            uri=is_uri(self.db_file),
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in CONNECTION_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if not self._migrated:
+            migrate(conn)
+            self._migrated = True
+        return conn
+
+    def _evict_idle(self, now):
+        # caller holds self._lock; the oldest connections sit at the front
+        while self._idle and now - self._idle[0]._last_used > self.idle_timeout:
+            self._idle.pop(0)._close()
+
+    def acquire(self):
         """
-        CREATE TABLE IF NOT EXISTS authors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL
-        );
+        Check out a connection, reusing the most recently returned one.
         """
-    )
+        if self._closed:
+            raise Exception("Connection pool has been shut down.")
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        conn._pool = self
+        return conn
 
-    # Magazines table
-    cur.execute(
+    def release(self, conn):
         """
-        CREATE TABLE IF NOT EXISTS magazines (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            category TEXT NOT NULL
-        );
+        Return a connection to the pool, closing it if the pool is full.
         """
-    )
+        if conn.in_transaction:
+            conn.rollback()
+        conn._last_used = time.monotonic()
+        with self._lock:
+            if not self._closed and len(self._idle) < self.size:
+                conn._pool = None
+                self._idle.append(conn)
+                return
+        conn._close()
 
-    # Articles table with foreign keys to authors and magazines
-    cur.execute(
+    def close(self):
         """
-        CREATE TABLE IF NOT EXISTS articles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            author_id INTEGER NOT NULL,
-            magazine_id INTEGER NOT NULL,
-            FOREIGN KEY (author_id) REFERENCES authors(id) ON DELETE CASCADE,
-            FOREIGN KEY (magazine_id) REFERENCES magazines(id) ON DELETE CASCADE
-        );
+        Close every idle connection and refuse further checkouts.
         """
-    )
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn._close()
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool():
+    """
+    Return the process-wide pool, creating it on first use (or after DB_FILE changed).
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.db_file == DB_FILE:
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.db_file != DB_FILE:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool()
+        return _pool
+
+
+def configure_pool(db_file=None, size=None, idle_timeout=None, cached_statements=None):
+    """
+    Replace the process-wide pool with one using the given settings.
+    """
+    global _pool, DB_FILE
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        if db_file is not None:
+            DB_FILE = db_file
+        _pool = ConnectionPool(DB_FILE, size, idle_timeout, cached_statements)
+        return _pool
+
+
+def close_pool():
+    """
+    Shutdown hook: close all pooled connections. Registered with atexit.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(close_pool)
+
+
+def get_connection():
+    """
+    Return a pooled sqlite3 connection with row factory set to sqlite3.Row.
+    Calling close() on it hands it back to the pool.
+    """
+    return get_pool().acquire()
+
+
+def bind_thread_connection(conn):
+    """
+    Make connection() on the current thread always yield conn (None unbinds).
+    Used by workers that own a dedicated connection, e.g. lib.aio.
+    """
+    _local.conn = conn
+
+
+def thread_connection():
+    """
+    Return the connection bound to the current thread, or None.
+    """
+    return getattr(_local, "conn", None)
+
+
+@contextmanager
+def connection(pool=None):
+    """
+    Check out a pooled connection for the duration of the with-block
+    (or use the connection bound to this thread, if there is one).
+    With an explicit pool, always check out from that pool.
+    """
+    bound = getattr(_local, "conn", None)
+    if bound is not None and pool is None:
+        yield bound
+        return
+    conn = (pool or get_pool()).acquire()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
 
-    conn.commit()
-    conn.close()
+@contextmanager
+def transaction():
+    """
+    Like connection(), but commits on success and rolls back on error.
+    The connection stays bound to this thread for the block, so a
+    transaction() opened inside it (by a save(), say) joins it rather than
+    waiting for the write lock it holds.
+    """
+    outer = getattr(_local, "transaction", None)
+    with connection() as conn:
+        if conn is outer:
+            yield conn
+            return
+        bound = getattr(_local, "conn", None)
+        outer_hooks = getattr(_local, "hooks", None)
+        hooks = []
+        _local.conn = _local.transaction = conn
+        _local.hooks = hooks
+        try:
+            yield conn
+            if conn.in_transaction:
+                for listener in list(_commit_listeners):
+                    listener(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            for _, on_rollback in hooks:
+                if on_rollback is not None:
+                    on_rollback()
+            raise
+        finally:
+            _local.conn, _local.transaction, _local.hooks = bound, outer, outer_hooks
+        for on_committed, _ in hooks:
+            on_committed()
+
+
+def on_commit(fn, on_rollback=None):
+    """
+    Call fn once the transaction() open on this thread commits, or right away
+    outside one; call on_rollback (if given) instead if it rolls back. A
+    save() joining a caller's transaction defers its bookkeeping this way.
+    """
+    hooks = getattr(_local, "hooks", None)
+    # under sharding.run_on() another database's connection may be bound
+    if hooks is None or getattr(_local, "transaction", None) is not getattr(_local, "conn", None):
+        fn()
+    else:
+        hooks.append((fn, on_rollback))
+
+
+def in_transaction():
+    """
+    True inside transaction(), or when this thread's bound connection has a
+    transaction open: this thread may hold the write lock.
+    """
+    bound = getattr(_local, "conn", None)
+    return getattr(_local, "transaction", None) is not None or (bound is not None and bound.in_transaction)
+
+
+def fetch_all(sql, params=()):
+    """
+    Run sql on connection() and return all of its rows.
+    """
+    with connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def stream(sql, params=(), chunk_size=None, pool=None):
+    """
+    Generator yielding the rows of sql, fetched chunk_size rows at a time.
+    A pooled connection is held only while the generator is alive: closing it
+    (explicitly, via contextlib.closing, or by dropping the last reference)
+    returns the connection to the pool immediately.
+    """
+    size = chunk_size or STREAM_CHUNK_SIZE
+    with connection(pool) as conn:
+        cur = conn.execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cur.close()
+
+
+def select_in(conn, sql, ids, batch_size=None, params=()):
+    """
+    Run sql once per batch of ids and yield the rows. sql must contain a
+    "{placeholders}" marker where the "?, ?, ..." list goes; params are bound
+    after the ids, for any "?" that follows the marker.
+    """
+    ids = list(ids)
+    size = batch_size or IN_BATCH_SIZE
+    for start in range(0, len(ids), size):
+        batch = ids[start:start + size]
+        placeholders = ", ".join("?" * len(batch))
+        yield from conn.execute(sql.format(placeholders=placeholders), (*batch, *params)).fetchall()
+
+
+def batched(iterable, size):
+    """
+    Yield lists of up to size items, consuming iterable lazily.
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def insert_batch(conn, sql, batch, params):
+    """
+    executemany() one batch of new rows and assign the generated ids back to
+    the objects. Must run inside a write transaction on an AUTOINCREMENT table:
+    the batch then occupies the consecutive ids ending at last_insert_rowid().
+    """
+    conn.executemany(sql, [params(obj) for obj in batch])
+    first_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(batch) + 1
+    for offset, obj in enumerate(batch):
+        obj.id = first_id + offset
+
+
+def update_sql(table, columns):
+    """
+    Build "UPDATE table SET col = ?, ... WHERE id = ?" for the given columns.
+    """
+    assignments = ", ".join(f"{col} = ?" for col in columns)
+    return f"UPDATE {table} SET {assignments} WHERE id = ?"
+
+
+def create_tables():
+    """
+    Create (or upgrade) the authors, magazines and articles schema.
+    See lib/migrations.py; this is a no-op when the schema is current.
+    """
+    with connection() as conn:
+        return migrate(conn)
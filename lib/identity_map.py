@@ -0,0 +1,172 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_CAPACITY = 10000
+
+
+class IdentityMap:
+    """
+    Bounded LRU map of (model class, primary key) -> loaded instance, so the
+    same row is represented by the same object while it stays cached.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, cls, id):
+        """
+        Return the cached instance for (cls, id) or None.
+        """
+        # lock-free read: single dict operations are atomic under the GIL, and
+        # an entry evicted between get() and move_to_end() is harmless
+        key = (cls, id)
+        obj = self._entries.get(key)
+        if obj is None:
+            self.misses += 1
+            return None
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            pass
+        self.hits += 1
+        return obj
+
+    def peek(self, cls, id):
+        """
+        Like get(), but without touching LRU order or the hit/miss counters.
+        """
+        return self._entries.get((cls, id))
+
+    def add(self, obj):
+        """
+        Cache obj under its class and id, evicting the least recently used entry when full.
+        """
+        if obj.id is None or self.capacity <= 0:
+            return obj
+        key = (type(obj), obj.id)
+        with self._lock:
+            self._entries[key] = obj
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return obj
+
+    def invalidate(self, cls=None, id=None):
+        """
+        Drop one entry (cls and id), every entry of a class (cls only) or everything.
+        """
+        with self._lock:
+            if cls is None:
+                self._entries.clear()
+            elif id is not None:
+                self._entries.pop((cls, id), None)
+            else:
+                for key in [k for k in self._entries if k[0] is cls]:
+                    del self._entries[key]
+
+    def clear(self):
+        self.invalidate()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Process-wide scope; sessions opened with identity_scope() sit on top of it
+_process_map = IdentityMap()
+_local = threading.local()
+
+
+def process_map():
+    return _process_map
+
+
+def configure(capacity=DEFAULT_CAPACITY):
+    """
+    Replace the process-wide map. capacity=0 disables process-wide caching.
+    """
+    global _process_map
+    _process_map = IdentityMap(capacity)
+    return _process_map
+
+
+def current():
+    """
+    Return the innermost active session map, or the process-wide map.
+    """
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else _process_map
+
+
+@contextmanager
+def identity_scope(capacity=DEFAULT_CAPACITY):
+    """
+    Open a per-session identity map for the current thread. Instances loaded
+    inside the block are cached in it and discarded when the block exits.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    session_map = IdentityMap(capacity)
+    stack.append(session_map)
+    try:
+        yield session_map
+    finally:
+        stack.remove(session_map)
+
+
+def lookup(cls, id):
+    return current().get(cls, id)
+
+
+def peek(cls, id):
+    """
+    Like lookup(), but not counted as a hit or miss (for re-checks after a counted lookup).
+    """
+    return current().peek(cls, id)
+
+
+def register(obj):
+    """
+    Record obj as the canonical instance for its id (called after loads and saves).
+    A partially loaded instance (QuerySet.only()) never becomes canonical: its
+    save drops the cached instance for the id instead, as that one is now stale.
+    """
+    if obj._partial:
+        invalidate(type(obj), obj.id)
+        return obj
+    active = current()
+    active.add(obj)
+    if active is not _process_map:
+        # don't let the process-wide scope keep serving a different instance
+        if _process_map.peek(type(obj), obj.id) not in (None, obj):
+            _process_map.invalidate(type(obj), obj.id)
+    return obj
+
+
+def invalidate(cls=None, id=None):
+    """
+    Invalidate entries in the process-wide map and every session map of this thread.
+    """
+    _process_map.invalidate(cls, id)
+    for session_map in getattr(_local, "stack", ()):
+        session_map.invalidate(cls, id)
@@ -1,6 +1,27 @@
-from .database_utils import get_connection
+from . import aio
+from . import article as _article
+from . import author as _author
+from . import identity_map
+from . import result_cache
+from . import sharding
+from .database_utils import (
+    BULK_BATCH_SIZE, batched, connection, fetch_all, insert_batch, select_in, transaction, update_sql,
+)
+from .pagination import DEFAULT_PAGE_SIZE
+from .query import QuerySet
+from .session import after_save, changed_columns, defer, track
 
 class Magazine:
+    __slots__ = ("_name", "_category", "id", "_loaded", "_partial")
+
+    # unit-of-work metadata (see lib/session.py)
+    _table = "magazines"
+    _flush_order = 0
+    _identity_mapped = True
+    _sharded = False
+    # column order of _from_row(), for lib.query
+    _columns = ("id", "name", "category")
+
     def __init__(self, name, category, id=None):
         # validation for name and category (read/write)
         if not isinstance(name, str):
@@ -15,6 +36,9 @@ class Magazine:
         self._name = name
         self._category = category
         self.id = id
+        # column values as last read from / written to the DB (None = unsaved)
+        self._loaded = (name, category) if id is not None else None
+        self._partial = False
 
     def __repr__(self):
         return f"<Magazine id={self.id} name={self._name!r} category={self._category!r}>"
@@ -31,6 +55,7 @@ class Magazine:
         if not value.strip():
             raise Exception("Magazine name must not be empty.")
         self._name = value
+        track(self)
 
     # category property (read/write)
     @property
@@ -44,66 +69,171 @@ class Magazine:
         if not value.strip():
             raise Exception("Magazine category must not be empty.")
         self._category = value
+        track(self)
+
+    def _column_values(self):
+        return {"name": self._name, "category": self._category}
+
+    def _related(self):
+        return ()
+
+    def _cache_tags(self):
+        # cached results a write to this row can change (see lib/result_cache.py)
+        return [("magazine", self.id)]
 
     # --- DB helper methods ---
+    @classmethod
+    def _from_row(cls, id, name, category):
+        """
+        Trusted constructor for values read from the DB: skips validation.
+        """
+        obj = object.__new__(cls)
+        obj._name = name
+        obj._category = category
+        obj.id = id
+        obj._loaded = (name, category)
+        obj._partial = False
+        return obj
+
+    @classmethod
+    def _hydrate(cls, id, name, category):
+        cached = identity_map.lookup(cls, id)
+        if cached is not None:
+            return cached
+        return identity_map.register(cls._from_row(id, name, category))
+
+    @classmethod
+    def _load(cls, row):
+        # row fetched after a counted identity-map miss: peek, so it isn't counted twice
+        if row is None:
+            return None
+        cached = identity_map.peek(cls, row[0])
+        if cached is not None:
+            return cached
+        return identity_map.register(cls._from_row(row[0], row[1], row[2]))
+
     @classmethod
     def new_from_db(cls, row):
         if row is None:
             return None
-        try:
-            id_val = row["id"]
-            name_val = row["name"]
-            category_val = row["category"]
-        except Exception:
-            id_val, name_val, category_val = row[0], row[1], row[2]
-        return cls(name_val, category_val, id=id_val)
+        if isinstance(row, (tuple, list)):
+            return cls._hydrate(row[0], row[1], row[2])
+        return cls._hydrate(row["id"], row["name"], row["category"])
 
     @classmethod
     def find_by_id(cls, id):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, name, category FROM magazines WHERE id = ?", (id,))
-        row = cur.fetchone()
-        conn.close()
-        return cls.new_from_db(row)
+        cached = identity_map.lookup(cls, id)
+        if cached is not None:
+            return cached
+        with connection() as conn:
+            row = conn.execute("SELECT id, name, category FROM magazines WHERE id = ?", (id,)).fetchone()
+        return cls._load(row)
+
+    @classmethod
+    def query(cls):
+        """
+        Lazy, chainable query over magazines; see lib/query.py.
+        """
+        return QuerySet(cls)
+
+    @classmethod
+    def find_many(cls, ids):
+        """
+        Return Magazines for ids in the given order (unknown ids are skipped).
+        Ids missing from the identity map are fetched with batched IN (...) queries.
+        """
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        missing = []
+        for id in ids:
+            cached = identity_map.lookup(cls, id)
+            if cached is not None:
+                found[id] = cached
+            else:
+                missing.append(id)
+        if missing:
+            with connection() as conn:
+                sql = "SELECT id, name, category FROM magazines WHERE id IN ({placeholders})"
+                for row in select_in(conn, sql, missing):
+                    found[row["id"]] = cls._load(row)
+        return [found[id] for id in ids if id in found]
 
     def save(self):
-        conn = get_connection()
-        cur = conn.cursor()
+        """
+        INSERT if no id, else UPDATE the changed columns (no-op if none changed).
+        Inside a Session the write is deferred until the session flushes.
+        """
+        if defer(self):
+            return self
+        inserted = [self] if self.id is None else []
         if self.id is None:
-            cur.execute(
-                "INSERT INTO magazines (name, category) VALUES (?, ?)",
-                (self._name, self._category)
-            )
-            self.id = cur.lastrowid
+            with transaction() as conn:
+                cur = conn.execute(
+                    "INSERT INTO magazines (name, category) VALUES (?, ?)",
+                    (self._name, self._category)
+                )
+                self.id = cur.lastrowid
         else:
-            cur.execute(
-                "UPDATE magazines SET name = ?, category = ? WHERE id = ?",
-                (self._name, self._category, self.id)
-            )
-        conn.commit()
-        conn.close()
+            changes = changed_columns(self)
+            if changes:
+                with transaction() as conn:
+                    conn.execute(update_sql("magazines", changes), (*changes.values(), self.id))
+        after_save([self], inserted)
+        return self
+
+    @classmethod
+    def bulk_create(cls, magazines, batch_size=BULK_BATCH_SIZE):
+        """
+        INSERT many unsaved Magazines in one transaction with executemany and
+        assign their ids. magazines may be any iterable, including a generator;
+        it is consumed batch_size rows at a time. Returns the number inserted.
+        """
+        inserted = []
+        try:
+            with transaction() as conn:
+                for batch in batched(magazines, batch_size):
+                    if not all(type(m) is cls and m.id is None for m in batch):
+                        raise Exception("bulk_create expects unsaved Magazine instances.")
+                    inserted.extend(batch)
+                    insert_batch(
+                        conn,
+                        "INSERT INTO magazines (name, category) VALUES (?, ?)",
+                        batch,
+                        lambda m: (m._name, m._category),
+                    )
+        except BaseException:
+            # the rows were rolled back, so the ids handed out are not real
+            for m in inserted:
+                m.id = None
+            raise
+        # only committed rows are cached and copied to the shards
+        after_save(inserted, inserted)
+        return len(inserted)
 
     # --- Relationships & aggregates ---
-    def articles(self):
-        from .article import Article
+    def articles(self, eager=False):
+        return _article.Article.select_where("a.magazine_id = ?", (self.id,), eager=eager, magazine=self)
+
+    def articles_page(self, page_size=DEFAULT_PAGE_SIZE, cursor=None, eager=False):
+        """
+        Return a Page of this magazine's articles in id order. Pass the page's
+        next_cursor back in to fetch the following page.
+        """
+        return _article.Article.page_where("a.magazine_id = ?", (self.id,), page_size, cursor, eager, magazine=self)
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, title, author_id, magazine_id FROM articles WHERE magazine_id = ?", (self.id,))
-        rows = cur.fetchall()
-        conn.close()
-        return [Article.new_from_db(r) for r in rows]
+    def iter_articles(self, chunk_size=None, eager=False):
+        """
+        Generator over this magazine's articles, streamed chunk_size rows at a time.
+        """
+        return _article.Article.iter_where("a.magazine_id = ?", (self.id,), chunk_size, eager, magazine=self)
 
+    @result_cache.cached(lambda self, authors: [("magazine", self.id), *(("author", a.id) for a in authors)])
     def contributors(self):
         """
         Return distinct Author instances who have articles in this magazine.
         """
-        from .author import Author
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
+        [rows] = sharding.gather(
+            sharding.shard_of(self.id), fetch_all,
             """
             SELECT DISTINCT au.id, au.name
             FROM authors au
@@ -112,64 +242,230 @@ class Magazine:
             """,
             (self.id,)
         )
-        rows = cur.fetchall()
-        conn.close()
-        return [Author.new_from_db(r) for r in rows]
+        from_db = _author.Author.new_from_db
+        return [from_db(r) for r in rows]
+
+    def iter_contributors(self, chunk_size=None):
+        """
+        Generator variant of contributors(), streamed chunk_size rows at a time.
+        """
+        sql = """
+            SELECT DISTINCT au.id, au.name
+            FROM authors au
+            JOIN articles a ON a.author_id = au.id
+            WHERE a.magazine_id = ?
+        """
+        [rows] = sharding.streams(sharding.shard_of(self.id), sql, (self.id,), chunk_size)
+        for row in rows:
+            yield _author.Author.new_from_db(row)
 
+    @result_cache.cached(lambda self, titles: [("magazine", self.id)])
     def article_titles(self):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT title FROM articles WHERE magazine_id = ?", (self.id,))
-        rows = cur.fetchall()
-        conn.close()
+        [rows] = sharding.gather(
+            sharding.shard_of(self.id), fetch_all, "SELECT title FROM articles WHERE magazine_id = ?", (self.id,)
+        )
         # rows are Row objects with 'title'
         return [r["title"] for r in rows]
 
+    def iter_titles(self, chunk_size=None):
+        """
+        Generator variant of article_titles(), streamed chunk_size rows at a time.
+        """
+        sql = "SELECT title FROM articles WHERE magazine_id = ?"
+        [rows] = sharding.streams(sharding.shard_of(self.id), sql, (self.id,), chunk_size)
+        for row in rows:
+            yield row["title"]
+
     def contributing_authors(self):
         """
         Return Author instances who have more than 2 articles in this magazine.
-        Uses GROUP BY ... HAVING COUNT(id) > 2
+        Reads the trigger-maintained magazine_author_counts table (see migration 4).
         """
-        from .author import Author
+        return Magazine.contributing_authors_for([self])[self]
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT author_id
-            FROM articles
-            WHERE magazine_id = ?
-            GROUP BY author_id
-            HAVING COUNT(id) > 2
-            """,
-            (self.id,)
+    def related_magazines(self, top_n=10):
+        """
+        Return {magazine: shared contributor count} for the top_n magazines
+        sharing the most contributors with this one, largest first (ties
+        broken by id). One self-join of the magazine_author_counts adjacency
+        table; with sharding, the contributors are read from this magazine's
+        shard and then matched on every shard.
+        """
+        if not sharding.enabled():
+            rows = fetch_all(
+                """
+                SELECT m.id, m.name, m.category, COUNT(*) AS shared
+                FROM magazine_author_counts mine
+                JOIN magazine_author_counts other
+                    ON other.author_id = mine.author_id AND other.magazine_id != mine.magazine_id
+                JOIN magazines m ON m.id = other.magazine_id
+                WHERE mine.magazine_id = ?
+                GROUP BY other.magazine_id
+                ORDER BY shared DESC, m.id
+                LIMIT ?
+                """,
+                (self.id, top_n)
+            )
+            return {Magazine.new_from_db(r): r["shared"] for r in rows}
+
+        [rows] = sharding.gather(
+            sharding.shard_of(self.id), fetch_all,
+            "SELECT author_id FROM magazine_author_counts WHERE magazine_id = ?", (self.id,)
         )
-        rows = cur.fetchall()
-        conn.close()
-        author_ids = [r["author_id"] for r in rows]
-        return [Author.find_by_id(aid) for aid in author_ids]
+        author_ids = [r[0] for r in rows]
+        sql = """
+            SELECT m.id, m.name, m.category, COUNT(*) AS shared
+            FROM magazine_author_counts c
+            JOIN magazines m ON m.id = c.magazine_id
+            WHERE c.author_id IN ({placeholders}) AND c.magazine_id != ?
+            GROUP BY c.magazine_id
+        """
+
+        def fetch():
+            with connection() as conn:
+                return list(select_in(conn, sql, author_ids, params=(self.id,)))
+
+        # the IN list may be split into batches, whose counts add up
+        shared, found = {}, {}
+        for results in sharding.scatter(fetch):
+            for row in results:
+                shared[row["id"]] = shared.get(row["id"], 0) + row["shared"]
+                found[row["id"]] = row
+        ranked = sorted(shared, key=lambda id: (-shared[id], id))[:top_n]
+        return {Magazine.new_from_db(found[id]): shared[id] for id in ranked}
 
     @staticmethod
     def top_publisher():
         """
         Bonus: Return the Magazine with the most articles (or None).
+        Walks the article_count index of magazine_article_counts, so it is O(1).
         """
-        from .magazine import Magazine as _Magazine
+        return next(iter(Magazine.top_publishers(1)), None)
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT magazine_id, COUNT(id) as cnt
-            FROM articles
-            GROUP BY magazine_id
-            ORDER BY cnt DESC
-            LIMIT 1
+    # --- Batch aggregates (one grouped query for many magazines) ---
+    @staticmethod
+    @result_cache.cached(lambda n, top: ["top_publishers", *(("magazine", m.id) for m in top)])
+    def top_publishers(n=10):
+        """
+        Return {magazine: article_count} for the n magazines with the most
+        articles, largest first (ties broken by id).
+        """
+        results = sharding.scatter(
+            fetch_all,
             """
+            SELECT m.id, m.name, m.category, c.article_count
+            FROM magazine_article_counts c
+            JOIN magazines m ON m.id = c.magazine_id
+            ORDER BY c.article_count DESC, c.magazine_id
+            LIMIT ?
+            """,
+            (n,)
         )
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return None
-        mag_id = row["magazine_id"]
-        return _Magazine.find_by_id(mag_id)
+        rows = sharding.merge(results, key=lambda r: (-r["article_count"], r["id"]))[:n]
+        return {Magazine.new_from_db(r): r["article_count"] for r in rows}
+
+    @staticmethod
+    def article_counts(magazines=None):
+        """
+        Return {magazine: article_count} for the given Magazines, or for every
+        magazine when none are given. Magazines without articles count 0.
+        """
+        if magazines is None:
+            # every shard has all magazines (replicated) but only its own counters
+            results = sharding.scatter(
+                fetch_all,
+                """
+                SELECT m.id, m.name, m.category, COALESCE(c.article_count, 0) AS article_count
+                FROM magazines m
+                LEFT JOIN magazine_article_counts c ON c.magazine_id = m.id
+                ORDER BY m.id
+                """
+            )
+            totals = {}
+            for rows in results:
+                for r in rows:
+                    totals[r["id"]] = totals.get(r["id"], 0) + r["article_count"]
+            return {Magazine.new_from_db(r): totals[r["id"]] for r in results[0]}
+        magazines = list(dict.fromkeys(magazines))
+        by_id = {m.id: m for m in magazines}
+        result = dict.fromkeys(magazines, 0)
+        sql = "SELECT magazine_id, article_count FROM magazine_article_counts WHERE magazine_id IN ({placeholders})"
+
+        def fetch():
+            with connection() as conn:
+                return list(select_in(conn, sql, by_id))
+
+        for rows in sharding.scatter(fetch):
+            for magazine_id, count in rows:
+                result[by_id[magazine_id]] += count
+        return result
+
+    @staticmethod
+    def contributing_authors_for(magazines, min_articles=3):
+        """
+        Return {magazine: [authors]} listing, for every given Magazine, the
+        authors with at least min_articles articles in it. The authors are
+        then loaded with a single Author.find_many() across all magazines.
+        """
+        magazines = list(dict.fromkeys(magazines))
+        by_id = {m.id: m for m in magazines}
+        sql = """
+            SELECT magazine_id, author_id
+            FROM magazine_author_counts
+            WHERE magazine_id IN ({placeholders}) AND article_count >= ?
+            ORDER BY magazine_id, author_id
+        """
+
+        def fetch():
+            with connection() as conn:
+                return list(select_in(conn, sql, by_id, params=(min_articles,)))
+
+        pairs = sorted(tuple(pair) for rows in sharding.scatter(fetch) for pair in rows)
+        authors = {a.id: a for a in _author.Author.find_many(author_id for _, author_id in pairs)}
+        result = {m: [] for m in magazines}
+        for magazine_id, author_id in pairs:
+            result[by_id[magazine_id]].append(authors[author_id])
+        return result
+
+    # --- asyncio counterparts (run on lib.aio's connection-owning executor) ---
+    @classmethod
+    async def afind_by_id(cls, id):
+        return await aio.run(cls.find_by_id, id)
+
+    @classmethod
+    async def afind_many(cls, ids):
+        return await aio.run(cls.find_many, list(ids))
+
+    async def asave(self):
+        return await aio.run(self.save)
+
+    async def aarticles(self, eager=False):
+        return await aio.run(self.articles, eager)
+
+    async def acontributors(self):
+        return await aio.run(self.contributors)
+
+    async def aarticle_titles(self):
+        return await aio.run(self.article_titles)
+
+    async def acontributing_authors(self):
+        return await aio.run(self.contributing_authors)
+
+    async def arelated_magazines(self, top_n=10):
+        return await aio.run(self.related_magazines, top_n)
+
+    @staticmethod
+    async def atop_publisher():
+        return await aio.run(Magazine.top_publisher)
+
+    @staticmethod
+    async def atop_publishers(n=10):
+        return await aio.run(Magazine.top_publishers, n)
+
+    @staticmethod
+    async def aarticle_counts(magazines=None):
+        return await aio.run(Magazine.article_counts, None if magazines is None else list(magazines))
+
+    @staticmethod
+    async def acontributing_authors_for(magazines, min_articles=3):
+        return await aio.run(Magazine.contributing_authors_for, list(magazines), min_articles)
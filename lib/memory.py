@@ -0,0 +1,182 @@
+"""
+In-memory serving mode.
+
+enable() copies DB_FILE into a named in-memory database and points the
+process-wide pool at it, so every model query is served from RAM. Writes
+land in the in-memory copy; snapshot() copies it back to the file with the
+sqlite3 backup API, every snapshot_interval seconds (when anything
+changed), on disable() and at interpreter exit.
+
+    memory.enable(snapshot_interval=60)
+    ...
+    memory.disable()            # final snapshot, then back to the file
+
+The database uses SQLite's memdb VFS: every pooled connection in the process
+sees the same data, and a writer blocks readers for the length of its
+transaction. The file is overwritten by each snapshot, so only one process
+should serve a given file from memory while others write to it. A write
+queue (lib.writer) is drained and restarted on every switch, so queued
+saves land in the database that is being served.
+"""
+import atexit
+import itertools
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from lib import database_utils, sharding
+from lib import writer as _writer
+
+_names = itertools.count(1)
+
+
+class MemoryDatabase:
+    """
+    A RAM copy of db_file plus the snapshot thread that writes it back.
+    """
+
+    def __init__(self, db_file, snapshot_interval=None):
+        self.db_file = db_file
+        self.uri = f"file:/magazine-{os.getpid()}-{next(_names)}?vfs=memdb"
+        self.snapshot_interval = snapshot_interval
+        self.snapshots = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # the in-memory database exists for as long as this connection stays open
+        self._anchor = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        # VACUUM INTO rather than backup(): the copy must not keep the file's
+        # WAL flag, which memdb can't open (and it comes out compacted)
+        disk = sqlite3.connect(Path(db_file).absolute().as_uri(), uri=True)
+        try:
+            disk.execute("VACUUM INTO ?", (self.uri,))
+        finally:
+            disk.close()
+        self._version = self._data_version()
+        self._thread = None
+        if snapshot_interval:
+            self._thread = threading.Thread(target=self._run, name="db-snapshot", daemon=True)
+            self._thread.start()
+
+    def _data_version(self):
+        # changes whenever another connection commits to the in-memory database
+        return self._anchor.execute("PRAGMA data_version").fetchone()[0]
+
+    def snapshot(self, force=False):
+        """
+        Copy the in-memory database to db_file if it changed since the last
+        snapshot (or always, with force). Returns True when it was written.
+        """
+        with self._lock:
+            version = self._data_version()
+            if version == self._version and not force:
+                return False
+            disk = sqlite3.connect(self.db_file)
+            try:
+                self._anchor.backup(disk)
+            finally:
+                disk.close()
+            self._version = version
+            self.snapshots += 1
+            return True
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except Exception as e:  # keep serving; the next interval tries again
+                self.last_error = e
+
+    def close(self, snapshot=True):
+        """
+        Stop the snapshot thread, write a final snapshot and free the memory.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            if snapshot:
+                self.snapshot()
+        finally:
+            self._anchor.close()
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def current():
+    """
+    Return the active MemoryDatabase, or None when serving from the file.
+    """
+    return _memory
+
+
+@contextmanager
+def _writer_restarted():
+    # a write queue owns a connection to the current DB_FILE: drain it before
+    # the switch, then start a new one (same settings) that connects to the new
+    # DB_FILE. lib.aio threads reconnect by themselves when DB_FILE changes.
+    queue = _writer.current()
+    if queue is not None:
+        _writer.disable()
+    try:
+        yield
+    finally:
+        if queue is not None:
+            _writer.configure(queue.max_batch, queue.max_delay, queue.max_pending)
+
+
+def enable(db_file=None, snapshot_interval=None):
+    """
+    Load db_file (default DB_FILE) into memory and serve all queries from it.
+    snapshot_interval (seconds) turns on periodic snapshots back to the file.
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is not None:
+            raise Exception("In-memory mode is already enabled.")
+        if sharding.enabled():
+            raise Exception("In-memory mode does not support sharding.")
+        db_file = db_file or database_utils.DB_FILE
+        pool = database_utils.get_pool()
+        with _writer_restarted():
+            _memory = MemoryDatabase(db_file, snapshot_interval)
+            database_utils.configure_pool(db_file=_memory.uri, size=pool.size, idle_timeout=pool.idle_timeout,
+                                          cached_statements=pool.cached_statements)
+        return _memory
+
+
+def snapshot(force=False):
+    if _memory is None:
+        raise Exception("In-memory mode is not enabled.")
+    return _memory.snapshot(force)
+
+
+def disable(snapshot=True):
+    """
+    Snapshot to the file (unless snapshot=False) and serve from it again.
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            return
+        pool = database_utils.get_pool()
+        with _writer_restarted():
+            # queued writes have reached memory by now, in time for the last snapshot
+            memory, _memory = _memory, None
+            database_utils.configure_pool(db_file=memory.db_file, size=pool.size, idle_timeout=pool.idle_timeout,
+                                          cached_statements=pool.cached_statements)
+            memory.close(snapshot)
+
+
+def _shutdown():
+    # queued group-commit writes must reach memory before the last snapshot
+    if _memory is not None:
+        _writer.disable()
+        disable()
+
+
+atexit.register(_shutdown)
@@ -0,0 +1,199 @@
+"""
+Schema migrations keyed on PRAGMA user_version.
+
+MIGRATIONS[n] upgrades a database from version n to n + 1. Entries are never
+edited once released; schema changes are made by appending a new entry.
+"""
+
+MIGRATIONS = [
+    # 1: base tables (IF NOT EXISTS, so databases created before versioning upgrade in place)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS authors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS magazines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS articles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            author_id INTEGER NOT NULL,
+            magazine_id INTEGER NOT NULL,
+            FOREIGN KEY (author_id) REFERENCES authors(id) ON DELETE CASCADE,
+            FOREIGN KEY (magazine_id) REFERENCES magazines(id) ON DELETE CASCADE
+        )
+        """,
+    ],
+    # 2: covering indexes for the relationship and aggregate queries
+    [
+        "CREATE INDEX IF NOT EXISTS idx_articles_magazine_author ON articles (magazine_id, author_id)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_author_magazine ON articles (author_id, magazine_id)",
+    ],
+    # 3: (fk, id) indexes so keyset pagination ("fk = ? AND id > ? ORDER BY id") never sorts
+    [
+        "CREATE INDEX IF NOT EXISTS idx_articles_magazine_id ON articles (magazine_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_author_id ON articles (author_id, id)",
+    ],
+    # 4: trigger-maintained article counters per magazine and per (magazine, author)
+    [
+        """
+        CREATE TABLE magazine_article_counts (
+            magazine_id INTEGER PRIMARY KEY,
+            article_count INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_magazine_article_counts_count ON magazine_article_counts (article_count DESC, magazine_id)",
+        """
+        CREATE TABLE magazine_author_counts (
+            magazine_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            article_count INTEGER NOT NULL,
+            PRIMARY KEY (magazine_id, author_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TRIGGER articles_counts_insert AFTER INSERT ON articles
+        BEGIN
+            INSERT INTO magazine_article_counts (magazine_id, article_count) VALUES (NEW.magazine_id, 1)
+                ON CONFLICT (magazine_id) DO UPDATE SET article_count = article_count + 1;
+            INSERT INTO magazine_author_counts (magazine_id, author_id, article_count)
+                VALUES (NEW.magazine_id, NEW.author_id, 1)
+                ON CONFLICT (magazine_id, author_id) DO UPDATE SET article_count = article_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER articles_counts_delete AFTER DELETE ON articles
+        BEGIN
+            UPDATE magazine_article_counts SET article_count = article_count - 1
+                WHERE magazine_id = OLD.magazine_id;
+            DELETE FROM magazine_article_counts
+                WHERE magazine_id = OLD.magazine_id AND article_count <= 0;
+            UPDATE magazine_author_counts SET article_count = article_count - 1
+                WHERE magazine_id = OLD.magazine_id AND author_id = OLD.author_id;
+            DELETE FROM magazine_author_counts
+                WHERE magazine_id = OLD.magazine_id AND author_id = OLD.author_id AND article_count <= 0;
+        END
+        """,
+        """
+        CREATE TRIGGER articles_counts_update AFTER UPDATE OF author_id, magazine_id ON articles
+        WHEN OLD.author_id IS NOT NEW.author_id OR OLD.magazine_id IS NOT NEW.magazine_id
+        BEGIN
+            UPDATE magazine_article_counts SET article_count = article_count - 1
+                WHERE magazine_id = OLD.magazine_id;
+            DELETE FROM magazine_article_counts
+                WHERE magazine_id = OLD.magazine_id AND article_count <= 0;
+            UPDATE magazine_author_counts SET article_count = article_count - 1
+                WHERE magazine_id = OLD.magazine_id AND author_id = OLD.author_id;
+            DELETE FROM magazine_author_counts
+                WHERE magazine_id = OLD.magazine_id AND author_id = OLD.author_id AND article_count <= 0;
+            INSERT INTO magazine_article_counts (magazine_id, article_count) VALUES (NEW.magazine_id, 1)
+                ON CONFLICT (magazine_id) DO UPDATE SET article_count = article_count + 1;
+            INSERT INTO magazine_author_counts (magazine_id, author_id, article_count)
+                VALUES (NEW.magazine_id, NEW.author_id, 1)
+                ON CONFLICT (magazine_id, author_id) DO UPDATE SET article_count = article_count + 1;
+        END
+        """,
+        # backfill from the rows that already exist
+        """
+        INSERT INTO magazine_article_counts (magazine_id, article_count)
+        SELECT magazine_id, COUNT(*) FROM articles GROUP BY magazine_id
+        """,
+        """
+        INSERT INTO magazine_author_counts (magazine_id, author_id, article_count)
+        SELECT magazine_id, author_id, COUNT(*) FROM articles GROUP BY magazine_id, author_id
+        """,
+    ],
+    # 5: FTS5 index over article titles (external content: the text lives in articles)
+    # prefix = '2 3' indexes 2- and 3-character prefixes (`cl*`, `cli*`); longer
+    # prefixes such as `clim*` are answered from a range scan of the full terms
+    [
+        """
+        CREATE VIRTUAL TABLE articles_fts USING fts5(
+            title,
+            content = 'articles',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER articles_fts_insert AFTER INSERT ON articles
+        BEGIN
+            INSERT INTO articles_fts (rowid, title) VALUES (NEW.id, NEW.title);
+        END
+        """,
+        """
+        CREATE TRIGGER articles_fts_delete AFTER DELETE ON articles
+        BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+        END
+        """,
+        """
+        CREATE TRIGGER articles_fts_update AFTER UPDATE OF title ON articles
+        WHEN OLD.title IS NOT NEW.title
+        BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+            INSERT INTO articles_fts (rowid, title) VALUES (NEW.id, NEW.title);
+        END
+        """,
+        # backfill from the rows that already exist
+        "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')",
+        # category filters resolve magazine ids through this index
+        "CREATE INDEX idx_magazines_category ON magazines (category, id)",
+    ],
+    # 6: author-first access to the per-(magazine, author) counters
+    [
+        "CREATE INDEX idx_magazine_author_counts_author ON magazine_author_counts (author_id, magazine_id)",
+    ],
+    # 7: import progress, written in the same transaction as the imported rows (lib/transfer.py)
+    [
+        """
+        CREATE TABLE import_checkpoints (
+            name TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            rows INTEGER NOT NULL
+        )
+        """,
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Bring the database behind conn up to SCHEMA_VERSION and return the version.
+    A current schema costs a single PRAGMA read and runs no DDL.
+    """
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return SCHEMA_VERSION
+    if conn.in_transaction:
+        conn.commit()
+    # take the write lock first so concurrent processes migrate one at a time
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            conn.rollback()
+            return version
+        for statements in MIGRATIONS[version:]:
+            for sql in statements:
+                conn.execute(sql)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return SCHEMA_VERSION
@@ -0,0 +1,31 @@
+import base64
+import binascii
+from collections import namedtuple
+
+DEFAULT_PAGE_SIZE = 50
+
+# items: the objects on this page; next_cursor: pass back to get the next page (None on the last page)
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+
+def encode_cursor(last_id):
+    """
+    Turn the last id seen on a page into an opaque cursor string.
+    """
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Return the last-seen id encoded in cursor (0 for the first page).
+    """
+    if cursor is None:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, _, value = base64.urlsafe_b64decode(padded.encode()).decode().partition(":")
+        if prefix != "id":
+            raise ValueError(cursor)
+        return int(value)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise Exception("Invalid pagination cursor.")
@@ -0,0 +1,286 @@
+"""
+Lazy, chainable queries compiled to a single parameterized SQL statement.
+
+    Article.query().where(magazine=m).where(author__in=authors).order_by("-id").limit(50)
+    Magazine.query().where(category="Science").count()
+    Article.query().where(title__contains="AI").values("id", "title")
+
+Every method returns a new QuerySet; nothing runs until the QuerySet is
+iterated (or count(), exists(), first() is called), and the rows are kept
+for further iterations. Filters are keyword lookups `field` or `field__op`:
+
+    eq (default), ne, lt, lte, gt, gte, in, contains, startswith
+
+A model instance stands in for its id, and author= / magazine= are accepted
+for author_id / magazine_id. The SQL text depends only on the shape of the
+query (lookups, ordering, limit, columns): values are bound as parameters,
+and an `__in` list is bound as a single JSON array, so compiled statements
+are cached by shape and reused from each connection's statement cache.
+"""
+import json
+from functools import lru_cache
+
+from lib import identity_map, sharding
+from lib.database_utils import fetch_all
+
+OPERATORS = {
+    "eq": "{column} = ?",
+    "ne": "{column} != ?",
+    "lt": "{column} < ?",
+    "lte": "{column} <= ?",
+    "gt": "{column} > ?",
+    "gte": "{column} >= ?",
+    "in": "{column} IN (SELECT value FROM json_each(?))",
+    "contains": "instr({column}, ?) > 0",
+    "startswith": "substr({column}, 1, ?) = ?",
+    "isnull": "{column} IS NULL",
+}
+
+SQL_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def compile_sql(table, mode, columns, filters, order, limit, offset):
+    """
+    SQL for one query shape. mode is "rows", "count" or "exists"; filters
+    are (column, op) pairs; order is (column, descending) pairs; limit and
+    offset say whether a LIMIT / OFFSET parameter follows the filter ones.
+    """
+    where = " AND ".join(OPERATORS[op].format(column=column) for column, op in filters)
+    where = f" WHERE {where}" if where else ""
+    if mode == "count":
+        if limit or offset:
+            inner = compile_sql(table, "rows", ("id",), filters, (), limit, offset)
+            return f"SELECT COUNT(*) FROM ({inner})"
+        return f"SELECT COUNT(*) FROM {table}{where}"
+    if mode == "exists":
+        return f"SELECT 1 FROM {table}{where} LIMIT 1"
+    sql = f"SELECT {', '.join(columns)} FROM {table}{where}"
+    if order:
+        sql += " ORDER BY " + ", ".join(f"{column} DESC" if desc else column for column, desc in order)
+    if limit or offset:
+        # SQLite needs a LIMIT to accept an OFFSET; -1 means no limit
+        sql += " LIMIT ?"
+    if offset:
+        sql += " OFFSET ?"
+    return sql
+
+
+class QuerySet:
+    """
+    A lazy query over one model's table; see the module docstring.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._filters = ()      # ((column, op, value), ...)
+        self._order = (("id", False),)
+        self._limit = None
+        self._offset = 0
+        self._values = None     # columns for values(), else None
+        self._only = None       # columns for only(), else None
+        self._result = None
+
+    def _clone(self, **changes):
+        clone = object.__new__(QuerySet)
+        clone.__dict__.update(self.__dict__, _result=None, **changes)
+        return clone
+
+    def __repr__(self):
+        sql, params = self.sql()
+        return f"<QuerySet {self.model.__name__}: {sql} {params}>"
+
+    # --- Building ---
+    def _column(self, name):
+        columns = self.model._columns
+        if name in columns:
+            return name
+        if f"{name}_id" in columns:
+            return f"{name}_id"
+        raise Exception(f"Unknown field {name!r} for {self.model.__name__}.")
+
+    @staticmethod
+    def _value(value):
+        # model instances stand in for their ids
+        if hasattr(value, "_table"):
+            if value.id is None:
+                raise Exception(f"{type(value).__name__} must be saved before it is used in a query.")
+            return value.id
+        return value
+
+    def where(self, **lookups):
+        """
+        Add filters (ANDed with the existing ones), e.g. where(title__contains="AI").
+        """
+        filters = list(self._filters)
+        for key, value in lookups.items():
+            name, _, op = key.partition("__")
+            op = op or "eq"
+            if op not in OPERATORS or op == "isnull":
+                raise Exception(f"Unknown lookup {op!r} in {key!r}.")
+            column = self._column(name)
+            if op == "in":
+                if isinstance(value, (str, bytes)) or not hasattr(value, "__iter__"):
+                    raise Exception(f"{key!r} expects a list of values, not {type(value).__name__}.")
+                value = [self._value(v) for v in value]
+            else:
+                value = self._value(value)
+                if value is None:
+                    if op != "eq":
+                        raise Exception(f"{key!r} can't be compared with None.")
+                    op = "isnull"
+            filters.append((column, op, value))
+        return self._clone(_filters=tuple(filters))
+
+    def order_by(self, *fields):
+        """
+        Replace the ordering (id by default); prefix a field with "-" for descending.
+        """
+        order = tuple((self._column(f.lstrip("-")), f.startswith("-")) for f in fields)
+        return self._clone(_order=order or (("id", False),))
+
+    def limit(self, n):
+        if n < 0:
+            raise Exception("limit must not be negative.")
+        return self._clone(_limit=n)
+
+    def offset(self, n):
+        if n < 0:
+            raise Exception("offset must not be negative.")
+        return self._clone(_offset=n)
+
+    def values(self, *fields):
+        """
+        Yield plain tuples of the given fields (all columns by default)
+        instead of model instances.
+        """
+        columns = tuple(self._column(f) for f in fields) or self.model._columns
+        return self._clone(_values=columns, _only=None)
+
+    def only(self, *fields):
+        """
+        Load instances with only the given fields (plus id); the other
+        columns read as None and are left untouched by save().
+        """
+        columns = ("id", *(self._column(f) for f in fields if f != "id"))
+        return self._clone(_only=tuple(dict.fromkeys(columns)), _values=None)
+
+    # --- Compiling ---
+    def _selected(self):
+        # the columns the caller gets, then any ORDER BY columns merging shards needs
+        shown = self._values or self._only or self.model._columns
+        if not (self.model._sharded and sharding.enabled()):
+            return shown, shown
+        hidden = tuple(dict.fromkeys(c for c, _ in self._order if c not in shown))
+        return shown, shown + hidden
+
+    def _params(self, limit, offset):
+        params = []
+        for column, op, value in self._filters:
+            if op == "in":
+                params.append(json.dumps(value))
+            elif op == "startswith":
+                params.extend((len(value), value))
+            elif op != "isnull":
+                params.append(value)
+        if limit is not None or offset:
+            params.append(-1 if limit is None else limit)
+        if offset:
+            params.append(offset)
+        return tuple(params)
+
+    def _sql(self, mode, columns=(), limit=None, offset=0, order=()):
+        filters = tuple((column, op) for column, op, _ in self._filters)
+        sql = compile_sql(self.model._table, mode, columns, filters, order, limit is not None, bool(offset))
+        return sql, self._params(limit, offset)
+
+    def sql(self):
+        """
+        The (sql, params) this QuerySet runs when iterated, without sharding.
+        """
+        return self._sql("rows", self._selected()[1], self._limit, self._offset, self._order)
+
+    def _shard(self):
+        # articles are sharded by magazine: a magazine filter pins one shard
+        if self.model._sharded:
+            for column, op, value in self._filters:
+                if column == "magazine_id" and op == "eq":
+                    return sharding.shard_of(value)
+        return None
+
+    # --- Running ---
+    def _rows(self):
+        shown, selected = self._selected()
+        if not sharding.enabled() or not self.model._sharded:
+            sql, params = self.sql()
+            return fetch_all(sql, params)
+        # every shard returns its first offset + limit rows; the merge applies the window
+        limit = None if self._limit is None else self._limit + self._offset
+        sql, params = self._sql("rows", selected, limit, 0, self._order)
+        rows = [tuple(r) for rows in sharding.gather(self._shard(), fetch_all, sql, params) for r in rows]
+        for column, desc in reversed(self._order):
+            index = selected.index(column)
+            rows.sort(key=lambda r: r[index], reverse=desc)
+        end = None if self._limit is None else self._offset + self._limit
+        return [r[:len(shown)] for r in rows[self._offset:end]]
+
+    def _build(self, rows):
+        model = self.model
+        if self._values is not None:
+            return [tuple(r) for r in rows]
+        if self._only is None:
+            if model._identity_mapped:
+                return [model._hydrate(*r) for r in rows]
+            return [model._from_row(*r) for r in rows]
+        # partial instances are marked, so identity_map.register() never makes them canonical
+        positions = [self._only.index(c) if c in self._only else None for c in model._columns]
+        result = []
+        for r in rows:
+            cached = identity_map.lookup(model, r[0]) if model._identity_mapped else None
+            if cached is None:
+                cached = model._from_row(*(None if i is None else r[i] for i in positions))
+                if model._identity_mapped:
+                    cached._partial = True
+            result.append(cached)
+        return result
+
+    def _fetch(self):
+        if self._result is None:
+            self._result = self._build(self._rows())
+        return self._result
+
+    def __iter__(self):
+        return iter(self._fetch())
+
+    def __len__(self):
+        return len(self._fetch())
+
+    def __bool__(self):
+        return bool(self._fetch())
+
+    def first(self):
+        for obj in self.limit(1):
+            return obj
+        return None
+
+    def count(self):
+        """
+        Number of matching rows (within limit/offset), counted by SQLite.
+        """
+        if self._result is not None:
+            return len(self._result)
+        if not sharding.enabled() or not self.model._sharded:
+            sql, params = self._sql("count", limit=self._limit, offset=self._offset)
+            return fetch_all(sql, params)[0][0]
+        sql, params = self._sql("count")
+        total = sum(rows[0][0] for rows in sharding.gather(self._shard(), fetch_all, sql, params))
+        total = max(total - self._offset, 0)
+        return total if self._limit is None else min(total, self._limit)
+
+    def exists(self):
+        if self._result is not None:
+            return bool(self._result)
+        if self._offset or self._limit == 0:
+            return self.count() > 0
+        sql, params = self._sql("exists")
+        return any(rows for rows in sharding.gather(self._shard(), fetch_all, sql, params))
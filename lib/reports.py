@@ -0,0 +1,237 @@
+"""
+Parallel per-author and per-magazine reports.
+
+Entity ids are cut into chunks of chunk_size and spread over a pool of
+worker processes. Each worker opens its own read-only (mode=ro) connections
+and builds the reports of a whole chunk with a handful of batched IN (...)
+queries instead of one model call per entity. Reports reach the sink in id
+order, and at most a few chunks per worker are in flight, so memory stays
+bounded however many entities there are.
+
+    with open("reports.jsonl", "w") as f:
+        generate_reports(jsonl_sink(f), workers=8)
+
+    python -m lib.reports reports.jsonl --workers 8 --chunk-size 200
+
+Author reports hold the author's articles, magazines and topic areas;
+magazine reports hold contributors, article titles and contributing authors
+(CONTRIBUTING_MIN_ARTICLES or more articles), matching the model methods.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from lib import database_utils, result_cache, sharding
+from lib.database_utils import connection, select_in, stream
+
+REPORT_CHUNK_SIZE = 200
+CONTRIBUTING_MIN_ARTICLES = 3
+KINDS = ("author", "magazine")
+
+# chunks submitted per worker ahead of the one being written out
+_IN_FLIGHT_PER_WORKER = 2
+
+
+# --- Building reports (one chunk of ids per call) ---
+def _group(rows):
+    # rows whose first column is the entity id -> {id: [rest of row, ...]}
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[0], []).append(tuple(row)[1:])
+    return grouped
+
+
+def author_reports(ids):
+    """
+    Return the reports of the authors with the given ids (skipping unknown ids), in id order.
+    """
+    with connection() as conn:
+        names = dict(select_in(conn, "SELECT id, name FROM authors WHERE id IN ({placeholders})", ids))
+        articles = _group(select_in(conn, """
+            SELECT author_id, id, title, magazine_id FROM articles
+            WHERE author_id IN ({placeholders}) ORDER BY author_id, id
+        """, ids))
+        magazines = _group(select_in(conn, """
+            SELECT c.author_id, m.id, m.name, m.category
+            FROM magazine_author_counts c
+            JOIN magazines m ON m.id = c.magazine_id
+            WHERE c.author_id IN ({placeholders})
+            ORDER BY c.author_id, m.id
+        """, ids))
+    reports = []
+    for id in sorted(names):
+        mags = magazines.get(id, [])
+        reports.append({
+            "type": "author",
+            "id": id,
+            "name": names[id],
+            "articles": [{"id": a, "title": t, "magazine_id": m} for a, t, m in articles.get(id, [])],
+            "magazines": [{"id": m, "name": n, "category": c} for m, n, c in mags],
+            "topic_areas": sorted({c for _, _, c in mags}),
+        })
+    return reports
+
+
+def magazine_reports(ids):
+    """
+    Return the reports of the magazines with the given ids (skipping unknown ids), in id order.
+    """
+    with connection() as conn:
+        magazines = {r[0]: r for r in select_in(
+            conn, "SELECT id, name, category FROM magazines WHERE id IN ({placeholders})", ids
+        )}
+        contributors = _group(select_in(conn, """
+            SELECT c.magazine_id, au.id, au.name, c.article_count
+            FROM magazine_author_counts c
+            JOIN authors au ON au.id = c.author_id
+            WHERE c.magazine_id IN ({placeholders})
+            ORDER BY c.magazine_id, au.id
+        """, ids))
+        titles = _group(select_in(conn, """
+            SELECT magazine_id, title FROM articles
+            WHERE magazine_id IN ({placeholders}) ORDER BY magazine_id, id
+        """, ids))
+    reports = []
+    for id in sorted(magazines):
+        authors = contributors.get(id, [])
+        reports.append({
+            "type": "magazine",
+            "id": id,
+            "name": magazines[id][1],
+            "category": magazines[id][2],
+            "contributors": [{"id": a, "name": n} for a, n, _ in authors],
+            "titles": [t for (t,) in titles.get(id, [])],
+            "contributing_authors": [a for a, _, count in authors if count >= CONTRIBUTING_MIN_ARTICLES],
+        })
+    return reports
+
+
+_BUILDERS = {"author": author_reports, "magazine": magazine_reports}
+_TABLES = {"author": "authors", "magazine": "magazines"}
+
+
+def _build(kind, ids):
+    return _BUILDERS[kind](ids)
+
+
+# --- Worker processes ---
+def read_only_uri(db_file):
+    return f"{Path(db_file).absolute().as_uri()}?mode=ro"
+
+
+def _init_worker(uri):
+    # each worker reads through its own pool of read-only connections
+    database_utils.configure_pool(db_file=uri)
+    result_cache.configure(capacity=0)
+
+
+def _chunks(kinds, chunk_size):
+    for kind in kinds:
+        ids = (row[0] for row in stream(f"SELECT id FROM {_TABLES[kind]} ORDER BY id"))
+        for chunk in database_utils.batched(ids, chunk_size):
+            yield kind, chunk
+
+
+class ReportRun:
+    """
+    Counts and timing of a generate_reports() call.
+    """
+
+    __slots__ = ("reports", "chunks", "seconds", "workers")
+
+    def __init__(self, workers):
+        self.reports = 0
+        self.chunks = 0
+        self.seconds = 0.0
+        self.workers = workers
+
+    @property
+    def reports_per_second(self):
+        return self.reports / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return (f"<ReportRun reports={self.reports} workers={self.workers} "
+                f"{self.reports_per_second:,.0f} reports/s>")
+
+
+def generate_reports(sink, kinds=KINDS, workers=None, chunk_size=REPORT_CHUNK_SIZE):
+    """
+    Build the reports of every entity of the given kinds and pass each one
+    (a dict) to sink, authors then magazines, in id order. workers defaults
+    to the number of CPUs; workers=0 builds them in this process.
+    """
+    if sharding.enabled():
+        raise Exception("Reports read a single database file; sharding is not supported.")
+    if database_utils.is_uri(database_utils.DB_FILE):
+        raise Exception("Reports need an on-disk database that worker processes can open.")
+    for kind in kinds:
+        if kind not in _BUILDERS:
+            raise Exception(f"Unknown report kind {kind!r}; expected one of {', '.join(KINDS)}.")
+    workers = os.cpu_count() if workers is None else workers
+    run = ReportRun(workers)
+    start = time.perf_counter()
+
+    def emit(reports):
+        for report in reports:
+            sink(report)
+        run.reports += len(reports)
+        run.chunks += 1
+
+    if not workers:
+        for kind, ids in _chunks(kinds, chunk_size):
+            emit(_build(kind, ids))
+    else:
+        # spawn, not fork: a forked child must not touch the parent's open SQLite connections
+        context = multiprocessing.get_context("spawn")
+        uri = read_only_uri(database_utils.DB_FILE)
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(uri,)) as pool:
+            pending = deque()
+            for kind, ids in _chunks(kinds, chunk_size):
+                pending.append(pool.submit(_build, kind, ids))
+                if len(pending) >= workers * _IN_FLIGHT_PER_WORKER:
+                    emit(pending.popleft().result())
+            while pending:
+                emit(pending.popleft().result())
+    run.seconds = time.perf_counter() - start
+    return run
+
+
+def jsonl_sink(f):
+    """
+    Sink writing each report as one JSON line to the text file f.
+    """
+    def write(report):
+        f.write(json.dumps(report, ensure_ascii=False))
+        f.write("\n")
+    return write
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write per-author and per-magazine reports as JSON lines.")
+    parser.add_argument("out", help="output file ('-' for stdout)")
+    parser.add_argument("--db", help=f"database file (default: {database_utils.DB_FILE})")
+    parser.add_argument("--kind", choices=KINDS, action="append", help="report kind (default: both)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count, 0 = in-process)")
+    parser.add_argument("--chunk-size", type=int, default=REPORT_CHUNK_SIZE, help="entities per batch")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        database_utils.configure_pool(db_file=args.db)
+    kinds = args.kind or KINDS
+    if args.out == "-":
+        run = generate_reports(jsonl_sink(sys.stdout), kinds, args.workers, args.chunk_size)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            run = generate_reports(jsonl_sink(f), kinds, args.workers, args.chunk_size)
+    print(f"{run.reports:,} reports in {run.seconds:.1f}s with {run.workers} workers "
+          f"({run.reports_per_second:,.0f} reports/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Result cache for relationship and aggregate queries.
+
+Entries are keyed by method and arguments, expire after `ttl` seconds and
+are evicted least-recently-used beyond `capacity`. Each entry carries tags
+such as ("magazine", 7) or ("author", 3); model writes invalidate exactly
+the tags they touch (see the models' _cache_tags()).
+
+Writes from other connections or processes are caught with PRAGMA
+data_version on a dedicated watcher connection per database file: when it
+changes for a reason other than our own tagged writes, the whole cache is
+dropped. It is checked on reads and right before each of our own commits,
+so a local write can't hide an external one made before it.
+"""
+import functools
+import inspect
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from lib import database_utils, identity_map, sharding
+
+DEFAULT_CAPACITY = 1024
+DEFAULT_TTL = 60.0
+
+
+class ResultCache:
+    """
+    Bounded, TTL-limited LRU of query results with tag-based invalidation.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, ttl=DEFAULT_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.external_flushes = 0
+        self._entries = OrderedDict()   # key -> (value, expires_at, tags)
+        self._tags = {}                 # tag -> set of keys
+        self._generation = 0            # bumped by every invalidation
+        self._watchers = {}             # db file -> [connection, last data_version]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    # --- Watching for writes from elsewhere ---
+    def _watched_files(self):
+        return [database_utils.DB_FILE, *sharding.shard_files()]
+
+    def _data_versions(self, on_disk_only=False):
+        # caller holds self._lock; returns True when any watched file changed
+        files = self._watched_files()
+        changed = False
+        for stale in set(self._watchers) - set(files):
+            self._watchers.pop(stale)[0].close()
+        for db_file in files:
+            if on_disk_only and database_utils.is_uri(db_file):
+                # the in-memory database (lib.memory) locks readers out while a
+                # write is open, and only this process can write to it anyway
+                continue
+            watcher = self._watchers.get(db_file)
+            if watcher is None:
+                conn = sqlite3.connect(db_file, check_same_thread=False, uri=database_utils.is_uri(db_file))
+                watcher = self._watchers[db_file] = [conn, None]
+                # a database we haven't seen: nothing cached can be from it
+                changed = True
+            version = watcher[0].execute("PRAGMA data_version").fetchone()[0]
+            if version != watcher[1]:
+                watcher[1] = version
+                changed = True
+        return changed
+
+    def _check_external(self, on_disk_only=False):
+        if self._data_versions(on_disk_only) and self._entries:
+            self.external_flushes += 1
+            self._clear_entries()
+
+    def before_commit(self, conn):
+        # called while our write holds the lock: any change seen now is someone
+        # else's, and must not be absorbed by invalidate()'s re-baselining
+        if self.enabled:
+            with self._lock:
+                self._check_external(on_disk_only=True)
+
+    # --- Entries ---
+    def get(self, key):
+        """
+        Return (True, value) for a live entry, else (False, None).
+        """
+        with self._lock:
+            self._check_external()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            if entry[1] < time.monotonic():
+                self.expirations += 1
+                self.misses += 1
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def generation(self):
+        return self._generation
+
+    def put(self, key, value, tags, generation):
+        """
+        Store value unless an invalidation happened since `generation` was
+        read (the value may then already be stale).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, time.monotonic() + self.ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.capacity:
+                self.evictions += 1
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _clear_entries(self):
+        self._entries.clear()
+        self._tags.clear()
+        self._generation += 1
+
+    def invalidate(self, tags):
+        """
+        Drop the entries carrying any of tags after a write we made ourselves.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self.invalidations += 1
+                    self._remove(key)
+            # our own commit moved data_version; don't mistake it for an external
+            # write (those before it were caught by before_commit())
+            self._data_versions()
+
+    def clear(self):
+        with self._lock:
+            self._clear_entries()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+            self.invalidations = self.external_flushes = 0
+
+    def close(self):
+        with self._lock:
+            self._clear_entries()
+            for conn, _ in self._watchers.values():
+                conn.close()
+            self._watchers.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "external_flushes": self.external_flushes,
+        }
+
+
+_cache = ResultCache()
+
+
+def process_cache():
+    return _cache
+
+
+def configure(capacity=DEFAULT_CAPACITY, ttl=DEFAULT_TTL):
+    """
+    Replace the process-wide cache. capacity=0 disables result caching.
+    """
+    global _cache
+    previous, _cache = _cache, ResultCache(capacity, ttl)
+    previous.close()
+    return _cache
+
+
+def invalidate(tags):
+    _cache.invalidate(tags)
+
+
+@database_utils.add_commit_listener
+def _before_commit(conn):
+    _cache.before_commit(conn)
+
+
+def stats():
+    return _cache.stats()
+
+
+def _key_part(value):
+    # models are keyed by class and id, everything else by value
+    if hasattr(value, "_table"):
+        return (type(value).__name__, value.id)
+    return value
+
+
+def cached(tags):
+    """
+    Decorator caching a method's result under its name and arguments.
+    tags(*args, result) returns the tags the entry depends on, with args
+    bound to the method's parameters (defaults filled in). List and dict
+    results are copied on the way out, so callers can't modify the cached value.
+    Calls on unsaved objects, or inside an identity_scope(), bypass the cache.
+    """
+    def decorate(fn):
+        name = fn.__qualname__
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = _cache
+            if not cache.enabled or identity_map.current() is not identity_map.process_map():
+                return fn(*args, **kwargs)
+            # bind with defaults, so f(), f(10) and f(n=10) share one entry
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            values = bound.arguments.values()
+            if any(getattr(arg, "_table", None) and arg.id is None for arg in values):
+                return fn(*args, **kwargs)
+            key = (name, *map(_key_part, values))
+            hit, value = cache.get(key)
+            if not hit:
+                generation = cache.generation()
+                value = fn(*bound.args, **bound.kwargs)
+                cache.put(key, value, tags(*bound.args, value, **bound.kwargs), generation)
+            if isinstance(value, (list, dict)):
+                return type(value)(value)
+            return value
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,227 @@
+import threading
+from itertools import groupby
+
+from lib import identity_map
+from lib import result_cache
+from lib import sharding
+from lib import writer as _writer
+from lib.database_utils import in_transaction, on_commit, transaction, update_sql
+
+_local = threading.local()
+
+
+def current_session():
+    """
+    Return the innermost Session open on this thread, or None.
+    """
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def changed_columns(obj):
+    """
+    Return {column: value} for the columns of obj that differ from the state
+    it was loaded or last saved with (every column for unsaved objects).
+    """
+    values = obj._column_values()
+    loaded = obj._loaded
+    if loaded is None:
+        return values
+    return {col: val for (col, val), old in zip(values.items(), loaded) if old != val}
+
+
+def mark_clean(obj):
+    """
+    Record the current column values of obj as its persisted state
+    (a tuple in _column_values() order, to keep instances small).
+    """
+    obj._loaded = tuple(obj._column_values().values())
+
+
+def after_save(objs, inserted=()):
+    """
+    Called once objs are written (inserted: those given new ids). When the
+    transaction commits, mark them clean, register them in the identity map,
+    copy directory rows to the shards and drop the cached results they touch.
+    If it rolls back, take the new ids back and evict the others from the
+    identity map, as their state in memory was never committed.
+    """
+    tags = {tag for obj in objs for tag in obj._cache_tags()}
+
+    def committed():
+        for obj in objs:
+            mark_clean(obj)
+            if obj._identity_mapped:
+                identity_map.register(obj)
+        sharding.replicate(objs)
+        result_cache.invalidate(tags)
+
+    def rolled_back():
+        new = {id(obj) for obj in inserted}
+        for obj in objs:
+            if id(obj) in new:
+                obj.id = None
+            elif obj._identity_mapped:
+                identity_map.invalidate(type(obj), obj.id)
+
+    on_commit(committed, rolled_back)
+
+
+def track(obj):
+    """
+    Called by model setters: register obj with the active session, if any.
+    """
+    session = current_session()
+    if session is not None:
+        session.add(obj)
+
+
+def defer(obj):
+    """
+    Called by save(): queue obj on the active session instead of writing now,
+    or, with a write queue configured (lib.writer), hand it to the writer
+    thread and wait for the group commit. Returns True when save() is done.
+    Inside an open transaction the write stays on this thread's connection:
+    the writer would wait for the lock the caller holds, and the write
+    belongs to the caller's transaction.
+    """
+    session = current_session()
+    if session is not None:
+        session.add(obj)
+        return True
+    queue = _writer.current()
+    if queue is None or queue.on_writer_thread or in_transaction():
+        return False
+    queue.save(obj)
+    return True
+
+
+class Session:
+    """
+    Unit of work: collects new and modified Authors, Magazines and Articles and
+    writes only their changed columns in one transaction when the block exits.
+
+        with Session() as session:
+            session.add(Author("Ada"))
+            magazine.name = "Renamed"   # setters register the object
+            author.add_article(magazine, "Title")   # save() is deferred
+
+    Authors and magazines are flushed before articles, so an article may
+    reference objects that only get their ids during the flush.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._statements = []
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.stack.remove(self)
+        if exc_type is None:
+            self.flush()
+        else:
+            self._pending.clear()
+            self._statements.clear()
+        return False
+
+    def add(self, obj):
+        """
+        Track obj (and any unsaved author/magazine it refers to).
+        """
+        self._pending.setdefault(id(obj), obj)
+        for related in obj._related():
+            if related.id is None and id(related) not in self._pending:
+                self.add(related)
+        return obj
+
+    def execute(self, sql, params=()):
+        """
+        Run sql in the flush transaction, after the pending objects are
+        written. With sharding that is the directory's transaction, which
+        commits before the shards' ones.
+        """
+        self._statements.append((sql, params))
+
+    @property
+    def new(self):
+        return [obj for obj in self._pending.values() if obj.id is None]
+
+    @property
+    def dirty(self):
+        return [obj for obj in self._pending.values() if obj.id is not None and changed_columns(obj)]
+
+    def flush(self):
+        """
+        Write all pending changes in dependency order inside one transaction.
+        """
+        pending = sorted(self._pending.values(), key=lambda obj: obj._flush_order)
+        statements, self._statements = self._statements, []
+        self._pending = {}
+        tags = {tag for obj in pending for tag in obj._cache_tags()}
+        new = [obj for obj in pending if obj.id is None]
+        try:
+            if not sharding.enabled():
+                self._flush_objects(pending, statements)
+                after_save(pending, new)
+            else:
+                # directory rows first (replicated once committed), then one transaction per shard
+                local = [obj for obj in pending if not obj._sharded]
+                self._flush_objects(local, statements)
+                after_save(local, new)
+                sharded = [obj for obj in pending if obj._sharded]
+                # objects changing shards are moved one by one (insert there, delete here)
+                moving = [(obj, obj._moved_from()) for obj in sharded]
+                staying = [obj for obj, source in moving if source is None]
+                for shard, objs in sharding.partition(staying, key=lambda obj: obj._shard_key()).items():
+                    sharding.run_on(shard, self._flush_objects, objs)
+                    sharding.run_on(shard, after_save, objs, new)
+                for obj, source in moving:
+                    if source is not None:
+                        obj._move(source)
+                        sharding.run_on(sharding.shard_of(obj._shard_key()), after_save, [obj])
+        finally:
+            result_cache.invalidate(tags)
+
+    def _flush_objects(self, pending, statements=()):
+        inserted = []
+        try:
+            with transaction() as conn:
+                for _, stage in groupby(pending, key=lambda obj: obj._flush_order):
+                    stage = list(stage)
+                    new = [obj for obj in stage if obj.id is None]
+                    existing = [obj for obj in stage if obj.id is not None]
+                    self._flush_inserts(conn, new, inserted)
+                    self._flush_updates(conn, existing)
+                for sql, params in statements:
+                    conn.execute(sql, params)
+        except BaseException:
+            # the rows were rolled back, so the ids handed out are not real
+            for obj in inserted:
+                obj.id = None
+            raise
+
+    @staticmethod
+    def _flush_inserts(conn, objs, inserted):
+        for cls, group in groupby(sorted(objs, key=lambda obj: type(obj).__name__), key=type):
+            group = list(group)
+            columns = list(group[0]._column_values())
+            inserted.extend(group)
+            sharding.insert_rows(conn, cls._table, columns, group, lambda obj: tuple(obj._column_values().values()))
+
+    @staticmethod
+    def _flush_updates(conn, objs):
+        # one executemany per (table, set of changed columns)
+        batches = {}
+        for obj in objs:
+            changes = changed_columns(obj)
+            if changes:
+                key = (type(obj)._table, tuple(changes))
+                batches.setdefault(key, []).append((*changes.values(), obj.id))
+        for (table, columns), params in batches.items():
+            conn.executemany(update_sql(table, columns), params)
@@ -0,0 +1,443 @@
+"""
+Horizontal sharding: articles partitioned across several SQLite files.
+
+The process-wide pool (DB_FILE) becomes the directory database and owns
+authors and magazines. Each shard file has the full schema and holds the
+articles of the magazines with magazine_id % N == shard, plus a replica of
+authors and magazines, so the JOIN queries and counter triggers run
+unchanged on every shard.
+
+Article ids stay unique across shards: above the shard set's id floor,
+shard i only hands out ids with id % N == i, so find_by_id() routes by id.
+Ids at or below the floor predate the split and are looked up on every shard.
+
+Files are committed independently: authors and magazines are written to
+the directory first and then replicated, and a write spanning several
+shards is one transaction per shard. Moving an article to a magazine on
+another shard inserts it there (under a new id, in that shard's stride) and
+then deletes the original.
+
+    python -m lib.sharding split magazine.db --directory dir.db s0.db s1.db s2.db
+    python -m lib.sharding rebalance dir.db --from s0.db s1.db --to n0.db n1.db n2.db
+"""
+import argparse
+import heapq
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from lib import database_utils
+from lib.database_utils import ConnectionPool, connection, insert_batch, stream, transaction
+
+# columns replicated from the directory into every shard
+REPLICATED = {"authors": ("name",), "magazines": ("name", "category")}
+
+_shards = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class ShardSet:
+    """
+    Connection pools for the shard files, plus the threads that run
+    scatter-gather queries against them in parallel.
+    """
+
+    def __init__(self, shard_files, pool_size=None):
+        if not shard_files:
+            raise Exception("At least one shard file is required.")
+        self.files = [str(f) for f in shard_files]
+        self.count = len(self.files)
+        self.pools = [ConnectionPool(f, pool_size) for f in self.files]
+        floors = []
+        for index, pool in enumerate(self.pools):
+            with connection(pool) as conn:
+                floors.append(_claim(conn, index, self.count))
+        self.id_floor = max(floors)
+        self._executor = ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="db-shard")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for pool in self.pools:
+            pool.close()
+
+
+def _claim(conn, index, count, id_floor=0):
+    """
+    Record which shard (of how many) the file behind conn is and return its
+    id floor. Opening a file under a different layout would misroute rows,
+    so a mismatch raises.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS shard_info ("
+        "shard INTEGER NOT NULL, shard_count INTEGER NOT NULL, id_floor INTEGER NOT NULL)"
+    )
+    row = conn.execute("SELECT shard, shard_count, id_floor FROM shard_info").fetchone()
+    if row is None:
+        conn.execute("INSERT INTO shard_info VALUES (?, ?, ?)", (index, count, id_floor))
+        conn.commit()
+        return id_floor
+    if (row[0], row[1]) != (index, count):
+        raise Exception(f"Shard file is shard {row[0]} of {row[1]}, not shard {index} of {count}.")
+    return row[2]
+
+
+def _upsert_sql(table, columns):
+    # never INSERT OR REPLACE: deleting the old row would cascade to its articles
+    names = ", ".join(("id", *columns))
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns)
+    return f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * (len(columns) + 1))}) " \
+           f"ON CONFLICT (id) DO UPDATE SET {updates}"
+
+
+def _sync_replicas(conn, directory_file):
+    """
+    Upsert every author and magazine from the directory into the shard behind
+    conn. Rows whose contents already match are read but not rewritten.
+    """
+    conn.execute("ATTACH DATABASE ? AS directory", (directory_file,))
+    try:
+        for table, columns in REPLICATED.items():
+            names = ", ".join(("id", *columns))
+            updates = ", ".join(f"{col} = excluded.{col}" for col in columns)
+            changed = " OR ".join(f"{col} IS NOT excluded.{col}" for col in columns)
+            # "WHERE true" keeps SQLite from reading ON CONFLICT as a join constraint
+            conn.execute(
+                f"INSERT INTO main.{table} ({names}) SELECT {names} FROM directory.{table} WHERE true "
+                f"ON CONFLICT (id) DO UPDATE SET {updates} WHERE {changed}"
+            )
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE directory")
+
+
+# --- Configuration ---
+def configure(shard_files, directory=None, pool_size=None):
+    """
+    Turn sharding on: articles are routed to shard_files, and the process-wide
+    pool (or `directory`, which then becomes DB_FILE) is the directory database.
+    Shard files are created and migrated as needed, and their author and
+    magazine replicas are brought up to date with the directory.
+    """
+    global _shards
+    if directory is not None:
+        database_utils.configure_pool(db_file=directory)
+    with connection() as conn:
+        if conn.execute("SELECT 1 FROM articles LIMIT 1").fetchone() is not None:
+            raise Exception("The directory database still holds articles; split it into shards first.")
+    shards = ShardSet(shard_files, pool_size)
+    # compare every row: a rename made while sharding was off changes no count or max id
+    for pool in shards.pools:
+        with connection(pool) as conn:
+            _sync_replicas(conn, database_utils.DB_FILE)
+    with _lock:
+        previous, _shards = _shards, shards
+    if previous is not None:
+        previous.close()
+    return shards
+
+
+def disable():
+    """
+    Turn sharding off and close the shard pools.
+    """
+    global _shards
+    with _lock:
+        previous, _shards = _shards, None
+    if previous is not None:
+        previous.close()
+
+
+def enabled():
+    return _shards is not None
+
+
+def shard_files():
+    """
+    The configured shard files ([] without sharding).
+    """
+    shards = _shards
+    return [] if shards is None else list(shards.files)
+
+
+def shard_indexes():
+    """
+    [0, 1, ..., N - 1] with sharding, or [None] (the one unsharded database).
+    """
+    shards = _shards
+    return [None] if shards is None else list(range(shards.count))
+
+
+# --- Routing ---
+def shard_of(magazine_id):
+    """
+    Shard holding the articles of magazine_id (None without sharding).
+    """
+    shards = _shards
+    if shards is None or magazine_id is None:
+        return None
+    return magazine_id % shards.count
+
+
+def article_shard(article_id):
+    """
+    Shard holding article_id, or None when it can't be told from the id
+    (no sharding, or an id from before the split).
+    """
+    shards = _shards
+    if shards is None or article_id is None or article_id <= shards.id_floor:
+        return None
+    return article_id % shards.count
+
+
+def run_on(shard, fn, *args):
+    """
+    Call fn(*args) with connection() bound to the given shard, so model code
+    runs against it unchanged. With shard None (or no sharding) just call fn.
+    """
+    shards = _shards
+    current = getattr(_local, "shard", None)
+    if shards is None or shard is None or shard == current:
+        return fn(*args)
+    previous = database_utils.thread_connection()
+    with connection(shards.pools[shard]) as conn:
+        database_utils.bind_thread_connection(conn)
+        _local.shard = shard
+        try:
+            return fn(*args)
+        finally:
+            database_utils.bind_thread_connection(previous)
+            _local.shard = current
+
+
+def scatter(fn, *args):
+    """
+    Return [fn(*args) on each shard], run in parallel, in shard order.
+    Without sharding this is just [fn(*args)].
+    """
+    shards = _shards
+    if shards is None:
+        return [fn(*args)]
+    if shards.count == 1 or getattr(_local, "shard", None) is not None:
+        # already on a shard thread: don't wait on the (possibly busy) executor
+        return [run_on(index, fn, *args) for index in range(shards.count)]
+    origin = database_utils.current_origin()
+    futures = [shards._executor.submit(_run_for, origin, index, fn, args) for index in range(shards.count)]
+    return [future.result() for future in futures]
+
+
+def _run_for(origin, shard, fn, args):
+    # executor side of scatter(): instrumentation credits the scattering call
+    with database_utils.query_origin(origin):
+        return run_on(shard, fn, *args)
+
+
+def gather(shard, fn, *args):
+    """
+    Return fn(*args) results as a list: from `shard` only, or from every
+    shard when shard is None.
+    """
+    if shard is None:
+        return scatter(fn, *args)
+    return [run_on(shard, fn, *args)]
+
+
+def streams(shard, sql, params=(), chunk_size=None):
+    """
+    stream() generators for sql: one for `shard`, or one per shard when
+    shard is None (a single generator without sharding).
+    """
+    shards = _shards
+    if shards is None:
+        return [stream(sql, params, chunk_size)]
+    pools = shards.pools if shard is None else [shards.pools[shard]]
+    return [stream(sql, params, chunk_size, pool) for pool in pools]
+
+
+def merge(results, key, reverse=False):
+    """
+    Merge per-shard lists that are each sorted by key into one sorted list.
+    """
+    if len(results) == 1:
+        return results[0]
+    return list(heapq.merge(*results, key=key, reverse=reverse))
+
+
+def partition(objs, key):
+    """
+    Group objs by shard of key(obj) (a magazine id): {shard: [objs]}.
+    Without sharding everything lands under None.
+    """
+    if _shards is None:
+        return {None: list(objs)}
+    groups = {}
+    for obj in objs:
+        groups.setdefault(shard_of(key(obj)), []).append(obj)
+    return groups
+
+
+def same_shard(magazine_id, other_magazine_id):
+    return shard_of(magazine_id) == shard_of(other_magazine_id)
+
+
+# --- Writes ---
+def _next_id_sql(table, shard, count, id_floor):
+    # smallest id above the table's max id, its AUTOINCREMENT high-water mark
+    # (so ids of deleted or moved rows are never handed out again) and the
+    # floor, with id % count == shard
+    return (
+        f"SELECT b + {count} - ((b - {shard}) % {count} + {count}) % {count} "
+        f"FROM (SELECT MAX(COALESCE(MAX(id), 0), "
+        f"COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0), {id_floor}) AS b FROM {table})"
+    )
+
+
+def insert_rows(conn, table, columns, batch, params):
+    """
+    INSERT a batch of new objects into table and assign their ids. On a
+    shard (inside run_on) ids are allocated with the shard's stride; otherwise
+    this is a plain insert (database_utils.insert_batch for several rows).
+    """
+    names = ", ".join(columns)
+    marks = ", ".join("?" * len(columns))
+    shards = _shards
+    shard = getattr(_local, "shard", None)
+    if shards is None or shard is None:
+        sql = f"INSERT INTO {table} ({names}) VALUES ({marks})"
+        if len(batch) == 1:
+            batch[0].id = conn.execute(sql, params(batch[0])).lastrowid
+        else:
+            insert_batch(conn, sql, batch, params)
+        return
+    first, rest = batch[0], batch[1:]
+    next_id = _next_id_sql(table, shard, shards.count, shards.id_floor)
+    first.id = conn.execute(f"INSERT INTO {table} (id, {names}) VALUES (({next_id}), {marks})", params(first)).lastrowid
+    if rest:
+        # the first insert holds the write lock, so the following ids are free
+        conn.executemany(
+            f"INSERT INTO {table} (id, {names}) VALUES (?, {marks})",
+            [(first.id + shards.count * n, *params(obj)) for n, obj in enumerate(rest, 1)],
+        )
+        for n, obj in enumerate(rest, 1):
+            obj.id = first.id + shards.count * n
+
+
+def replicate(objs):
+    """
+    Upsert saved authors/magazines from the directory into every shard.
+    No-op without sharding.
+    """
+    if _shards is None:
+        return
+    groups = {}
+    for obj in objs:
+        if obj._table in REPLICATED:
+            groups.setdefault(obj._table, []).append((obj.id, *obj._column_values().values()))
+    if not groups:
+        return
+
+    def write():
+        with transaction() as conn:
+            for table, rows in groups.items():
+                conn.executemany(_upsert_sql(table, REPLICATED[table]), rows)
+
+    scatter(write)
+
+
+# --- Splitting and rebalancing ---
+def _build_shards(directory, sources, shard_files):
+    """
+    Fill new shard files from the directory (authors, magazines) and the
+    article sources, routing articles by magazine_id % len(shard_files).
+    Returns {shard file: article count}.
+    """
+    existing = [f for f in shard_files if Path(f).exists()]
+    if existing:
+        raise Exception(f"Shard files must not exist yet: {', '.join(map(str, existing))}")
+    id_floor = 0
+    for source in sources:
+        # a plain connection: the sources are only read, never migrated
+        conn = sqlite3.connect(str(source))
+        try:
+            id_floor = max(id_floor, conn.execute(
+                "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'articles'), 0),"
+                " COALESCE((SELECT MAX(id) FROM articles), 0))"
+            ).fetchone()[0])
+        finally:
+            conn.close()
+    counts = {}
+    count = len(shard_files)
+    for index, shard_file in enumerate(shard_files):
+        pool = ConnectionPool(str(shard_file), 1)
+        with connection(pool) as conn:
+            _sync_replicas(conn, str(directory))
+            for source in sources:
+                conn.execute("ATTACH DATABASE ? AS source", (str(source),))
+                # the insert triggers fill the counter tables and the search index
+                conn.execute(
+                    "INSERT INTO main.articles (id, title, author_id, magazine_id) "
+                    "SELECT id, title, author_id, magazine_id FROM source.articles "
+                    "WHERE magazine_id % ? = ? ORDER BY id",
+                    (count, index),
+                )
+                conn.commit()
+                conn.execute("DETACH DATABASE source")
+            _claim(conn, index, count, id_floor)
+            counts[str(shard_file)] = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+        pool.close()
+    return counts
+
+
+def split(source, directory, shard_files):
+    """
+    Split an unsharded database into a new directory database (authors and
+    magazines) and new shard files (articles). source is left untouched.
+    Returns {shard file: article count}.
+    """
+    if Path(directory).exists():
+        raise Exception(f"Directory database must not exist yet: {directory}")
+    pool = ConnectionPool(str(directory), 1)
+    with connection(pool) as conn:
+        conn.execute("ATTACH DATABASE ? AS source", (str(source),))
+        for table, columns in REPLICATED.items():
+            names = ", ".join(("id", *columns))
+            conn.execute(f"INSERT INTO main.{table} ({names}) SELECT {names} FROM source.{table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE source")
+    pool.close()
+    return _build_shards(directory, [source], shard_files)
+
+
+def rebalance(directory, old_shard_files, new_shard_files):
+    """
+    Redistribute the articles of old_shard_files over new_shard_files (any
+    number of them). The old files are left untouched; configure() the new
+    set to switch over.
+    """
+    return _build_shards(directory, old_shard_files, new_shard_files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a database into shards, or rebalance shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    split_cmd = commands.add_parser("split", help="split an unsharded database")
+    split_cmd.add_argument("source")
+    split_cmd.add_argument("--directory", required=True, help="new directory database")
+    split_cmd.add_argument("shards", nargs="+", help="new shard files")
+    rebalance_cmd = commands.add_parser("rebalance", help="move articles to a new set of shards")
+    rebalance_cmd.add_argument("directory")
+    rebalance_cmd.add_argument("--from", dest="old", nargs="+", required=True, help="current shard files")
+    rebalance_cmd.add_argument("--to", dest="new", nargs="+", required=True, help="new shard files")
+    args = parser.parse_args(argv)
+
+    if args.command == "split":
+        counts = split(args.source, args.directory, args.shards)
+    else:
+        counts = rebalance(args.directory, args.old, args.new)
+    for shard_file, count in counts.items():
+        print(f"{shard_file}: {count} articles")
+
+
+if __name__ == "__main__":
+    main()
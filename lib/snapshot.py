@@ -0,0 +1,218 @@
+"""
+Columnar in-memory snapshot of authors, magazines and articles for analytics.
+
+Ids are held in typed `array` columns (8-byte ints, no per-row objects) and
+magazine categories are dictionary-encoded. The aggregates compute results
+for every entity in one pass: with NumPy installed they run vectorized over
+zero-copy views of the arrays, otherwise on collections.Counter.
+
+    snap = Snapshot.load()
+    snap.top_publishers(10)          # [(magazine_id, article_count), ...]
+    snap.refresh()                   # append rows added since the last load
+
+refresh() only picks up rows with a higher id than the last one loaded (per
+shard, when sharded); use reload() after updates or deletes.
+"""
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from lib import sharding
+from lib.database_utils import STREAM_CHUNK_SIZE, batched, stream
+
+try:
+    import numpy as np
+except ImportError:  # optional: the pure-Python paths give the same results
+    np = None
+
+ID_TYPECODE = "q"
+
+
+class Snapshot:
+    """
+    Typed-column copy of the three tables; see the module docstring.
+    """
+
+    def __init__(self, use_numpy=None):
+        if use_numpy and np is None:
+            raise Exception("NumPy is not installed.")
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        # authors
+        self.author_ids = array(ID_TYPECODE)
+        self.author_names = []
+        # magazines; category codes index into self.categories
+        self.magazine_ids = array(ID_TYPECODE)
+        self.magazine_names = []
+        self.magazine_categories = array(ID_TYPECODE)
+        self.categories = []
+        self._category_codes = {}
+        # articles (titles are not loaded)
+        self.article_ids = array(ID_TYPECODE)
+        self.article_authors = array(ID_TYPECODE)
+        self.article_magazines = array(ID_TYPECODE)
+        # last loaded id per table; articles per shard
+        self._last_author = 0
+        self._last_magazine = 0
+        self._last_article = {}
+
+    def __repr__(self):
+        return (f"<Snapshot authors={len(self.author_ids)} magazines={len(self.magazine_ids)} "
+                f"articles={len(self.article_ids)}>")
+
+    @classmethod
+    def load(cls, use_numpy=None):
+        snap = cls(use_numpy)
+        snap.refresh()
+        return snap
+
+    def reload(self):
+        """
+        Drop everything and load the tables again.
+        """
+        self.__init__(self.use_numpy)
+        return self.refresh()
+
+    def refresh(self, chunk_size=None):
+        """
+        Append the rows added since the last load and return how many there were.
+        """
+        size = chunk_size or STREAM_CHUNK_SIZE
+        added = 0
+        # articles first: any author or magazine they reference is then loaded below
+        sql = "SELECT id, author_id, magazine_id FROM articles WHERE id > ? ORDER BY id"
+        for shard in sharding.shard_indexes():
+            [rows] = sharding.streams(shard, sql, (self._last_article.get(shard, 0),), size)
+            for chunk in batched(rows, size):
+                # transpose in C rather than appending row by row
+                ids, authors, magazines = zip(*chunk)
+                self.article_ids.extend(ids)
+                self.article_authors.extend(authors)
+                self.article_magazines.extend(magazines)
+                self._last_article[shard] = ids[-1]
+                added += len(ids)
+        rows = stream("SELECT id, name FROM authors WHERE id > ? ORDER BY id", (self._last_author,), size)
+        for chunk in batched(rows, size):
+            ids, names = zip(*chunk)
+            self.author_ids.extend(ids)
+            self.author_names.extend(names)
+            self._last_author = ids[-1]
+            added += len(ids)
+        sql = "SELECT id, name, category FROM magazines WHERE id > ? ORDER BY id"
+        for chunk in batched(stream(sql, (self._last_magazine,), size), size):
+            ids, names, categories = zip(*chunk)
+            self.magazine_ids.extend(ids)
+            self.magazine_names.extend(names)
+            self.magazine_categories.extend(map(self._category_code, categories))
+            self._last_magazine = ids[-1]
+            added += len(ids)
+        return added
+
+    def _category_code(self, category):
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    # --- Lookups ---
+    def author_name(self, author_id):
+        return self.author_names[self._position(self.author_ids, author_id)]
+
+    def magazine_name(self, magazine_id):
+        return self.magazine_names[self._position(self.magazine_ids, magazine_id)]
+
+    def magazine_category(self, magazine_id):
+        return self.categories[self.magazine_categories[self._position(self.magazine_ids, magazine_id)]]
+
+    @staticmethod
+    def _position(ids, id):
+        # ids are loaded in ascending order
+        index = bisect_left(ids, id)
+        if index == len(ids) or ids[index] != id:
+            raise Exception(f"id {id} is not in the snapshot.")
+        return index
+
+    # --- Vectorized aggregates ---
+    def _unique_counts(self, keys):
+        # numpy int64 array -> {key: count}
+        values, counts = np.unique(keys, return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    def article_counts(self):
+        """
+        {magazine_id: article count} for every magazine (0 when it has none).
+        """
+        counts = dict.fromkeys(self.magazine_ids, 0)
+        if self.use_numpy:
+            counts.update(self._unique_counts(np.frombuffer(self.article_magazines, dtype=np.int64)))
+        else:
+            counts.update(Counter(self.article_magazines))
+        return counts
+
+    def contribution_counts(self):
+        """
+        {(magazine_id, author_id): article count}: the magazine x author matrix, sparse.
+        """
+        if self.use_numpy:
+            magazines = np.frombuffer(self.article_magazines, dtype=np.int64)
+            authors = np.frombuffer(self.article_authors, dtype=np.int64)
+            width = int(authors.max()) + 1 if len(authors) else 1
+            return {divmod(key, width): count for key, count in self._unique_counts(magazines * width + authors).items()}
+        return dict(Counter(zip(self.article_magazines, self.article_authors)))
+
+    def top_publishers(self, n=10):
+        """
+        [(magazine_id, article count)] for the n magazines with most articles,
+        ties broken by id (the order Magazine.top_publishers uses).
+        """
+        counts = ((id, count) for id, count in self.article_counts().items() if count)
+        return heapq.nsmallest(n, counts, key=lambda item: (-item[1], item[0]))
+
+    def top_publisher(self):
+        """
+        Id of the magazine with the most articles, or None.
+        """
+        top = self.top_publishers(1)
+        return top[0][0] if top else None
+
+    def contributing_authors(self, min_articles=3):
+        """
+        {magazine_id: [author ids]} of authors with at least min_articles
+        articles in each magazine, for every magazine that has any.
+        """
+        result = {}
+        for (magazine_id, author_id), count in sorted(self.contribution_counts().items()):
+            if count >= min_articles:
+                result.setdefault(magazine_id, []).append(author_id)
+        return result
+
+    def author_category_histogram(self):
+        """
+        {author_id: {category: article count}} for every author with articles.
+        """
+        result = {}
+        for (author_id, code), count in self._author_category_counts().items():
+            result.setdefault(author_id, {})[self.categories[code]] = count
+        return result
+
+    def topic_areas(self):
+        """
+        {author_id: sorted unique categories} for every author with articles.
+        """
+        return {author_id: sorted(histogram) for author_id, histogram in self.author_category_histogram().items()}
+
+    def _author_category_counts(self):
+        # {(author_id, category code): article count}
+        if self.use_numpy:
+            magazine_ids = np.frombuffer(self.magazine_ids, dtype=np.int64)
+            codes = np.frombuffer(self.magazine_categories, dtype=np.int64)
+            # magazine id -> category code, as a dense lookup table
+            lookup = np.full(int(magazine_ids.max()) + 1 if len(magazine_ids) else 1, -1, dtype=np.int64)
+            lookup[magazine_ids] = codes
+            article_codes = lookup[np.frombuffer(self.article_magazines, dtype=np.int64)]
+            authors = np.frombuffer(self.article_authors, dtype=np.int64)
+            width = len(self.categories) or 1
+            return {divmod(key, width): count for key, count in self._unique_counts(authors * width + article_codes).items()}
+        code_of = dict(zip(self.magazine_ids, self.magazine_categories))
+        return dict(Counter(zip(self.article_authors, map(code_of.__getitem__, self.article_magazines))))
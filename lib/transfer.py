@@ -0,0 +1,330 @@
+"""
+Streaming bulk import/export of articles as CSV or JSONL.
+
+Every record is one article: title, author, magazine, category. Import
+resolves author and magazine names to ids through in-memory lookups
+(creating the ones it hasn't seen) and writes each chunk in one Session
+transaction, recording its progress under a checkpoint name in the same
+transaction so an interrupted import can resume. Export streams rows with
+fetchmany(), so memory stays flat in both directions.
+
+    python -m lib.transfer import articles.csv --checkpoint articles
+    python -m lib.transfer export dump.jsonl
+"""
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import multiprocessing
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from lib import database_utils, sharding
+from lib.article import Article
+from lib.author import Author
+from lib.database_utils import BULK_BATCH_SIZE, batched, fetch_all, stream, transaction
+from lib.magazine import Magazine
+from lib.session import Session
+
+FIELDS = ("title", "author", "magazine", "category")
+FORMATS = ("csv", "jsonl")
+
+# chunks handed to each parsing process ahead of the one being imported
+_IN_FLIGHT_PER_WORKER = 2
+
+
+class TransferReport:
+    """
+    Row count and timing of an import or export.
+    """
+
+    __slots__ = ("rows", "skipped", "seconds")
+
+    def __init__(self, rows=0, skipped=0, seconds=0.0):
+        self.rows = rows
+        self.skipped = skipped
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return f"<TransferReport rows={self.rows} skipped={self.skipped} {self.rows_per_second:,.0f} rows/s>"
+
+
+def detect_format(path, format=None):
+    if format is not None:
+        if format not in FORMATS:
+            raise Exception(f"Unknown format {format!r}; expected one of {', '.join(FORMATS)}.")
+        return format
+    if str(path).endswith(".csv"):
+        return "csv"
+    if str(path).endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise Exception(f"Can't tell the format of {path}; pass format='csv' or 'jsonl'.")
+
+
+@contextmanager
+def _open(path, mode):
+    # "-" is stdin/stdout
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+        return
+    with open(path, mode, newline="", encoding="utf-8") as f:
+        yield f
+
+
+# --- Parsing ---
+def _record(values, number):
+    if len(values) != len(FIELDS) or not all(isinstance(v, str) and v.strip() for v in values):
+        raise Exception(f"Record {number}: expected non-empty {', '.join(FIELDS)}.")
+    return values
+
+
+def read_records(f, format):
+    """
+    Generator of (title, author, magazine, category) tuples from a CSV
+    (with a header row) or JSONL text stream.
+    """
+    if format == "csv":
+        for number, row in enumerate(csv.DictReader(f), 1):
+            yield _record(tuple(row.get(field) for field in FIELDS), number)
+    else:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield _parse_json_line(line, number)
+
+
+def _parse_json_line(line, number):
+    try:
+        obj = json.loads(line)
+    except ValueError as e:
+        raise Exception(f"Record {number}: invalid JSON ({e}).") from None
+    return _record(tuple(obj.get(field) for field in FIELDS), number)
+
+
+def _parse_json_chunk(numbered_lines):
+    # runs in a worker process
+    return [_parse_json_line(line, number) for number, line in numbered_lines if line.strip()]
+
+
+def _record_chunks(f, format, chunk_size, workers):
+    """
+    Yield lists of records, parsed in `workers` processes when workers > 0.
+    """
+    if not workers:
+        yield from batched(read_records(f, format), chunk_size)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        # a bounded window of chunks in flight, so parsing can't run ahead of the writes
+        pending = deque()
+        for lines in batched(enumerate(f, 1), chunk_size):
+            pending.append(pool.apply_async(_parse_json_chunk, (lines,)))
+            if len(pending) >= workers * _IN_FLIGHT_PER_WORKER:
+                records = pending.popleft().get()
+                if records:
+                    yield records
+        while pending:
+            records = pending.popleft().get()
+            if records:
+                yield records
+
+
+# --- Checkpoints ---
+# A checkpoint is a named row of import_checkpoints (migration 7). Without
+# sharding it is written in the chunk's own transaction, so a resumed import
+# neither repeats nor skips records. With sharding the articles commit on the
+# shards after the directory does, so the checkpoint is written once they
+# have: a crash in between re-imports that one chunk (at-least-once).
+CHECKPOINT_SQL = """
+    INSERT INTO import_checkpoints (name, source, rows) VALUES (?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET rows = excluded.rows
+"""
+
+
+def read_checkpoint(checkpoint, source):
+    """
+    Number of records of source already imported according to checkpoint.
+    """
+    if checkpoint is None:
+        return 0
+    rows = fetch_all("SELECT source, rows FROM import_checkpoints WHERE name = ?", (checkpoint,))
+    if not rows:
+        return 0
+    if rows[0]["source"] != str(source):
+        raise Exception(f"Checkpoint {checkpoint} belongs to {rows[0]['source']!r}, not {str(source)!r}.")
+    return rows[0]["rows"]
+
+
+def write_checkpoint(checkpoint, source, rows):
+    with transaction() as conn:
+        conn.execute(CHECKPOINT_SQL, (checkpoint, str(source), rows))
+
+
+# --- Import ---
+class _NameLookup:
+    """
+    name -> id maps for authors and (name, category) -> id for magazines,
+    loaded once and extended as the import creates rows.
+    """
+
+    def __init__(self):
+        self.authors = {}
+        self.magazines = {}
+        for id, name in stream("SELECT id, name FROM authors ORDER BY id"):
+            self.authors.setdefault(name, id)
+        for id, name, category in stream("SELECT id, name, category FROM magazines ORDER BY id"):
+            self.magazines.setdefault((name, category), id)
+
+    def articles(self, records):
+        """
+        Build unsaved Articles for records; unknown authors and magazines
+        become unsaved instances shared within the chunk.
+        """
+        authors, magazines, articles = {}, {}, []
+        for title, author_name, magazine_name, category in records:
+            author = authors.get(author_name)
+            if author is None:
+                id = self.authors.get(author_name)
+                author = authors[author_name] = Author._from_row(id, author_name) if id else Author(author_name)
+            key = (magazine_name, category)
+            magazine = magazines.get(key)
+            if magazine is None:
+                id = self.magazines.get(key)
+                magazine = magazines[key] = Magazine._from_row(id, *key) if id else Magazine(*key)
+            articles.append(Article(title, author, magazine))
+        return articles, authors, magazines
+
+    def learn(self, authors, magazines):
+        for name, author in authors.items():
+            self.authors.setdefault(name, author.id)
+        for key, magazine in magazines.items():
+            self.magazines.setdefault(key, magazine.id)
+
+
+def import_articles(path, format=None, chunk_size=BULK_BATCH_SIZE, checkpoint=None, workers=0, progress=None):
+    """
+    Import the articles in path ("-" for stdin). Each chunk of chunk_size
+    records is written in one transaction, together with the progress
+    recorded under the name checkpoint; rerunning with the same checkpoint
+    skips the records already imported. workers > 0 parses JSONL in that
+    many processes. progress(report) is called after every chunk.
+    """
+    format = detect_format(path, format)
+    if workers and format != "jsonl":
+        # CSV records may span lines, so they can't be split between processes blindly
+        raise Exception("Parsing in worker processes is supported for JSONL input only.")
+    done = read_checkpoint(checkpoint, path)
+    report = TransferReport(skipped=done)
+    lookup = _NameLookup()
+    start = time.perf_counter()
+    with _open(path, "r") as f:
+        to_skip = done
+        for records in _record_chunks(f, format, chunk_size, workers):
+            if to_skip:
+                skipped = min(to_skip, len(records))
+                records, to_skip = records[skipped:], to_skip - skipped
+                if not records:
+                    continue
+            articles, authors, magazines = lookup.articles(records)
+            done += len(records)
+            with Session() as session:
+                for article in articles:
+                    session.add(article)
+                if checkpoint is not None and not sharding.enabled():
+                    session.execute(CHECKPOINT_SQL, (checkpoint, str(path), done))
+            if checkpoint is not None and sharding.enabled():
+                write_checkpoint(checkpoint, path, done)
+            lookup.learn(authors, magazines)
+            report.rows += len(records)
+            report.seconds = time.perf_counter() - start
+            if progress is not None:
+                progress(report)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+# --- Export ---
+EXPORT_SQL = """
+    SELECT a.id, a.title, au.name, m.name, m.category
+    FROM articles a
+    JOIN authors au ON au.id = a.author_id
+    JOIN magazines m ON m.id = a.magazine_id
+    ORDER BY a.id
+"""
+
+
+def iter_export_rows(chunk_size=None):
+    """
+    Generator of (title, author, magazine, category) in article id order,
+    streamed chunk_size rows at a time (merged across shards when sharded).
+    """
+    rows = sharding.streams(None, EXPORT_SQL, (), chunk_size)
+    for row in heapq.merge(*rows, key=lambda r: r[0]):
+        yield tuple(row)[1:]
+
+
+def export_articles(path, format=None, chunk_size=None, progress=None, progress_every=100_000):
+    """
+    Write every article to path ("-" for stdout) as CSV or JSONL.
+    """
+    format = detect_format(path, format)
+    report = TransferReport()
+    start = time.perf_counter()
+    with _open(path, "w") as f:
+        if format == "csv":
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+        rows = iter_export_rows(chunk_size)
+        while True:
+            # write in slices rather than row by row, reporting after each
+            chunk = list(itertools.islice(rows, progress_every))
+            if not chunk:
+                break
+            if format == "csv":
+                writer.writerows(chunk)
+            else:
+                f.writelines(json.dumps(dict(zip(FIELDS, values)), ensure_ascii=False) + "\n" for values in chunk)
+            report.rows += len(chunk)
+            report.seconds = time.perf_counter() - start
+            if progress is not None:
+                progress(report)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export articles as CSV or JSONL.")
+    parser.add_argument("--db", help=f"database file (default: {database_utils.DB_FILE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_cmd = commands.add_parser("import", help="import articles from a file ('-' for stdin)")
+    import_cmd.add_argument("path")
+    import_cmd.add_argument("--format", choices=FORMATS)
+    import_cmd.add_argument("--chunk-size", type=int, default=BULK_BATCH_SIZE)
+    import_cmd.add_argument("--checkpoint", help="name to record progress under, to resume an interrupted import")
+    import_cmd.add_argument("--workers", type=int, default=0, help="parse JSONL in this many processes")
+    export_cmd = commands.add_parser("export", help="export articles to a file ('-' for stdout)")
+    export_cmd.add_argument("path")
+    export_cmd.add_argument("--format", choices=FORMATS)
+    args = parser.parse_args(argv)
+
+    if args.db:
+        database_utils.configure_pool(db_file=args.db)
+
+    def progress(report):
+        print(f"\r{report.rows:,} rows ({report.rows_per_second:,.0f} rows/s)", end="", file=sys.stderr)
+
+    if args.command == "import":
+        report = import_articles(args.path, args.format, args.chunk_size, args.checkpoint, args.workers, progress)
+    else:
+        report = export_articles(args.path, args.format, progress=progress)
+    print(f"\r{args.command}ed {report.rows:,} rows in {report.seconds:.1f}s "
+          f"({report.rows_per_second:,.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Single-writer queue with group commit.
+
+Concurrent save() calls each committing on their own connection fight over
+SQLite's write lock. With a WriteQueue configured, save() hands the object
+to one writer thread instead and waits: the writer drains whatever has been
+queued (up to max_batch objects) and writes it all in one Session flush,
+i.e. one transaction and one commit. Saves queue up while a commit is in
+progress, so batches grow with the number of producers. max_delay adds a
+window (in seconds) to wait for more writes; it only pays off for
+producers that submit() without waiting for each result.
+
+    writer.configure(max_batch=500)
+    author.save()                       # now group-committed
+    future = writer.current().submit(magazine)   # or don't wait: Future -> id
+
+If a batch fails, its objects are retried one by one so that only the
+failing write raises. The queue holds at most max_pending objects; producers
+block (backpressure) until there is room. Objects must not be modified
+between submit() and the future completing.
+"""
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from lib import database_utils
+from lib import session as _session
+
+DEFAULT_MAX_BATCH = 500
+DEFAULT_MAX_DELAY = 0.0
+DEFAULT_MAX_PENDING = 10_000
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Owns the writer thread and its dedicated connection; see the module docstring.
+    """
+
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY, max_pending=DEFAULT_MAX_PENDING):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.writes = 0
+        self.commits = 0
+        self.retries = 0
+        self.largest_batch = 0
+        self._queue = queue.Queue(max_pending)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def on_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    # --- Producers ---
+    def submit(self, obj, timeout=None):
+        """
+        Queue obj (an Author, Magazine or Article) for saving and return a
+        Future resolving to its id. Blocks while the queue is full; raises if
+        it is still full after timeout seconds.
+        """
+        if self._closed:
+            raise Exception("Write queue is closed.")
+        future = Future()
+        try:
+            self._queue.put((obj, future), timeout=timeout)
+        except queue.Full:
+            raise Exception(f"Write queue is full ({self.max_pending} pending writes).") from None
+        return future
+
+    def save(self, obj, timeout=None):
+        """
+        submit(obj) and wait for the commit; re-raises the write's error.
+        """
+        self.submit(obj, timeout).result()
+        return obj
+
+    # --- Writer thread ---
+    def _run(self):
+        conn = database_utils.get_pool()._connect()
+        database_utils.bind_thread_connection(conn)
+        try:
+            while True:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._commit(batch)
+                if stop:
+                    return
+        finally:
+            database_utils.bind_thread_connection(None)
+            conn.close()
+
+    def _next_batch(self):
+        # block for the first write, then take whatever else arrives within max_delay
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, batch):
+        try:
+            self._flush(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # isolate the failing write(s): everything else still gets saved
+            self.retries += 1
+            for item in batch:
+                self._commit([item])
+            return
+        for obj, future in batch:
+            future.set_result(obj.id)
+
+    def _flush(self, batch):
+        session = _session.Session()
+        for obj, _ in batch:
+            session.add(obj)
+        session.flush()
+        self.writes += len(batch)
+        self.commits += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+    # --- Lifecycle ---
+    def close(self):
+        """
+        Write everything already queued, then stop the writer thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "writes": self.writes,
+            "commits": self.commits,
+            "writes_per_commit": self.writes / self.commits if self.commits else 0.0,
+            "largest_batch": self.largest_batch,
+            "retries": self.retries,
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def current():
+    """
+    Return the process-wide WriteQueue, or None when saves write directly.
+    """
+    return _queue
+
+
+def configure(max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY, max_pending=DEFAULT_MAX_PENDING):
+    """
+    Route save() through a new process-wide WriteQueue (closing the previous one).
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.close()
+        _queue = WriteQueue(max_batch, max_delay, max_pending)
+        return _queue
+
+
+def disable():
+    """
+    Drain and stop the process-wide WriteQueue; save() writes directly again.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.close()
+            _queue = None
+
+
+atexit.register(disable)
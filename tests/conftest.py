@@ -0,0 +1,18 @@
+import pytest
+from lib import database_utils, identity_map, result_cache, sharding, writer
+
+@pytest.fixture(autouse=True)
+def isolated_db(tmp_path):
+    """
+    Point the models at a fresh database file for every test, instead of the
+    shared magazine.db, so results don't depend on earlier runs.
+    """
+    original = database_utils.DB_FILE
+    database_utils.configure_pool(db_file=str(tmp_path / "magazine.db"))
+    identity_map.configure()
+    result_cache.configure()
+    yield
+    writer.disable()
+    sharding.disable()
+    database_utils.close_pool()
+    database_utils.DB_FILE = original
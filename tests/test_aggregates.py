@@ -1,3 +1,4 @@
+import pytest
 from lib.author import Author
 from lib.magazine import Magazine
 
@@ -26,3 +27,98 @@ def test_magazine_contributing_authors_and_top_publisher():
     # Top publisher should be Global News
     top = Magazine.top_publisher()
     assert top.name == "Global News"
+
+def test_counters_follow_inserts_updates_and_deletes():
+    from lib.database_utils import connection
+    a1 = Author("Counter One").save()
+    a2 = Author("Counter Two").save()
+    m1 = Magazine("Count Weekly", "Stats").save()
+    m2 = Magazine("Count Daily", "Stats").save()
+    arts = [a1.add_article(m1, f"C{i}") for i in range(3)]
+    assert m1.contributing_authors() == [a1]
+    assert Magazine.top_publisher() is m1
+
+    # moving one article drops a1 below the threshold and changes the leader
+    arts[0].magazine = m2
+    arts[0].save()
+    a2.add_article(m2, "Other")
+    a2.add_article(m2, "Another")
+    assert m1.contributing_authors() == []
+    assert Magazine.top_publisher() is m2
+
+    with connection() as conn:
+        conn.execute("DELETE FROM articles WHERE magazine_id = ?", (m2.id,))
+        conn.commit()
+        counts = dict(conn.execute("SELECT magazine_id, article_count FROM magazine_article_counts").fetchall())
+    assert counts == {m1.id: 2}
+
+def test_batch_aggregates_match_per_entity_methods():
+    authors = [Author(f"Batch {i}").save() for i in range(3)]
+    mags = [Magazine(f"Batch Mag {i}", cat).save() for i, cat in enumerate(["Science", "Art", "Science"])]
+    empty = Magazine("Empty Batch", "Art").save()
+    for i, a in enumerate(authors):
+        for m in mags[: i + 1]:
+            for n in range(i + 1):
+                a.add_article(m, f"{a.name} / {m.name} / {n}")
+    topics = Author.topic_areas_for(authors)
+    assert topics == {a: sorted(a.topic_areas()) for a in authors}
+    assert topics[authors[0]] == ["Science"] and topics[authors[1]] == ["Art", "Science"]
+    counts = Magazine.article_counts(mags + [empty])
+    assert counts == {mags[0]: 6, mags[1]: 5, mags[2]: 3, empty: 0}
+    assert Magazine.article_counts()[empty] == 0
+    assert list(Magazine.top_publishers(2).items()) == [(mags[0], 6), (mags[1], 5)]
+    contributing = Magazine.contributing_authors_for(mags + [empty], min_articles=2)
+    assert contributing == {mags[0]: authors[1:], mags[1]: authors[1:], mags[2]: [authors[2]], empty: []}
+    assert contributing[mags[2]] == mags[2].contributing_authors()
+
+def test_batch_aggregates_cost_one_query():
+    from lib import identity_map
+    from lib.database_utils import capture_queries
+    authors = [Author(f"Q{i}").save() for i in range(20)]
+    m = Magazine("Query Budget", "Ops").save()
+    for a in authors:
+        a.add_article(m, "Only one")
+    identity_map.invalidate()
+    with capture_queries() as stats:
+        Author.topic_areas_for(authors)
+        Magazine.article_counts([m])
+    assert stats.count == 2
+    with capture_queries() as stats:
+        Magazine.contributing_authors_for([m], min_articles=1)
+    assert stats.count == 2   # the counters, then one find_many for all authors
+
+def _graph():
+    # a0 and a1 share m0 and m1, a2 only shares m1, a3 writes alone in m2
+    authors = [Author(f"Graph {i}").save() for i in range(4)]
+    mags = [Magazine(f"Graph Mag {i}", "Science").save() for i in range(3)]
+    for a, m in [(0, 0), (0, 1), (0, 1), (1, 0), (1, 1), (2, 1), (3, 2), (2, 0)]:
+        authors[a].add_article(mags[m], f"{a} in {m}")
+    return authors, mags
+
+def _naive_collaborators(author):
+    shared = {}
+    for m in author.magazines():
+        for other in m.contributors():
+            if other != author:
+                shared[other] = shared.get(other, 0) + 1
+    return shared
+
+@pytest.mark.parametrize("shards", [0, 2])
+def test_collaborators_and_related_magazines(tmp_path, shards):
+    from lib import sharding
+    from lib.database_utils import capture_queries
+    if shards:
+        sharding.configure([str(tmp_path / f"g{i}.db") for i in range(shards)], directory=str(tmp_path / "dir.db"))
+    authors, mags = _graph()
+    ranked = authors[0].collaborators()
+    assert ranked == _naive_collaborators(authors[0])
+    assert list(ranked.items()) == [(authors[1], 2), (authors[2], 2)]
+    assert authors[0].collaborators(min_shared=3) == {} and authors[3].collaborators() == {}
+    assert list(mags[1].related_magazines().items()) == [(mags[0], 3)]
+    assert list(mags[0].related_magazines(top_n=1).items()) == [(mags[1], 3)]
+    assert mags[2].related_magazines() == {}
+    if not shards:
+        with capture_queries() as stats:
+            authors[0].collaborators()
+            mags[1].related_magazines()
+        assert stats.count == 2
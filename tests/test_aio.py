@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from lib import aio
+from lib.article import Article
+from lib.author import Author
+from lib.magazine import Magazine
+
+@pytest.fixture
+def executor():
+    ex = aio.configure(workers=2, max_concurrency=4)
+    yield ex
+    aio.shutdown()
+
+def test_async_crud_and_relationships(executor):
+    async def scenario():
+        a = await Author("Async Author").asave()
+        m = await Magazine("Async Weekly", "Concurrency").asave()
+        art = await a.aadd_article(m, "Awaited")
+        assert await Author.afind_by_id(a.id) is a
+        assert [x.title for x in await m.aarticles()] == ["Awaited"]
+        assert await m.acontributors() == [a]
+        loaded = await Article.afind_by_id(art.id)
+        assert await loaded.aauthor() is a and await loaded.amagazine() is m
+        return await Magazine.atop_publisher()
+    assert asyncio.run(scenario()).name == "Async Weekly"
+
+def test_concurrent_calls_overlap(executor):
+    async def scenario():
+        authors = [Author(f"Many {i}") for i in range(10)]
+        await asyncio.gather(*(a.asave() for a in authors))
+        found = await asyncio.gather(*(Author.afind_by_id(a.id) for a in authors))
+        return authors, found
+    authors, found = asyncio.run(scenario())
+    assert found == authors
+
+def test_cancellation_interrupts_running_query():
+    # a single worker: the follow-up call only runs if the first one was interrupted
+    aio.configure(workers=1)
+    slow = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n"
+
+    def run_forever():
+        from lib.database_utils import connection
+        with connection() as conn:
+            return conn.execute(slow).fetchone()
+
+    async def scenario():
+        task = asyncio.ensure_future(aio.run(run_forever))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the worker is free again once the statement was interrupted
+        return await asyncio.wait_for(aio.run(lambda: 42), timeout=5)
+
+    try:
+        assert asyncio.run(scenario()) == 42
+    finally:
+        aio.shutdown()
@@ -27,3 +27,35 @@ def test_update_article_title():
     art.save()
     updated = Article.new_from_db({"id": art.id, "title": "Modern Design", "author_id": a.id, "magazine_id": m.id})
     assert updated.title == "Modern Design"
+
+def test_articles_eager_load_from_join():
+    a = Author("Nora").save()
+    m1 = Magazine("Atlas", "Geography").save()
+    m2 = Magazine("Ledger", "Finance").save()
+    a.add_article(m1, "Rivers")
+    a.add_article(m2, "Bonds")
+    arts = a.articles(eager=True)
+    assert [art.title for art in arts] == ["Rivers", "Bonds"]
+    assert all(art._magazine is not None for art in arts)
+    assert arts[0].magazine is m1 and arts[1].magazine is m2
+    assert all(art.author is a for art in arts)
+
+def test_find_many_preserves_order_and_skips_unknown():
+    a1 = Author("Pia").save()
+    a2 = Author("Quinn").save()
+    assert Author.find_many([a2.id, 10 ** 9, a1.id, a2.id]) == [a2, a1]
+    m = Magazine("Relay", "Sport").save()
+    assert Magazine.find_many([m.id]) == [m]
+
+def test_relationships_are_lazy_by_default():
+    a = Author("Lazy").save()
+    m = Magazine("Lazy Mag", "Sloth").save()
+    art = a.add_article(m, "Later")
+    listed = m.articles()[0]
+    assert listed.magazine is m
+    assert listed._author is None and listed.author_id == a.id
+    assert listed.author is a
+
+    loaded = Article.find_by_id(art.id)
+    assert loaded._author is None and loaded._magazine is None
+    assert Article.find_by_id(art.id, eager=True)._magazine is m
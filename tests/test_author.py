@@ -23,3 +23,10 @@ def test_author_articles_and_magazines():
     assert len(a.articles()) == 2
     magazine_names = [m.name for m in a.magazines()]
     assert "World" in magazine_names and "Techy" in magazine_names
+
+def test_models_use_slots_and_trusted_rows():
+    a = Author.new_from_db((10 ** 6, "Slotted"))
+    assert not hasattr(a, "__dict__")
+    assert a.name == "Slotted" and a.id == 10 ** 6
+    m = Magazine.new_from_db({"id": 10 ** 6, "name": "Slotted Mag", "category": "Memory"})
+    assert not hasattr(m, "__dict__")
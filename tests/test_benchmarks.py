@@ -0,0 +1,30 @@
+import json
+from benchmarks import run
+from benchmarks.datagen import generate
+from lib.author import Author
+from lib.database_utils import fetch_all
+
+def test_datagen_is_deterministic(tmp_path):
+    generate(str(tmp_path / "a.db"), 50, 10, 500, seed=7)
+    first = [len(a.articles()) for a in Author.find_many(range(1, 51))]
+    generate(str(tmp_path / "b.db"), 50, 10, 500, seed=7)
+    second = [len(a.articles()) for a in Author.find_many(range(1, 51))]
+    assert first == second and sum(first) == 500
+    # skewed: the top-ranked author writes far more than the median one
+    assert first[0] > 5 * sorted(first)[25]
+
+def test_benchmark_run_writes_results(tmp_path):
+    out = tmp_path / "results.json"
+    report = run.main(["--db", str(tmp_path / "bench.db"), "--iterations", "5", "--out", str(out)])
+    saved = json.loads(out.read_text())
+    assert saved["benchmarks"].keys() == report["benchmarks"].keys()
+    assert {"p50_ms", "p99_ms", "ops_per_s", "peak_kib"} <= saved["benchmarks"]["Magazine.top_publisher"].keys()
+    # the write benchmarks ran on a throwaway copy: the reused dataset is unchanged
+    assert not fetch_all("SELECT id FROM authors WHERE name LIKE 'Bench %'")
+    assert not fetch_all("SELECT id FROM magazines WHERE name LIKE '% #%'")
+
+def test_benchmark_run_in_memory_mode(tmp_path):
+    db_file = str(tmp_path / "bench.db")
+    report = run.main(["--db", db_file, "--iterations", "5", "--memory", "--only", "Author", "--out", str(tmp_path / "m.json")])
+    assert report["memory"] and "Author.save[insert]" in report["benchmarks"]
+    assert not fetch_all("SELECT id FROM authors WHERE name LIKE 'Bench %'")
@@ -0,0 +1,40 @@
+import pytest
+from lib import sharding
+from lib.article import Article
+from lib.author import Author
+from lib.database_utils import fetch_all
+from lib.magazine import Magazine
+
+def test_bulk_create_assigns_ids():
+    authors = [Author(f"Bulk {i}") for i in range(5)]
+    assert Author.bulk_create(authors, batch_size=2) == 5
+    ids = [a.id for a in authors]
+    assert ids == list(range(ids[0], ids[0] + 5))
+    assert Author.find_by_id(ids[3]).name == "Bulk 3"
+
+def test_bulk_create_accepts_generators():
+    a = Author("Gen Author").save()
+    mags = [Magazine(f"Gen Mag {i}", "Bulk") for i in range(3)]
+    Magazine.bulk_create(iter(mags))
+    articles = (Article(f"Gen {i}", a, mags[i % 3]) for i in range(7))
+    assert Article.bulk_create(articles, batch_size=3) == 7
+    assert sorted(art.title for art in a.articles()) == sorted(f"Gen {i}" for i in range(7))
+
+def test_bulk_create_rejects_unsaved_relations():
+    a = Author("Unsaved Writer")
+    m = Magazine("Unsaved Mag", "Bulk").save()
+    with pytest.raises(Exception):
+        Article.bulk_create([Article("Orphan", a, m)])
+
+def test_failed_bulk_create_leaves_no_ids_behind(tmp_path):
+    sharding.configure([str(tmp_path / f"b{i}.db") for i in range(2)])
+    authors = [Author(f"Rolled back {i}") for i in range(3)]
+    saved = Author("Already saved").save()
+    with pytest.raises(Exception, match="unsaved Author"):
+        Author.bulk_create([*authors, saved], batch_size=3)
+    assert [a.id for a in authors] == [None, None, None]
+    assert fetch_all("SELECT COUNT(*) FROM authors")[0][0] == 1
+    # nothing reached the shard replicas either
+    [rows] = sharding.gather(1, fetch_all, "SELECT COUNT(*) FROM authors")
+    assert rows[0][0] == 1
+    assert Author.bulk_create(authors) == 3 and all(a.id for a in authors)
@@ -0,0 +1,34 @@
+import pytest
+from lib.database_utils import ConnectionPool, connection, get_pool
+
+def test_pool_reuses_connections(tmp_path):
+    pool = ConnectionPool(db_file=str(tmp_path / "pool.db"), size=2)
+    conn = pool.acquire()
+    conn.close()
+    assert pool.acquire() is conn
+    pool.close()
+
+def test_pool_size_and_idle_eviction(tmp_path):
+    pool = ConnectionPool(db_file=str(tmp_path / "pool.db"), size=1, idle_timeout=0)
+    c1, c2 = pool.acquire(), pool.acquire()
+    c1.close()
+    c2.close()
+    assert pool.idle_count == 1
+    # idle_timeout=0 evicts the idle connection on the next checkout
+    assert pool.acquire() is not c1
+    pool.close()
+
+def test_pool_shutdown(tmp_path):
+    pool = ConnectionPool(db_file=str(tmp_path / "pool.db"))
+    pool.acquire().close()
+    pool.close()
+    assert pool.idle_count == 0
+    with pytest.raises(Exception):
+        pool.acquire()
+
+def test_connection_context_returns_to_pool():
+    with connection() as conn:
+        conn.execute("SELECT 1")
+    with connection() as again:
+        assert again is conn
+    assert get_pool().idle_count >= 1
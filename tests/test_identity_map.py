@@ -0,0 +1,49 @@
+from lib import identity_map
+from lib.author import Author
+from lib.magazine import Magazine
+
+def test_find_by_id_returns_same_instance():
+    a = Author("Iris").save()
+    assert Author.find_by_id(a.id) is a
+    m = Magazine("Orbit", "Space").save()
+    assert Magazine.find_by_id(m.id) is m
+
+def test_articles_share_author_instance():
+    a = Author("Omar").save()
+    m = Magazine("Harbor", "Travel").save()
+    a.add_article(m, "Ports")
+    a.add_article(m, "Piers")
+    arts = a.articles()
+    assert all(art.author is a and art.magazine is m for art in arts)
+
+def test_invalidate_and_stats():
+    a = Author("Uma").save()
+    identity_map.invalidate(Author, a.id)
+    fetched = Author.find_by_id(a.id)
+    assert fetched is not a and fetched.name == "Uma"
+    stats = identity_map.process_map().stats()
+    assert stats["hits"] == 0 and stats["misses"] == 1
+    assert Author.find_by_id(a.id) is fetched
+    b = Author("Una").save()
+    identity_map.invalidate(Author, b.id)
+    assert [x.name for x in Author.find_many([a.id, b.id])] == ["Uma", "Una"]
+    stats = identity_map.process_map().stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["hit_rate"] == 0.5
+
+def test_lru_eviction():
+    imap = identity_map.IdentityMap(capacity=2)
+    objs = [Author(f"A{i}", id=i) for i in range(3)]
+    for o in objs:
+        imap.add(o)
+    assert imap.get(Author, 0) is None
+    assert imap.get(Author, 2) is objs[2]
+    assert imap.stats()["hits"] == 1 and imap.stats()["misses"] == 1
+
+def test_session_scope_is_discarded():
+    a = Author("Vic").save()
+    identity_map.invalidate(Author, a.id)
+    with identity_map.identity_scope() as session_map:
+        loaded = Author.find_by_id(a.id)
+        assert Author.find_by_id(a.id) is loaded
+        assert (Author, a.id) in session_map
+    assert (Author, a.id) not in identity_map.process_map()
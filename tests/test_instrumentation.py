@@ -0,0 +1,62 @@
+import pytest
+from lib.author import Author
+from lib.database_utils import add_listener, capture_queries, detect_n_plus_one, query_shape, remove_listener
+from lib.magazine import Magazine
+
+def test_capture_records_sql_rows_and_caller():
+    a = Author("Traced").save()
+    m = Magazine("Traced Mag", "Ops").save()
+    for t in ("One", "Two", "Three"):
+        a.add_article(m, t)
+    with capture_queries() as stats:
+        arts = m.articles()
+    assert stats.count == 1
+    event = stats.events[0]
+    assert event.rows == 3 and event.duration > 0
+    assert event.caller == "Magazine.articles"
+    assert "FROM articles" in event.sql and event.params == (m.id,)
+    assert [x.title for x in arts] == ["One", "Two", "Three"]
+
+def test_query_budget_for_eager_and_lazy_loading():
+    a = Author("Budget").save()
+    m = Magazine("Budget Mag", "Ops").save()
+    for i in range(4):
+        a.add_article(m, f"B{i}")
+    with capture_queries() as stats:
+        arts = a.articles(eager=True)
+        [(x.author.name, x.magazine.name) for x in arts]
+    assert stats.count == 1
+    with capture_queries() as stats:
+        m.contributing_authors()
+        a.magazines()
+    assert {e.caller for e in stats.events} == {"Magazine.contributing_authors", "Author.magazines"}
+
+def test_detector_flags_repeated_shapes():
+    authors = [Author(f"N{i}").save() for i in range(6)]
+    from lib import identity_map
+    identity_map.invalidate()
+    with detect_n_plus_one(threshold=5) as detector:
+        for a in authors:
+            Author.find_by_id(a.id)
+    [(shape, count, callers)] = detector.findings
+    assert count == 6 and callers == ["Author.find_by_id"]
+    identity_map.invalidate()
+    with pytest.raises(Exception):
+        with detect_n_plus_one(threshold=5, raise_on_detect=True):
+            for a in authors:
+                Author.find_by_id(a.id)
+    with detect_n_plus_one(threshold=2) as detector:
+        Author.find_many([a.id for a in authors])
+    assert detector.findings == []
+
+def test_listener_and_shape_normalization():
+    Author("Warm-up").save()   # opens (and migrates) the pooled connection
+    seen = []
+    listener = add_listener(seen.append)
+    try:
+        Author("Listened").save()
+    finally:
+        remove_listener(listener)
+    assert [e.sql for e in seen] == ["INSERT INTO authors (name) VALUES (?)"]
+    assert seen[0].rows == 1
+    assert query_shape("SELECT * FROM t WHERE id IN (?, ?,?)") == "SELECT * FROM t WHERE id IN (?...)"
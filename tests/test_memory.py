@@ -0,0 +1,68 @@
+import asyncio
+import sqlite3
+import time
+import pytest
+from lib import aio, database_utils, identity_map, memory, writer
+from lib.author import Author
+from lib.database_utils import fetch_all
+from lib.magazine import Magazine
+
+@pytest.fixture(autouse=True)
+def back_to_disk():
+    yield
+    memory.disable(snapshot=False)
+
+def _disk_names(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return [r[0] for r in conn.execute("SELECT name FROM authors ORDER BY id")]
+    finally:
+        conn.close()
+
+def test_memory_mode_serves_from_ram_and_snapshots_back():
+    db_file = database_utils.DB_FILE
+    magazine = Magazine("Resident", "Science").save()
+    Author("On disk").save().add_article(magazine, "Loaded")
+    memory.enable()
+    assert database_utils.DB_FILE.startswith("file:")
+    assert [a.name for a in magazine.contributors()] == ["On disk"]
+    Author("In memory").save().add_article(magazine, "Written in RAM")
+    assert len(magazine.articles()) == 2
+    assert _disk_names(db_file) == ["On disk"]
+    assert memory.snapshot() is True and memory.snapshot() is False
+    assert _disk_names(db_file) == ["On disk", "In memory"]
+    Author("Last").save()
+    memory.disable()
+    assert database_utils.DB_FILE == db_file
+    assert [a.name for a in Author.find_many([1, 2, 3])] == ["On disk", "In memory", "Last"]
+
+def test_periodic_snapshots():
+    db_file = database_utils.DB_FILE
+    with pytest.raises(Exception, match="not enabled"):
+        memory.snapshot()
+    mem = memory.enable(snapshot_interval=0.02)
+    Author("Ticked").save()
+    deadline = time.monotonic() + 5
+    while not mem.snapshots and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _disk_names(db_file) == ["Ticked"] and mem.last_error is None
+    with pytest.raises(Exception, match="already enabled"):
+        memory.enable()
+
+def test_write_queue_and_async_threads_follow_the_switch():
+    db_file = database_utils.DB_FILE
+    Author("On disk").save()
+    aio.configure(workers=1)
+    asyncio.run(Author.afind_by_id(1))   # the async worker connects to the file
+    writer.configure()
+    memory.enable()
+    queued = Author("Queued in memory").save()
+    assert fetch_all("SELECT name FROM authors WHERE id = ?", (queued.id,))[0][0] == "Queued in memory"
+    identity_map.invalidate()
+    assert asyncio.run(Author.afind_by_id(queued.id)).name == "Queued in memory"
+    assert _disk_names(db_file) == ["On disk"]
+    memory.disable()
+    assert writer.current() is not None and _disk_names(db_file) == ["On disk", "Queued in memory"]
+    assert Author("Queued on disk").save().id == 3
+    assert _disk_names(db_file)[-1] == "Queued on disk"
+    aio.shutdown()
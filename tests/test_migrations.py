@@ -0,0 +1,36 @@
+import sqlite3
+from lib.migrations import SCHEMA_VERSION, migrate, schema_version
+
+def test_migrate_upgrades_unversioned_database_in_place(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    conn.execute("CREATE TABLE authors (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)")
+    conn.execute("INSERT INTO authors (name) VALUES ('Legacy')")
+    conn.commit()
+    assert migrate(conn) == SCHEMA_VERSION
+    assert schema_version(conn) == SCHEMA_VERSION
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_articles_magazine_author", "idx_articles_author_magazine"} <= indexes
+    assert conn.execute("SELECT name FROM authors").fetchall() == [("Legacy",)]
+
+def test_migrate_skips_ddl_when_current(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "new.db"))
+    migrate(conn)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    migrate(conn)
+    assert statements == ["PRAGMA user_version"]
+
+def test_counter_tables_are_backfilled(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    conn.executescript("""
+        CREATE TABLE authors (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL);
+        CREATE TABLE magazines (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, category TEXT NOT NULL);
+        CREATE TABLE articles (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL,
+                               author_id INTEGER NOT NULL, magazine_id INTEGER NOT NULL);
+        INSERT INTO authors (name) VALUES ('A');
+        INSERT INTO magazines (name, category) VALUES ('M', 'C');
+        INSERT INTO articles (title, author_id, magazine_id) VALUES ('x', 1, 1), ('y', 1, 1);
+    """)
+    migrate(conn)
+    assert conn.execute("SELECT * FROM magazine_article_counts").fetchall() == [(1, 2)]
+    assert conn.execute("SELECT * FROM magazine_author_counts").fetchall() == [(1, 1, 2)]
@@ -0,0 +1,33 @@
+import pytest
+from lib.author import Author
+from lib.database_utils import connection
+from lib.magazine import Magazine
+from lib.pagination import decode_cursor, encode_cursor
+
+def test_articles_page_walks_all_pages():
+    a = Author("Pager").save()
+    m = Magazine("Paged", "Pages").save()
+    created = [a.add_article(m, f"Page {i}") for i in range(5)]
+    seen, cursor = [], None
+    while True:
+        page = m.articles_page(page_size=2, cursor=cursor)
+        seen.extend(page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert [x.id for x in seen] == [x.id for x in created]
+    assert len(a.articles_page(page_size=10).items) == 5
+
+def test_cursor_round_trip_and_validation():
+    assert decode_cursor(encode_cursor(42)) == 42
+    assert decode_cursor(None) == 0
+    with pytest.raises(Exception):
+        decode_cursor("not-a-cursor")
+
+def test_page_query_uses_index():
+    with connection() as conn:
+        plan = " ".join(r["detail"] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM articles WHERE magazine_id = ? AND id > ? ORDER BY id LIMIT 10",
+            (1, 0),
+        ))
+    assert "idx_articles_magazine_id" in plan and "TEMP B-TREE" not in plan
@@ -0,0 +1,75 @@
+import pytest
+from lib import identity_map, query, sharding
+from lib.article import Article
+from lib.author import Author
+from lib.database_utils import capture_queries
+from lib.magazine import Magazine
+
+def _dataset():
+    authors = [Author(f"Query {i}").save() for i in range(3)]
+    mags = [Magazine("Query Science", "Science").save(), Magazine("Query Art", "Art").save()]
+    for n in range(12):
+        authors[n % 3].add_article(mags[n % 2], f"Title {n:02d}")
+    return authors, mags
+
+@pytest.mark.parametrize("shards", [0, 2])
+def test_queries_match_the_fixed_methods(tmp_path, shards):
+    if shards:
+        sharding.configure([str(tmp_path / f"q{i}.db") for i in range(shards)], directory=str(tmp_path / "dir.db"))
+    authors, mags = _dataset()
+    qs = Article.query().where(magazine=mags[0])
+    assert [a.id for a in qs] == [a.id for a in mags[0].articles()]
+    picked = qs.where(author__in=authors[:2]).order_by("-id").limit(3)
+    expected = sorted((a for a in mags[0].articles() if a.author_id in (authors[0].id, authors[1].id)),
+                      key=lambda a: -a.id)[:3]
+    assert [a.id for a in picked] == [a.id for a in expected]
+    assert Article.query().count() == 12 and qs.count() == 6
+    window = Article.query().order_by("-title").offset(2).limit(3).values("title")
+    assert list(window) == [("Title 09",), ("Title 08",), ("Title 07",)]
+    assert Article.query().offset(10).count() == 2 and Article.query().limit(5).count() == 5
+    assert Article.query().where(title__startswith="Title 1").count() == 2
+    assert Article.query().where(title__contains="0").exists()
+    assert not Article.query().where(author__in=[]).exists()
+    assert [m.name for m in Magazine.query().where(category__ne="Art")] == ["Query Science"]
+    assert Author.query().where(name="Query 1").first() is authors[1]
+
+def test_values_only_and_lazy_execution():
+    authors, mags = _dataset()
+    with capture_queries() as stats:
+        qs = Article.query().where(author=authors[0]).order_by("title")
+        narrowed = qs.where(id__gt=0).limit(2)
+    assert stats.count == 0
+    with capture_queries() as stats:
+        values = narrowed.values("id", "title")
+        rows = list(values)
+        assert list(values) == rows   # results are kept after the first run
+        assert len(narrowed) == 2 and len(narrowed) == 2
+    assert stats.count == 2 and rows[0][1] == "Title 00" and isinstance(rows[0], tuple)
+    article = Article.query().only("title").where(magazine=mags[1]).first()
+    assert article.title == "Title 01" and article.author_id is None
+    # partial instances save only what changed; the columns left out stay as they are
+    identity_map.invalidate()
+    partial = Magazine.query().only("name").where(id=mags[1].id).first()
+    assert partial.category is None
+    partial.name = "Query Art Renamed"
+    partial.save()
+    assert Magazine.query().where(id=mags[1].id).values("name", "category").first() == ("Query Art Renamed", "Art")
+    # ...and never become the canonical instance for their id
+    partial.save()
+    loaded = Magazine.find_by_id(mags[1].id)
+    assert loaded is not partial and (loaded.name, loaded.category) == ("Query Art Renamed", "Art")
+    with pytest.raises(Exception, match="Unknown field"):
+        Article.query().where(colour="red")
+    with pytest.raises(Exception, match="Unknown lookup"):
+        Article.query().where(title__regex="x")
+    with pytest.raises(Exception, match="expects a list of values"):
+        Article.query().where(id__in=5)
+
+def test_compiled_sql_is_cached_by_shape():
+    authors, mags = _dataset()
+    query.compile_sql.cache_clear()
+    for author in authors:
+        list(Article.query().where(author__in=[author, authors[0]]).limit(3))
+    Article.query().where(author__in=authors).limit(1).count()
+    info = query.compile_sql.cache_info()
+    assert info.misses == 3 and info.hits == 2   # rows shape once; count shape and its inner rows shape
@@ -0,0 +1,43 @@
+import io
+import json
+import pytest
+from lib import reports
+from lib.author import Author
+from lib.magazine import Magazine
+
+def _dataset():
+    authors = [Author(f"Reported {i}").save() for i in range(5)]
+    mags = [Magazine(f"Report Mag {i}", ["Science", "Art"][i % 2]).save() for i in range(3)]
+    for n in range(30):
+        authors[n % 5].add_article(mags[n % 3], f"Report {n}")
+    Author("Idle").save()
+    return authors, mags
+
+def test_reports_match_the_model_methods():
+    authors, mags = _dataset()
+    out = []
+    run = reports.generate_reports(out.append, workers=0, chunk_size=2)
+    assert run.reports == 9 and run.chunks == 5
+    by_key = {(r["type"], r["id"]): r for r in out}
+    for a in authors:
+        report = by_key["author", a.id]
+        assert [x["title"] for x in report["articles"]] == [x.title for x in a.articles()]
+        assert [m["id"] for m in report["magazines"]] == [m.id for m in a.magazines()]
+        assert report["topic_areas"] == a.topic_areas()
+    for m in mags:
+        report = by_key["magazine", m.id]
+        assert report["titles"] == m.article_titles()
+        assert sorted(c["id"] for c in report["contributors"]) == sorted(a.id for a in m.contributors())
+        assert report["contributing_authors"] == [a.id for a in m.contributing_authors()]
+    assert by_key["author", 6]["articles"] == [] and by_key["author", 6]["topic_areas"] == []
+
+def test_worker_processes_stream_the_same_reports(tmp_path):
+    _dataset()
+    serial = io.StringIO()
+    reports.generate_reports(reports.jsonl_sink(serial), workers=0, chunk_size=2)
+    out = tmp_path / "reports.jsonl"
+    reports.main([str(out), "--workers", "2", "--chunk-size", "2"])
+    assert out.read_text() == serial.getvalue()
+    assert [json.loads(line)["type"] for line in serial.getvalue().splitlines()].count("magazine") == 3
+    with pytest.raises(Exception, match="Unknown report kind"):
+        reports.generate_reports(print, kinds=["article"])
@@ -0,0 +1,94 @@
+import sqlite3
+from lib import database_utils, result_cache
+from lib.author import Author
+from lib.database_utils import capture_queries
+from lib.magazine import Magazine
+
+def test_cached_results_and_precise_invalidation():
+    ada, bob = Author("Ada").save(), Author("Bob").save()
+    m1 = Magazine("Cached", "Science").save()
+    m2 = Magazine("Elsewhere", "Art").save()
+    ada.add_article(m1, "First")
+    assert m1.contributors() == [ada]
+    with capture_queries() as stats:
+        assert m1.contributors() == [ada] and m1.article_titles() == ["First"]
+        m1.article_titles()
+    assert stats.count == 1   # only article_titles' first call
+    bob.add_article(m2, "Unrelated")
+    with capture_queries() as stats:
+        m1.contributors()
+    assert stats.count == 0
+    bob.add_article(m1, "Second")
+    assert m1.contributors() == [ada, bob] and m1.article_titles() == ["First", "Second"]
+    assert result_cache.stats()["hit_rate"] > 0
+
+def test_writes_invalidate_dependent_entries():
+    ada = Author("Ada").save()
+    m1, m2 = Magazine("One", "Science").save(), Magazine("Two", "Art").save()
+    ada.add_article(m1, "A")
+    assert Magazine.top_publisher() is m1
+    assert [m.name for m in ada.magazines()] == ["One"]
+    ada.add_article(m2, "B")
+    ada.add_article(m2, "C")
+    assert Magazine.top_publisher() is m2
+    assert [m.name for m in ada.magazines()] == ["One", "Two"]
+    returned = ada.magazines()
+    returned.clear()   # callers get a copy
+    assert len(ada.magazines()) == 2
+
+def test_writes_from_other_connections_flush_the_cache():
+    ada = Author("Ada").save()
+    m = Magazine("Watched", "News").save()
+    ada.add_article(m, "Local")
+    assert m.article_titles() == ["Local"]
+    other = sqlite3.connect(database_utils.DB_FILE)
+    other.execute("INSERT INTO articles (title, author_id, magazine_id) VALUES ('Remote', ?, ?)", (ada.id, m.id))
+    other.commit()
+    other.close()
+    assert m.article_titles() == ["Local", "Remote"]
+    assert result_cache.stats()["external_flushes"] == 1
+
+def test_external_write_followed_by_a_local_write_still_flushes():
+    ada = Author("Ada").save()
+    m = Magazine("Watched", "News").save()
+    ada.add_article(m, "Local")
+    assert m.article_titles() == ["Local"]
+    other = sqlite3.connect(database_utils.DB_FILE)
+    other.execute("INSERT INTO articles (title, author_id, magazine_id) VALUES ('Remote', ?, ?)", (ada.id, m.id))
+    other.commit()
+    other.close()
+    Author("Unrelated").save()   # our own commit must not hide the one before it
+    assert m.article_titles() == ["Local", "Remote"]
+    assert result_cache.stats()["external_flushes"] == 1
+
+def test_ttl_capacity_and_disabling():
+    ada = Author("Ada").save()
+    mags = [Magazine(f"M{i}", "News").save() for i in range(3)]
+    for m in mags:
+        ada.add_article(m, "Title")
+    cache = result_cache.configure(capacity=2)
+    for m in mags:
+        m.article_titles()
+    assert len(cache) == 2 and cache.stats()["evictions"] == 1
+    cache = result_cache.configure(ttl=-1)
+    mags[0].article_titles()
+    mags[0].article_titles()
+    assert cache.stats()["expirations"] == 1 and cache.hits == 0
+    result_cache.configure(capacity=0)
+    with capture_queries() as stats:
+        mags[0].article_titles()
+        mags[0].article_titles()
+    assert stats.count == 2
+
+def test_cached_methods_accept_defaults_and_keywords():
+    ada = Author("Ada").save()
+    mags = [Magazine(f"Kw {i}", "Science").save() for i in range(12)]
+    for i, m in enumerate(mags):
+        for n in range(i + 1):
+            ada.add_article(m, f"Kw {i}.{n}")
+    top = Magazine.top_publishers()
+    assert len(top) == 10 and next(iter(top)) is mags[-1]
+    with capture_queries() as stats:
+        assert Magazine.top_publishers(n=10) == top and Magazine.top_publishers(10) == top
+    assert stats.count == 0   # one entry for all three spellings
+    assert list(Magazine.top_publishers(n=2).values()) == [12, 11]
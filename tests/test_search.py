@@ -0,0 +1,68 @@
+import sqlite3
+import pytest
+from lib.article import Article
+from lib.author import Author
+from lib.database_utils import transaction
+from lib.magazine import Magazine
+from lib.migrations import migrate
+
+def _titles(articles):
+    return [a.title for a in articles]
+
+def test_search_filters_and_prefix_queries():
+    ada = Author("Ada").save()
+    bob = Author("Bob").save()
+    science = Magazine("Nature Weekly", "Science").save()
+    business = Magazine("Money Matters", "Business").save()
+    ada.add_article(science, "Climate models explained")
+    bob.add_article(science, "Climbing Everest")
+    ada.add_article(business, "Pricing climate risk")
+    bob.add_article(business, "Quarterly earnings")
+    assert sorted(_titles(Article.search("climate"))) == ["Climate models explained", "Pricing climate risk"]
+    assert _titles(Article.search("climate", category="Science")) == ["Climate models explained"]
+    assert _titles(Article.search("climate", magazine=business)) == ["Pricing climate risk"]
+    assert sorted(_titles(Article.search("clim*", author=bob))) == ["Climbing Everest"]
+    assert len(Article.search("clim*", limit=2)) == 2
+    [hit] = Article.search("earnings", eager=True)
+    assert hit.magazine is business
+
+def test_search_index_follows_updates_and_deletes():
+    a = Author("Editor").save()
+    m = Magazine("Daily", "News").save()
+    art = a.add_article(m, "Old headline")
+    art._title = "Fresh headline"
+    art.save()
+    assert Article.search("old") == []
+    assert [x.id for x in Article.search("fresh")] == [art.id]
+    with transaction() as conn:
+        conn.execute("DELETE FROM articles WHERE id = ?", (art.id,))
+    assert Article.search("headline") == []
+
+def test_search_ranks_best_match_first_and_rejects_bad_queries():
+    a = Author("Ranker").save()
+    m = Magazine("Ranked", "Science").save()
+    a.add_article(m, "Ocean currents and the deep ocean floor ocean")
+    a.add_article(m, "A long survey of many topics including the ocean and more besides")
+    assert Article.search("ocean")[0].title.startswith("Ocean currents")
+    for bad in ('"unterminated', "ocean AND", "colour: red"):
+        with pytest.raises(Exception, match="invalid search query"):
+            Article.search(bad)
+    # a database failure is not mistaken for a bad query
+    with transaction() as conn:
+        conn.execute("DROP TABLE articles_fts")
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        Article.search("ocean")
+
+def test_migration_backfills_existing_titles(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "legacy.db"))
+    conn.executescript("""
+        CREATE TABLE authors (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL);
+        CREATE TABLE magazines (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, category TEXT NOT NULL);
+        CREATE TABLE articles (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL,
+                               author_id INTEGER NOT NULL, magazine_id INTEGER NOT NULL);
+        INSERT INTO authors (name) VALUES ('Legacy');
+        INSERT INTO magazines (name, category) VALUES ('Old Mag', 'Archive');
+        INSERT INTO articles (title, author_id, magazine_id) VALUES ('Forgotten treasure', 1, 1);
+    """)
+    migrate(conn)
+    assert conn.execute("SELECT rowid FROM articles_fts WHERE articles_fts MATCH 'treasure'").fetchall() == [(1,)]
@@ -0,0 +1,42 @@
+import pytest
+from lib.author import Author
+from lib.database_utils import capture_queries
+from lib.magazine import Magazine
+from lib.session import Session, changed_columns
+
+def test_session_flushes_in_dependency_order():
+    with Session() as session:
+        a = Author("Session Author")
+        m = Magazine("Session Mag", "Ops")
+        art = a.add_article(m, "Deferred")
+        assert art.id is None and set(session.new) == {a, m, art}
+    assert a.id and m.id and art.id
+    assert [x.title for x in a.articles()] == ["Deferred"]
+
+def test_session_tracks_setters_and_changed_columns():
+    m = Magazine("Before", "Cat").save()
+    with Session() as session:
+        m.name = "After"
+        assert session.dirty == [m]
+        assert changed_columns(m) == {"name": "After"}
+    assert changed_columns(m) == {}
+    assert Magazine.find_many([m.id])[0].name == "After"
+
+def test_save_skips_noop_update():
+    m = Magazine("Steady", "Cat").save()
+    assert changed_columns(m) == {}
+    with capture_queries() as stats:
+        assert m.save() is m
+    assert not any(e.shape.startswith("UPDATE") for e in stats.events)
+    m.name = "Steadier"
+    with capture_queries() as stats:
+        m.save()
+    assert [e.shape for e in stats.events] == ["UPDATE magazines SET name = ? WHERE id = ?"]
+
+def test_session_discards_on_error():
+    a = Author("Never Saved")
+    with pytest.raises(RuntimeError):
+        with Session() as session:
+            session.add(a)
+            raise RuntimeError("boom")
+    assert a.id is None
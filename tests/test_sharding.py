@@ -0,0 +1,125 @@
+import sqlite3
+import pytest
+from lib import database_utils, identity_map, sharding
+from lib.article import Article
+from lib.author import Author
+from lib.magazine import Magazine
+from lib.session import Session
+
+def _article_ids(shard_file):
+    conn = sqlite3.connect(shard_file)
+    try:
+        return [r[0] for r in conn.execute("SELECT id FROM articles ORDER BY id")]
+    finally:
+        conn.close()
+
+@pytest.fixture
+def shard_files(tmp_path):
+    files = [str(tmp_path / f"shard{i}.db") for i in range(3)]
+    sharding.configure(files)
+    return files
+
+def test_articles_are_routed_by_magazine(shard_files):
+    ada = Author("Ada").save()
+    mags = [Magazine(f"Mag {i}", "Science").save() for i in range(3)]
+    articles = [ada.add_article(m, f"{m.name} story {n}") for m in mags for n in range(2)]
+    for shard, shard_file in enumerate(shard_files):
+        ids = _article_ids(shard_file)
+        assert ids and all(i % 3 == shard for i in ids)
+        assert ids == sorted(a.id for a in articles if a.magazine_id % 3 == shard)
+    with database_utils.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0] == 0
+    identity_map.invalidate()
+    assert [a.id for a in ada.articles()] == sorted(a.id for a in articles)
+    assert [a.title for a in mags[1].articles()] == ["Mag 1 story 0", "Mag 1 story 1"]
+    assert Article.find_by_id(articles[3].id).title == articles[3].title
+    assert [m.id for m in ada.magazines()] == [m.id for m in mags]
+
+def test_scatter_gather_aggregates(shard_files):
+    a, b = Author("A").save(), Author("B").save()
+    mags = [Magazine(f"Agg {i}", cat).save() for i, cat in enumerate(["Science", "Art", "Food", "Art"])]
+    Article.bulk_create(Article(f"Piece {n}", a, mags[n % 4]) for n in range(10))
+    for n in range(3):
+        b.add_article(mags[3], f"B piece {n}")
+    assert Magazine.top_publisher() is mags[3]
+    assert list(Magazine.top_publishers(2).values()) == [5, 3]
+    assert Magazine.article_counts() == {mags[0]: 3, mags[1]: 3, mags[2]: 2, mags[3]: 5}
+    assert a.topic_areas() == ["Art", "Food", "Science"]
+    assert mags[3].contributing_authors() == [b]
+    page = a.articles_page(page_size=4)
+    rest = a.articles_page(page_size=20, cursor=page.next_cursor)
+    assert [x.id for x in page.items + rest.items] == [x.id for x in a.iter_articles(chunk_size=3)]
+    assert len(Article.search("piece", limit=20)) == 13
+
+def test_session_flush_and_cross_shard_move(shard_files):
+    with Session():
+        author = Author("Session")
+        mags = [Magazine(f"S{i}", "News") for i in range(2)]
+        arts = [Article(f"Flushed {i}", author, mags[i % 2]) for i in range(4)]
+        for art in arts:
+            art.save()
+    assert all(art.id % 3 == art.magazine_id % 3 for art in arts)
+    assert {a.title for a in author.articles()} == {f"Flushed {i}" for i in range(4)}
+    # moving to a magazine on another shard: deleted there, inserted here with a new id
+    old_id = arts[0].id
+    arts[0].magazine = mags[1]
+    arts[0].save()
+    assert arts[0].id != old_id and arts[0].id % 3 == mags[1].id % 3
+    assert Article.find_by_id(old_id) is None
+    assert old_id not in _article_ids(shard_files[mags[0].id % 3])
+    assert [a.title for a in mags[0].articles()] == ["Flushed 2"]
+    assert Magazine.article_counts([mags[0], mags[1]]) == {mags[0]: 1, mags[1]: 3}
+    with Session():
+        arts[1].magazine = mags[0]
+        arts[1].save()
+    assert [a.title for a in mags[0].articles()] == ["Flushed 2", "Flushed 1"]
+    assert Article.search("flushed", magazine=mags[1])[0].magazine_id == mags[1].id
+
+def test_ids_of_moved_articles_are_never_reused(shard_files):
+    author = Author("Mover").save()
+    home, away = Magazine("Home", "News").save(), Magazine("Away", "News").save()
+    last = [author.add_article(home, f"Home {n}") for n in range(2)][-1]
+    old_id = last.id
+    last.magazine = away
+    last.save()
+    # the moved article had the highest id on its old shard
+    fresh = author.add_article(home, "Home 2")
+    assert fresh.id > old_id and Article.find_by_id(old_id) is None
+    assert old_id not in _article_ids(shard_files[home.id % 3])
+
+def test_split_existing_database(tmp_path):
+    a = Author("Legacy").save()
+    mags = [Magazine(f"Old {i}", "Archive").save() for i in range(4)]
+    old = [a.add_article(m, f"Old article {i}") for i, m in enumerate(mags * 2)]
+    source = database_utils.DB_FILE
+    database_utils.close_pool()
+    files = [str(tmp_path / f"part{i}.db") for i in range(2)]
+    counts = sharding.split(source, str(tmp_path / "directory.db"), files)
+    assert sum(counts.values()) == len(old)
+    sharding.configure(files, directory=str(tmp_path / "directory.db"))
+    identity_map.invalidate()
+    # ids from before the split are found by asking every shard
+    assert Article.find_by_id(old[5].id).title == old[5].title
+    author = Author.find_by_id(a.id)
+    fresh = author.add_article(Magazine.find_by_id(mags[1].id), "After the split")
+    assert fresh.id > max(x.id for x in old) and fresh.id % 2 == mags[1].id % 2
+    assert [x.id for x in author.articles()] == [x.id for x in old] + [fresh.id]
+    with pytest.raises(Exception, match="shard 0 of 2"):
+        sharding.configure(files[:1])
+    moved = [str(tmp_path / f"new{i}.db") for i in range(3)]
+    assert sum(sharding.rebalance(str(tmp_path / "directory.db"), files, moved).values()) == len(old) + 1
+    sharding.configure(moved)
+    identity_map.invalidate()
+    assert [x.title for x in Author.find_by_id(a.id).articles()][-1] == "After the split"
+
+def test_configure_resyncs_edits_made_while_sharding_was_off(shard_files):
+    ada = Author("Ada").save()
+    mag = Magazine("Renamed later", "Science").save()
+    ada.add_article(mag, "Before the rename")
+    sharding.disable()
+    mag.category = "Art"
+    mag.save()
+    sharding.configure(shard_files)
+    identity_map.invalidate()
+    assert ada.topic_areas() == ["Art"]
+    assert ada.articles(eager=True)[0].magazine.category == "Art"
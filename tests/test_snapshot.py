@@ -0,0 +1,42 @@
+import pytest
+from lib import snapshot
+from lib.article import Article
+from lib.author import Author
+from lib.magazine import Magazine
+from lib.snapshot import Snapshot
+
+MODES = [False] + ([True] if snapshot.np is not None else [])
+
+def _dataset():
+    authors = [Author(f"Snap {i}").save() for i in range(4)]
+    mags = [Magazine(f"Snap Mag {i}", ["Science", "Art", "Science"][i]).save() for i in range(3)]
+    Article.bulk_create(
+        Article(f"Snap {n}", authors[n % 4], mags[(n * n) % 3]) for n in range(40)
+    )
+    return authors, mags
+
+@pytest.mark.parametrize("use_numpy", MODES)
+def test_snapshot_aggregates_match_the_models(use_numpy):
+    authors, mags = _dataset()
+    snap = Snapshot.load(use_numpy=use_numpy)
+    assert len(snap.article_ids) == 40 and snap.magazine_category(mags[1].id) == "Art"
+    assert snap.top_publisher() == Magazine.top_publisher().id
+    assert snap.top_publishers(3) == [(m.id, c) for m, c in Magazine.top_publishers(3).items()]
+    assert snap.article_counts() == {m.id: c for m, c in Magazine.article_counts().items()}
+    expected = Magazine.contributing_authors_for(mags, min_articles=3)
+    assert snap.contributing_authors(3) == {m.id: [a.id for a in found] for m, found in expected.items() if found}
+    assert snap.topic_areas() == {a.id: cats for a, cats in Author.topic_areas_for(authors).items()}
+    histogram = snap.author_category_histogram()
+    assert sum(sum(h.values()) for h in histogram.values()) == 40
+
+def test_snapshot_refresh_is_incremental():
+    authors, mags = _dataset()
+    snap = Snapshot.load(use_numpy=False)
+    assert snap.refresh() == 0
+    newcomer = Author("Late").save()
+    newcomer.add_article(mags[2], "Late entry")
+    assert snap.refresh() == 2
+    assert snap.author_name(newcomer.id) == "Late"
+    assert snap.topic_areas()[newcomer.id] == ["Science"]
+    with pytest.raises(Exception):
+        snap.author_name(10 ** 9)
@@ -0,0 +1,26 @@
+from lib.author import Author
+from lib.database_utils import get_pool
+from lib.magazine import Magazine
+
+def test_iter_methods_match_list_methods():
+    a1 = Author("Stream One").save()
+    a2 = Author("Stream Two").save()
+    m = Magazine("Stream Weekly", "Streams").save()
+    for i in range(5):
+        (a1 if i % 2 else a2).add_article(m, f"Part {i}")
+    assert [x.id for x in m.iter_articles(chunk_size=2)] == [x.id for x in m.articles()]
+    assert list(m.iter_titles(chunk_size=2)) == m.article_titles()
+    assert set(m.iter_contributors(chunk_size=1)) == {a1, a2}
+    assert [x.title for x in a1.iter_articles(chunk_size=1)] == ["Part 1", "Part 3"]
+
+def test_abandoned_generator_returns_connection():
+    a = Author("Stream Three").save()
+    m = Magazine("Stream Daily", "Streams").save()
+    a.add_article(m, "Only")
+    a.add_article(m, "Two")
+    pool = get_pool()
+    titles = m.iter_titles(chunk_size=1)
+    next(titles)
+    held = pool.idle_count
+    titles.close()
+    assert pool.idle_count == held + 1
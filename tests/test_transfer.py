@@ -0,0 +1,103 @@
+import csv
+import json
+import pytest
+from lib import sharding, transfer
+from lib.article import Article
+from lib.author import Author
+from lib.magazine import Magazine
+from lib.database_utils import fetch_all
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for title, author, magazine, category in records:
+            f.write(json.dumps({"title": title, "author": author, "magazine": magazine, "category": category}) + "\n")
+
+def _write(path, records):
+    if str(path).endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(transfer.FIELDS)
+            writer.writerows(records)
+    else:
+        _write_jsonl(path, records)
+
+RECORDS = [(f"Imported {n}", f"Writer {n % 3}", f"Journal {n % 2}", "Science") for n in range(10)]
+
+def _table():
+    return fetch_all("""
+        SELECT a.title, au.name, m.name, m.category FROM articles a
+        JOIN authors au ON au.id = a.author_id JOIN magazines m ON m.id = a.magazine_id
+        ORDER BY a.id
+    """)
+
+@pytest.mark.parametrize("format", ["csv", "jsonl"])
+def test_import_then_export_round_trips(tmp_path, format):
+    existing = Author("Writer 0").save()
+    source = tmp_path / f"in.{format}"
+    _write(source, RECORDS)
+    report = transfer.import_articles(str(source), chunk_size=4)
+    assert report.rows == 10 and report.rows_per_second > 0
+    assert [tuple(r) for r in _table()] == RECORDS
+    # names resolve to one row each, reusing the author that already existed
+    assert fetch_all("SELECT COUNT(*) FROM authors")[0][0] == 3
+    assert fetch_all("SELECT COUNT(*) FROM magazines")[0][0] == 2
+    assert len(existing.articles()) == 4
+
+    dump = tmp_path / f"out.{format}"
+    assert transfer.export_articles(str(dump)).rows == 10
+    with open(dump, newline="", encoding="utf-8") as f:
+        assert list(transfer.read_records(f, format)) == RECORDS
+
+def test_import_resumes_from_checkpoint(tmp_path):
+    source = tmp_path / "in.jsonl"
+    _write_jsonl(source, RECORDS[:6])
+    with open(source, "a", encoding="utf-8") as f:
+        f.write("{not json\n")
+    checkpoint = "nightly"
+    with pytest.raises(Exception, match="Record 7"):
+        transfer.import_articles(str(source), chunk_size=3, checkpoint=checkpoint)
+    assert fetch_all("SELECT COUNT(*) FROM articles")[0][0] == 6
+    # progress is committed with the rows it counts
+    assert transfer.read_checkpoint(checkpoint, str(source)) == 6
+    assert tuple(fetch_all("SELECT name, rows FROM import_checkpoints")[0]) == ("nightly", 6)
+
+    _write_jsonl(source, RECORDS)
+    report = transfer.import_articles(str(source), chunk_size=4, checkpoint=checkpoint)
+    assert (report.skipped, report.rows) == (6, 4)
+    assert [tuple(r) for r in _table()] == RECORDS
+    with pytest.raises(Exception, match="belongs to"):
+        transfer.import_articles(str(tmp_path / "other.jsonl"), checkpoint=checkpoint)
+
+def test_import_parses_in_worker_processes_and_into_shards(tmp_path):
+    sharding.configure([str(tmp_path / f"shard{i}.db") for i in range(2)])
+    source = tmp_path / "in.jsonl"
+    _write_jsonl(source, RECORDS)
+    assert transfer.import_articles(str(source), chunk_size=3, workers=2, checkpoint="sharded").rows == 10
+    assert transfer.read_checkpoint("sharded", str(source)) == 10
+    assert sorted(a.title for a in Article.select_where("1 = 1")) == sorted(r[0] for r in RECORDS)
+    assert {m.name: c for m, c in Magazine.article_counts().items()} == {"Journal 0": 5, "Journal 1": 5}
+    with pytest.raises(Exception, match="JSONL"):
+        transfer.import_articles(str(tmp_path / "in.csv"), workers=2)
+
+def test_worker_parsing_keeps_a_bounded_number_of_chunks_in_flight():
+    read = 0
+
+    def lines():
+        nonlocal read
+        for n in range(1000):
+            read += 1
+            yield json.dumps({"title": f"T{n}", "author": "A", "magazine": "M", "category": "C"}) + "\n"
+
+    window = 2 * transfer._IN_FLIGHT_PER_WORKER * 10
+    chunks = transfer._record_chunks(lines(), "jsonl", chunk_size=10, workers=2)
+    for expected in range(5):
+        assert next(chunks)[0][0] == f"T{expected * 10}"
+        assert read <= window + expected * 10
+    chunks.close()
+
+def test_cli_exports(tmp_path, capsys):
+    Author("Cli").save().add_article(Magazine("Cli Mag", "Art").save(), "Via the CLI")
+    dump = tmp_path / "dump.csv"
+    transfer.main(["export", str(dump)])
+    assert "exported 1 rows" in capsys.readouterr().err
+    assert dump.read_text().splitlines() == ["title,author,magazine,category", "Via the CLI,Cli,Cli Mag,Art"]
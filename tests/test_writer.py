@@ -0,0 +1,81 @@
+import threading
+import pytest
+from lib import identity_map, writer
+from lib.article import Article
+from lib.author import Author
+from lib.magazine import Magazine
+from lib.database_utils import fetch_all, transaction
+
+def test_concurrent_saves_are_group_committed():
+    queue = writer.configure(max_delay=0.02)
+    magazine = Magazine("Queued", "Science").save()
+
+    def produce(n):
+        for i in range(20):
+            author = Author(f"Producer {n}-{i}").save()
+            assert author.id is not None
+            author.add_article(magazine, f"Queued {n}-{i}")
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert fetch_all("SELECT COUNT(*) FROM articles")[0][0] == 160
+    stats = queue.stats()
+    assert stats["writes"] == 321 and stats["commits"] < stats["writes"]
+
+def test_failed_write_only_fails_its_own_future():
+    queue = writer.configure(max_delay=0.05)
+    magazine = Magazine("Queued", "Art").save()
+    good = queue.submit(Author("Fine"))
+    bad = queue.submit(Article("Orphan", Author._from_row(9999, "Ghost"), magazine))
+    assert isinstance(good.result(), int)
+    with pytest.raises(Exception, match="FOREIGN KEY"):
+        bad.result()
+    assert fetch_all("SELECT name FROM authors")[0][0] == "Fine"
+
+def test_full_queue_applies_backpressure(monkeypatch):
+    queue = writer.configure(max_pending=1, max_delay=0)
+    release = threading.Event()
+    flush = queue._flush
+    monkeypatch.setattr(queue, "_flush", lambda batch: (release.wait(), flush(batch)))
+    first = queue.submit(Author("One"))      # taken by the (stalled) writer
+    while queue.stats()["pending"]:
+        pass
+    second = queue.submit(Author("Two"))     # fills the queue
+    with pytest.raises(Exception, match="full"):
+        queue.submit(Author("Three"), timeout=0.05)
+    release.set()
+    assert first.result() and second.result()
+    writer.disable()
+    assert writer.current() is None and Author("Direct").save().id is not None
+
+def test_save_inside_a_transaction_writes_directly():
+    queue = writer.configure()
+    with transaction() as conn:
+        conn.execute("INSERT INTO authors (name) VALUES ('Caller')")
+        joined = Author("Joined").save()   # not queued: this thread holds the write lock
+        assert joined.id is not None
+    assert queue.stats()["writes"] == 0
+    assert [r[0] for r in fetch_all("SELECT name FROM authors ORDER BY id")] == ["Caller", "Joined"]
+    with pytest.raises(RuntimeError):
+        with transaction():
+            Author("Rolled back").save()
+            raise RuntimeError("abort")
+    assert not fetch_all("SELECT id FROM authors WHERE name = 'Rolled back'")
+
+def test_rolled_back_saves_leave_no_ids_or_cached_instances():
+    kept = Magazine("Kept", "Art").save()
+    with pytest.raises(RuntimeError):
+        with transaction():
+            ghost = Author("Ghost").save()
+            kept.name = "Renamed"
+            kept.save()
+            assert identity_map.lookup(Author, ghost.id) is None   # nothing is registered before the commit
+            raise RuntimeError("abort")
+    assert ghost.id is None and identity_map.lookup(Magazine, kept.id) is None
+    real = Author("Real").save()
+    assert Author.find_by_id(real.id) is real and Magazine.find_by_id(kept.id).name == "Kept"
+    with pytest.raises(Exception, match="must be saved"):
+        ghost.add_article(kept, "Haunted")